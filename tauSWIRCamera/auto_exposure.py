@@ -0,0 +1,159 @@
+import time
+
+import numpy as np
+
+from histogram import frameHistogram
+
+
+### SOFTWARE AUTO-EXPOSURE ###
+# The setup script disables the Tau auto-exposure ("set-auto-exposure", False) and the
+# notebooks pick the integration time by hand. autoExposure closes the loop on the frame
+# stream instead:
+#   - the exact histogram (histogram.frameHistogram) of a few subsampled frames gives the
+#     level of a target percentile
+#   - the signal above the bias scales linearly with the integration time, so the new
+#     integration time is computed in one step: t * (target - bias) / (level - bias).
+#     When the percentile is saturated the scale is unknown and the time is divided by
+#     `backoff` instead. When the time falls outside [minIntTime_ms, frame period] the
+#     gain is changed as well, scaling with the conversion gains (e-/DN) of the noise model
+#   - gain and integration time are written with one configure call (one batch, one round
+#     trip), and not at all while the level is within `tolerance` of the target
+#   - fencing: the frames already queued on the stream (socket and acquisition server
+#     buffer, up to 100 MB) when the new settings took effect were exposed with the old
+#     ones. The row timestamps count the acquisition server clock, which has no known
+#     relation to the host clock, so the queue is drained by arrival time instead: frames
+#     arriving less than queuedFraction of a frame period after the previous one come
+#     from the queue and are skipped (at most maxDrainFrames), then settleFrames more
+#
+#     ae = autoExposure(cam, percentile=99, targetFill=0.7)
+#     ae.run()                                   # converge, then collect as usual
+#     for frame in ae.stream(): ...             # or keep the exposure locked while streaming
+
+class autoExposure(object):
+
+    def __init__(self, cam, percentile=99.0, targetFill=0.7, tolerance=0.05, gains=None, framesPerUpdate=2,
+                 settleFrames=2, backoff=4.0, minIntTime_ms=0.01, step=4, saturationFill=0.98,
+                 queuedFraction=0.5, maxDrainFrames=160):
+        self.cam = cam
+        self.percentile = percentile     # percentile of the frame brought to the target
+        self.targetFill = targetFill     # target level, fraction of the range between bias and full well
+        self.tolerance = tolerance       # relative error of the level accepted without a change
+        self.framesPerUpdate = framesPerUpdate
+        self.settleFrames = settleFrames
+        self.queuedFraction = queuedFraction # arrival interval (fraction of the frame period) of queued frames
+        self.maxDrainFrames = maxDrainFrames # 100 MB of queued 640x512 16 bit frames
+        self.backoff = backoff
+        self.minIntTime_ms = minIntTime_ms
+        self.step = step                 # subsampling of the frames for the histogram
+        self.saturationFill = saturationFill
+        self.fullScale = 2**cam.digitization - 1
+        # Gains allowed, from the largest well (least sensitive) to the smallest
+        gains = gains or list(cam._wellSizes)
+        self.gains = sorted(gains, key=lambda gain: -cam._wellSizes[gain])
+        if not all(hasattr(cam, name) for name in ("fps", "gainMode", "intTime_ms")):
+            state = cam.refresh() # one batch read of the current settings
+            cam.fps, cam.gainMode, cam.intTime_ms = state["fps"], state["gain"], state["int_time_ms"]
+        self._reset()
+        self._draining, self._drained = False, 0
+        self._lastArrival = 0.0
+        self._fence = 0
+        self.fenced = False # whether the last frame given to update was skipped
+        self.lastError = None # relative error of the last measured level
+        self.history = [] # (time, gain, int time (ms), measured level (DN), target (DN))
+
+    def _reset(self):
+        self._hist = frameHistogram(self.cam.digitization)
+
+    def _bias(self, gain):
+        bias = self.cam.noiseModel.bias_DN
+        return float(np.mean(bias[gain] if isinstance(bias, dict) else bias))
+
+    def target(self, gain=None):
+        bias = self._bias(gain or self.cam.gainMode)
+        return bias + self.targetFill*(self.fullScale - bias)
+
+    def maxIntTime_ms(self):
+        # Integrate then read: the integration fits in the frame period
+        return 0.95e3 / self.cam.fps
+
+    def solve(self, level):
+        # (gain, int time) bringing the measured percentile level to the target
+        gain, t = self.cam.gainMode, self.cam.intTime_ms
+        bias = self._bias(gain)
+        if level >= self.saturationFill*self.fullScale:
+            scale = 1/self.backoff
+        else:
+            scale = (self.target(gain) - bias) / max(level - bias, 1.0)
+        # Integration time per electron of signal, then the time that reaches the target at every allowed gain
+        msPerElectron = scale * t / ((self.target(gain) - bias) * self.cam.noiseModel.electronsPerDN(gain))
+        times = {g: msPerElectron * self.cam.noiseModel.electronsPerDN(g) * (self.target(g) - self._bias(g))
+                 for g in self.gains}
+        k = self.gains.index(gain) if gain in self.gains else 0
+        # Keep the gain if possible, else move one gain at a time towards a valid time
+        while times[self.gains[k]] > self.maxIntTime_ms() and k < len(self.gains)-1: k += 1
+        while times[self.gains[k]] < self.minIntTime_ms and k > 0: k -= 1
+        newGain = self.gains[k]
+        return newGain, float(np.clip(times[newGain], self.minIntTime_ms, self.maxIntTime_ms()))
+
+    def update(self, frame):
+        # Adds one streamed frame. Returns True when new settings were applied
+        self.fenced = self._fenced(time.time())
+        if self.fenced:
+            return False
+        self._hist.add(frame[::self.step, ::self.step])
+        if self._hist.nFrames < self.framesPerUpdate:
+            return False
+        level = float(self._hist.percentile(self.percentile))
+        self._reset()
+        target = self.target()
+        self.history.append((time.time(), self.cam.gainMode, self.cam.intTime_ms, level, target))
+        self.lastError = (level - target) / (target - self._bias(self.cam.gainMode))
+        if abs(self.lastError) <= self.tolerance:
+            return False
+        gain, t = self.solve(level)
+        if gain == self.cam.gainMode and abs(t - self.cam.intTime_ms) <= 0.02*self.cam.intTime_ms:
+            return False # at a limit, nothing to change
+        self.cam.configure(gain=gain, int_time_ms=t)
+        self._draining, self._drained = True, 0
+        self._lastArrival = time.time()
+        self._fence = self.settleFrames
+        return True
+
+    def _fenced(self, arrival):
+        # Whether a frame arriving at `arrival` (time.time()) was exposed before the last change
+        if self._draining:
+            queued = arrival - self._lastArrival < self.queuedFraction / self.cam.fps
+            self._lastArrival = arrival
+            if queued and self._drained < self.maxDrainFrames:
+                self._drained += 1
+                return True
+            self._draining = False
+        if self._fence > 0:
+            self._fence -= 1
+            return True
+        return False
+
+    def stream(self, numFrames=None):
+        # Streams frames (cam.iterFrames) with the exposure controlled on the fly; the
+        # frames taken before a change took effect are not yielded
+        for frame in self.cam.iterFrames(numFrames):
+            self.update(frame)
+            if not self.fenced:
+                yield frame
+
+    def run(self, maxFrames=100):
+        # Adjusts the exposure until the level is within tolerance (or stuck at a limit).
+        # Returns (gain, int time (ms), number of frames used)
+        self.lastError = None
+        nChanges = n = 0
+        for n, frame in enumerate(self.cam.iterFrames(maxFrames), 1):
+            measured = len(self.history)
+            changed = self.update(frame)
+            nChanges += changed
+            if len(self.history) > measured and not changed:
+                break # level within tolerance, or at the limit of the settings
+        else:
+            print("WARNING: auto-exposure did not converge")
+        print(f"Auto-exposure: {self.cam.gainMode} gain, {self.cam.intTime_ms:.3f}ms "
+              f"after {nChanges} changes and {n} frames")
+        return self.cam.gainMode, self.cam.intTime_ms, n
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+### BAD PIXEL MAP ###
+# Classifies pixels from the mean and std frames of a bias/dark acquisition, all
+# vectorized (no loop over the outlier coordinates as in the histogram notebooks):
+#   HOT   - mean above   mean + nSigma*std of the frame (same +/-5 sigma rule as the notebooks)
+#   COLD  - mean below   mean - nSigma*std of the frame
+#   NOISY - temporal std above median + nSigma*robust spread of the std frame
+#   DEAD  - temporal std below deadStd (stuck pixel, no temporal noise at all)
+# Maps are uint8 bit flags, so maps from several gains / temperatures merge with a
+# bitwise OR. For the repair, the closest good neighbours of every bad pixel are
+# precomputed once as a flat index table; a frame is then repaired with one gather
+# and one median.
+#
+#     flags = mergeMaps(classifyPixels(mean_low, std_low), classifyPixels(mean_high, std_high))
+#     badIndex, neighbours = neighbourTable(flags != 0)
+#     repairFrame(frame, badIndex, neighbours)
+
+HOT = 1
+COLD = 2
+NOISY = 4
+DEAD = 8
+flagNames = {HOT: "hot", COLD: "cold", NOISY: "noisy", DEAD: "dead"}
+
+def classifyPixels(meanFrame, stdFrame=None, nSigma=5, deadStd=0.5):
+    meanFrame = np.asarray(meanFrame, dtype=np.float64)
+    flags = np.zeros(meanFrame.shape, dtype=np.uint8)
+    mean_value = meanFrame.mean()
+    std_value = meanFrame.std()
+    flags[meanFrame > mean_value + nSigma*std_value] |= HOT
+    flags[meanFrame < mean_value - nSigma*std_value] |= COLD
+    if stdFrame is not None:
+        stdFrame = np.asarray(stdFrame, dtype=np.float64)
+        median = np.median(stdFrame)
+        spread = 1.4826 * np.median(np.abs(stdFrame - median)) # MAD -> sigma, not pulled up by the noisy pixels themselves
+        flags[stdFrame > median + nSigma*spread] |= NOISY
+        flags[stdFrame < deadStd] |= DEAD
+    return flags
+
+def mergeMaps(*maps):
+    merged = np.zeros(np.shape(maps[0]), dtype=np.uint8)
+    for flags in maps:
+        merged |= flags
+    return merged
+
+def countFlags(flags):
+    return {name: int(np.count_nonzero(flags & bit)) for bit, name in flagNames.items()}
+
+def neighbourTable(badMask, nNeighbours=8):
+    # Returns (flat indices of the bad pixels, (nBad, nNeighbours) flat indices of their
+    # closest good pixels). Candidates are taken from square windows of growing radius,
+    # so clusters and edge pixels still get nNeighbours good pixels.
+    badMask = np.asarray(badMask, dtype=bool)
+    rows, cols = badMask.shape
+    badIndex = np.flatnonzero(badMask)
+    nGood = badMask.size - len(badIndex)
+    if len(badIndex) and nGood < nNeighbours:
+        raise ValueError(f"Too few good pixels to repair the bad ones: {nGood} good, {nNeighbours} neighbours needed")
+    table = np.empty((len(badIndex), nNeighbours), dtype=np.intp)
+    todo = np.arange(len(badIndex))
+    radius = 1
+    # With at least nNeighbours good pixels, the window covering the whole frame finds them
+    while len(todo) and radius <= max(rows, cols):
+        # Window offsets sorted by distance (the centre excluded)
+        dr, dc = np.mgrid[-radius:radius+1, -radius:radius+1]
+        dr, dc = dr.ravel(), dc.ravel()
+        order = np.argsort(dr*dr + dc*dc, kind='stable')[1:]
+        dr, dc = dr[order], dc[order]
+        r = badIndex[todo, None] // cols + dr[None, :]
+        c = badIndex[todo, None] % cols + dc[None, :]
+        inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+        candidates = np.where(inside, r*cols + c, 0)
+        good = inside & ~badMask.reshape(-1)[candidates]
+        enough = good.sum(axis=1) >= nNeighbours
+        # First nNeighbours good candidates of each row (stable sort keeps the distance order)
+        first = np.argsort(~good[enough], axis=1, kind='stable')[:, :nNeighbours]
+        table[todo[enough]] = np.take_along_axis(candidates[enough], first, axis=1)
+        todo = todo[~enough]
+        radius += 1
+    return badIndex, table
+
+def repairFrame(frame, badIndex, neighbours, out=None):
+    # Replaces the bad pixels by the median of their neighbours (in place unless out is given)
+    if out is None:
+        out = frame
+    else:
+        np.copyto(out, frame)
+    flat = out.reshape(-1)
+    flat[badIndex] = np.median(flat[neighbours], axis=1)
+    return out
+
+
+### EXPORT ###
+# Compact form: flat indices and flags of the flagged pixels only (a few kB instead
+# of a full frame), plus the frame shape.
+
+def exportMap(flags, path):
+    index = np.flatnonzero(flags)
+    np.savez_compressed(path, shape=np.array(flags.shape), index=index.astype(np.uint32), flags=flags.reshape(-1)[index])
+
+def loadMap(path):
+    data = np.load(path)
+    flags = np.zeros(tuple(data["shape"]), dtype=np.uint8)
+    flags.reshape(-1)[data["index"]] = data["flags"]
+    return flags
+
+def writeOutlierReport(path, meanFrame, stdFrame, flags, mode='w'):
+    # Same table as the dark histogram notebook (num, Pixel_x, Pixel_y, Pixel_Mean, Pixel_Std),
+    # with the flags, written in one call
+    y, x = np.nonzero(flags)
+    counts = countFlags(flags)
+    with open(path, mode) as f:
+        f.write(f'Number of flagged pixels: {len(y)}\n')
+        for name, count in counts.items():
+            f.write(f'Num {name} pixels: {count}\n')
+        f.write('\n')
+        table = np.column_stack([np.arange(1, len(y)+1), x, y, np.asarray(meanFrame)[y, x], np.asarray(stdFrame)[y, x], flags[y, x]])
+        np.savetxt(f, table, fmt=['%d', '%d', '%d', '%.6g', '%.6g', '%d'], delimiter=', ',
+                   header='num, Pixel_x, Pixel_y, Pixel_Mean, Pixel_Std, Flags', comments='')
@@ -0,0 +1,236 @@
+import json
+import os
+import re
+
+import numpy as np
+
+
+### CALIBRATION PRODUCT STORE ###
+# Calibration products (bias/dark mean and std frames, dark current maps, bad
+# pixel masks, ...) keyed by
+#     (camera, product, gain, FPA temp, FPS, integration time)
+# instead of parameters encoded in hundreds of TIFF file names. The store is a
+# directory with a small JSON index and one .npy payload per product, which is
+# memory-mapped on first access, so lookups are a dict access and loading a master
+# does not decode anything. FPS and integration time may be None when they do not
+# apply (the bias frames are stored without either).
+#
+#     store = calibrationStore("calibration_store")
+#     importCalibrationTree(store, "bias_frame")  # one-off import of the existing layout
+#     bias = store.get("CAM1", "bias_mean", "high", 20)
+#     key, dark = store.nearest("CAM1", "dark_mean", "high", 20, intTime_ms=7.5)
+#     key, flat = store.nearest("CAM1", "flat_gain", "high", 20, fps=10, intTime_ms=14)
+
+def _norm(value):
+    return None if value is None else round(float(value), 4)
+
+
+class calibrationStore(object):
+
+    def __init__(self, root):
+        self.root = root
+        self._indexPath = os.path.join(root, "index.json")
+        os.makedirs(os.path.join(root, "arrays"), exist_ok=True)
+        self._index = {}   # key -> {"file": ..., "shape": ..., "dtype": ..., "meta": {...}}
+        self._groups = {}  # (camera, product, gain) -> [key, ...], for the nearest-neighbour queries
+        self._arrays = {}  # key -> memmap, filled on first access
+        if os.path.exists(self._indexPath):
+            with open(self._indexPath) as f:
+                for entry in json.load(f):
+                    self._add(tuple(entry.pop("key")), entry)
+
+    def _key(self, camera, product, gain, fpaTemp, fps=None, intTime_ms=None):
+        return (camera, product, gain, _norm(fpaTemp), _norm(fps), _norm(intTime_ms))
+
+    def _add(self, key, entry):
+        if key not in self._index:
+            self._groups.setdefault(key[:3], []).append(key)
+        self._index[key] = entry
+        self._arrays.pop(key, None)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return self._key(*key) in self._index
+
+    def keys(self):
+        return list(self._index)
+
+    def save(self):
+        tmp = self._indexPath + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump([dict(entry, key=list(key)) for key, entry in self._index.items()], f, indent=1)
+        os.replace(tmp, self._indexPath)
+
+    def put(self, camera, product, gain, fpaTemp, fps, intTime_ms, array, meta=None, save=True):
+        # array=None stores a metadata-only entry (e.g. statistics without their frame)
+        key = self._key(camera, product, gain, fpaTemp, fps, intTime_ms)
+        entry = {"file": None, "shape": None, "dtype": None, "meta": meta or {}}
+        if array is not None:
+            array = np.asarray(array)
+            entry["file"] = re.sub(r"[^A-Za-z0-9_.-]", "_", "_".join("x" if part is None else str(part) for part in key)) + ".npy"
+            entry["shape"], entry["dtype"] = list(array.shape), str(array.dtype)
+            # Write beside the old payload and swap it in: earlier get() results may
+            # still be memmaps of that file and must keep their contents
+            path = os.path.join(self.root, "arrays", entry["file"])
+            with open(path + ".tmp", 'wb') as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+        self._add(key, entry)
+        if save: self.save()
+        return key
+
+    def _load(self, key):
+        if self._index[key]["file"] is None: return None
+        if key not in self._arrays:
+            self._arrays[key] = np.load(os.path.join(self.root, "arrays", self._index[key]["file"]), mmap_mode='r')
+        return self._arrays[key]
+
+    def get(self, camera, product, gain, fpaTemp, fps=None, intTime_ms=None):
+        # Exact lookup, raises KeyError when the product is not in the store
+        return self._load(self._key(camera, product, gain, fpaTemp, fps, intTime_ms))
+
+    def meta(self, camera, product, gain, fpaTemp, fps=None, intTime_ms=None):
+        return self._index[self._key(camera, product, gain, fpaTemp, fps, intTime_ms)]["meta"]
+
+    def nearest(self, camera, product, gain, fpaTemp, fps=None, intTime_ms=None):
+        # Closest stored product of the same camera/product/gain: nearest FPA temperature
+        # first, then nearest integration time, then nearest FPS. Returns (key, array).
+        # fps and intTime_ms are in the order of the key, as in get() and put()
+        keys = self._groups.get((camera, product, gain))
+        if not keys:
+            raise KeyError(f"No {product} for {camera} at {gain} gain")
+        def distance(value, target):
+            if target is None or value is None: return 0.0
+            return abs(value - target)
+        temps = np.array([distance(key[3], fpaTemp) for key in keys])
+        times = np.array([distance(key[5], intTime_ms) for key in keys])
+        rates = np.array([distance(key[4], fps) for key in keys])
+        best = keys[np.lexsort((rates, times, temps))[0]]
+        return best, self._load(best)
+
+
+### IMPORTER FOR THE EXISTING DIRECTORY LAYOUT ###
+# Recognised file names (as written by the bias/dark notebooks):
+#   bias_frame_{gain}_{T}C_{CAM}.tif                                   -> bias_mean
+#   bias_frame_std_{gain}_{T}C_{CAM}.tif                               -> bias_std
+#   bias_frame_statistics_{gain}_{T}C_{CAM}                            -> meta of bias_mean
+#                                                                         (metadata-only entry if the frame is missing)
+#   dark_frame[_std]_{gain}_{T}C_{CAM}_expTime_{t}ms.tif               -> dark_mean / dark_std
+#   {CAM}_{mean|std}_dark_frame_from{N}images_{gain}gain_{T}C_expTime_{t}ms.tif
+#     (inside a {fps}fps folder)                                       -> dark_mean / dark_std
+#   {CAM}_stack_{N}images_{gain}gain_FPA_at{T}C_expTime_{t}ms.tif
+#     (inside a {fps}fps folder, under a folder named flat...)         -> flat_mean (mean of the stack)
+#   {CAM}_{mean|std}_flat_frame_from{N}images_{gain}gain_{T}C_expTime_{t}ms.tif
+#     (inside a {fps}fps folder, as written by stack_batch)            -> flat_mean / flat_std
+# The dark sweeps and the flat field notebook write their stacks under the same names, so
+# under a folder named flat... the dark patterns are ignored.
+# Every flat_mean then gets a flat_gain table (see putFlatGains), used by
+# frame_correction.frameCorrector.fromStore.
+_patterns = [
+    (re.compile(r"^bias_frame_(?P<std>std_)?(?P<gain>low|medium|high)_(?P<T>-?\d+)C_(?P<cam>CAM\d)\.tif$"), "bias"),
+    (re.compile(r"^dark_frame_(?P<std>std_)?(?P<gain>low|medium|high)_(?P<T>-?\d+)C_(?P<cam>CAM\d)_expTime_(?P<t>[0-9.]+)ms\.tif$"), "dark"),
+    (re.compile(r"^(?P<cam>CAM\d)_(?P<stat>mean|std)_dark_frame_from(?P<N>\d+)images_(?P<gain>low|medium|high)gain_(?P<T>-?\d+)C_expTime_(?P<t>[0-9.]+)ms\.tif$"), "dark"),
+    (re.compile(r"^(?P<cam>CAM\d)_(?P<stat>mean|std)_flat_frame_from(?P<N>\d+)images_(?P<gain>low|medium|high)gain_(?P<T>-?\d+)C_expTime_(?P<t>[0-9.]+)ms\.tif$"), "flat"),
+]
+_flatStack = re.compile(r"^(?P<cam>CAM\d)_stack_(?P<N>\d+)images_(?P<gain>low|medium|high)gain_FPA_at(?P<T>-?\d+)C_expTime_(?P<t>[0-9.]+)ms\.tif$")
+_statistics = re.compile(r"^bias_frame_statistics_(?P<gain>low|medium|high)_(?P<T>-?\d+)C_(?P<cam>CAM\d)$")
+
+def isFlatFolder(folder, root):
+    # Flat field data lives under a folder named flat... (e.g. flat_frame/CAM1/10fps)
+    return "flat" in os.path.relpath(folder, root).lower()
+
+def _readStatistics(path):
+    # "Name: value" lines of the statistics files; the per-pixel listings are ignored
+    stats = {}
+    with open(path) as f:
+        for line in f:
+            name, sep, value = line.partition(":")
+            if not sep: continue
+            try:
+                stats[name.strip()] = float(value)
+            except ValueError:
+                continue
+    return stats
+
+def importCalibrationTree(store, root):
+    # Walks `root` and adds every recognised product to the store. Returns the number of products imported.
+    from tifffile import imread
+    imported = 0
+    statistics = []
+    for folder, _, files in os.walk(root):
+        fpsMatch = re.search(r"(\d+)fps$", folder)
+        fps = int(fpsMatch.group(1)) if fpsMatch else None
+        inFlat = isFlatFolder(folder, root)
+        for name in files:
+            path = os.path.join(folder, name)
+            match = _statistics.match(name)
+            if match:
+                statistics.append((match, path))
+                continue
+            match = _flatStack.match(name)
+            if match:
+                # The dark sweeps write stacks under the same name: only the flat field folders are flats
+                if inFlat:
+                    meta = {"source": os.path.relpath(path, root), "numFrames": int(match["N"])}
+                    flat = np.mean(imread(path), axis=0, dtype=np.float64).astype(np.float32)
+                    store.put(match["cam"], "flat_mean", match["gain"], int(match["T"]), fps, float(match["t"]), flat, meta, save=False)
+                    imported += 1
+                continue
+            for pattern, kind in _patterns:
+                match = pattern.match(name)
+                if not match: continue
+                if kind == "dark" and inFlat: break
+                fields = match.groupdict()
+                isStd = bool(fields.get("std")) or fields.get("stat") == "std"
+                product = f"{kind}_{'std' if isStd else 'mean'}"
+                intTime = float(fields["t"]) if fields.get("t") else None
+                meta = {"source": os.path.relpath(path, root)}
+                if fields.get("N"): meta["numFrames"] = int(fields["N"])
+                store.put(fields["cam"], product, fields["gain"], int(fields["T"]), fps, intTime, imread(path), meta, save=False)
+                imported += 1
+                break
+    # Statistics become metadata of the matching bias mean frame
+    for match, path in statistics:
+        key = store._key(match["cam"], "bias_mean", match["gain"], int(match["T"]))
+        if key in store._index:
+            store._index[key]["meta"].update(_readStatistics(path))
+        else:
+            meta = dict(_readStatistics(path), source=os.path.relpath(path, root))
+            store.put(match["cam"], "bias_mean", match["gain"], int(match["T"]), None, None, None, meta, save=False)
+            imported += 1
+    imported += putFlatGains(store, save=False)
+    store.save()
+    return imported
+
+def flatGain(flat, dark):
+    # Flat-field gain table mean(flat - dark) / (flat - dark). Pixels without signal keep a gain of 1
+    # (they are left to the bad pixel repair)
+    signal = np.asarray(flat, dtype=np.float64) - np.asarray(dark, dtype=np.float64)
+    valid = signal > 0
+    gain = np.ones(signal.shape, dtype=np.float32)
+    if np.any(valid):
+        gain[valid] = signal[valid].mean() / signal[valid]
+    return gain
+
+def putFlatGains(store, save=True):
+    # Adds a "flat_gain" table for every "flat_mean" of the store, with the dark master nearest
+    # to the flat's settings (the bias master if there is no dark). Returns the number of tables added
+    added = 0
+    for key in store.keys():
+        camera, product, gain, fpaTemp, fps, intTime_ms = key
+        if product != "flat_mean": continue
+        try:
+            darkKey, dark = store.nearest(camera, "dark_mean", gain, fpaTemp, fps=fps, intTime_ms=intTime_ms)
+        except KeyError:
+            try:
+                darkKey, dark = store.nearest(camera, "bias_mean", gain, fpaTemp)
+            except KeyError:
+                continue
+        if dark is None: continue
+        meta = {"flat": list(key), "dark": list(darkKey)}
+        store.put(camera, "flat_gain", gain, fpaTemp, fps, intTime_ms, flatGain(store.get(*key), dark), meta, save=False)
+        added += 1
+    if save: store.save()
+    return added
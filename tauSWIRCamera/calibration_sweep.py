@@ -0,0 +1,227 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tifffile import imwrite
+
+from tau_commands import (FPA_setPointTemps, gainModes)
+
+
+### CALIBRATION SWEEP ORCHESTRATOR ###
+# Runs a parameter grid (FPA temperature x FPS x gain x integration time) on one
+# or more cameras, replacing the hand-run runDarkFrameAnalysis(...) cells of the
+# dark/flat notebooks.
+#
+# - Ordering: the grid is walked with the most expensive transition outermost
+#   (TEC set point, then FPS, then gain, then integration time), and every inner
+#   level alternates direction (serpentine), so consecutive points share as many
+#   settings as possible, e.g. the last FPS at 20oC is the first FPS at 40oC.
+# - Checkpointing: every completed point is recorded in a JSON file; running the
+#   same sweep again skips what is already done. The outcome of every TEC settle is
+#   recorded too; when a TEC does not settle, the points at that temperature are
+#   skipped (not checkpointed), so they are retried by the next run.
+# - Estimate: the remaining time is computed from per-transition costs, which are
+#   updated with the measured durations as the sweep runs.
+#
+#     sweep = calibrationSweep([cam1, cam2], grid, darkFrameAction(outputDir), "dark_sweep.json")
+#     sweep.run()
+
+sweepLevels = ["fpa_temp", "fps", "gain", "int_time_ms"] # most expensive transition first
+
+defaultTransitionCosts = {
+    "fpa_temp": 45.0,   # s, TEC settle
+    "fps": 1.0,         # s
+    "gain": 0.3,        # s
+    "int_time_ms": 0.3, # s
+}
+
+def validPoint(point):
+    # Integration time must fit in the frame period (same rule as the notebooks)
+    return point["int_time_ms"] < math.floor(1e3/point["fps"])
+
+def validateGrid(grid, maxFPS=60):
+    # Checks every axis up front, so a bad value fails before the sweep starts rather than when it is reached
+    for level in sweepLevels:
+        if level not in grid or len(grid[level]) == 0:
+            raise Exception(f"Sweep grid has no {level} values")
+    for temp in grid["fpa_temp"]:
+        if temp not in FPA_setPointTemps:
+            raise Exception(f"Invalid FPA temperature {temp}. Options: {', '.join(map(str, FPA_setPointTemps))}")
+    for fps in grid["fps"]:
+        if fps != int(fps) or not 0 < fps <= maxFPS:
+            raise Exception(f"Invalid FPS {fps}. Options: integers from 1 to {maxFPS}")
+    for gain in grid["gain"]:
+        if gain not in gainModes:
+            raise Exception("Invalid gain mode. Options: high, medium, low")
+    for t_ms in grid["int_time_ms"]:
+        if not t_ms > 0:
+            raise Exception(f"Invalid integration time {t_ms}ms")
+
+def planSweep(grid, startTemp=None):
+    # grid: {"fpa_temp": [...], "fps": [...], "gain": [...], "int_time_ms": [...]}
+    values = [list(grid[level]) for level in sweepLevels]
+    # Start from the end of the temperature range closest to the current set point
+    values[0].sort()
+    if startTemp is not None and abs(values[0][-1]-startTemp) < abs(values[0][0]-startTemp):
+        values[0].reverse()
+    points = []
+    passes = [0]*len(sweepLevels)
+
+    def walk(level, point):
+        if level == len(sweepLevels):
+            if validPoint(point): points.append(dict(point))
+            return
+        levelValues = values[level] if passes[level] % 2 == 0 else values[level][::-1]
+        passes[level] += 1
+        for value in levelValues:
+            point[sweepLevels[level]] = value
+            walk(level+1, point)
+
+    walk(0, {})
+    return points
+
+def pointKey(point):
+    return "|".join(f"{level}={point[level]}" for level in sweepLevels)
+
+def transitions(previous, point):
+    # Settings that change between two consecutive points. An FPS change resets
+    # the gain (and may clamp the integration time), so those are applied again.
+    if previous is None: return list(sweepLevels)
+    changed = [level for level in sweepLevels if previous[level] != point[level]]
+    if "fps" in changed:
+        changed = [level for level in sweepLevels if level in changed or level in ("gain", "int_time_ms")]
+    return changed
+
+
+class calibrationSweep(object):
+
+    def __init__(self, cams, grid, action, checkpoint, priority="Integration", framesPerPoint=100, startTemp=20,
+                 transitionCosts=None, acquisitionOverhead=1.0):
+        self.cams = cams if isinstance(cams, (list, tuple)) else [cams]
+        validateGrid(grid, min(cam.maxFPS for cam in self.cams))
+        # Plain python values, so the grid can be stored in the checkpoint (e.g. np.linspace(1,30,30))
+        self.grid = {level: [value.item() if hasattr(value, "item") else value for value in grid[level]] for level in sweepLevels}
+        self.action = action                # action(cam, point), called once the settings are applied
+        self.checkpoint = checkpoint        # path of the JSON progress file
+        self.priority = priority
+        self.framesPerPoint = framesPerPoint # only used for the time estimate
+        self.costs = dict(defaultTransitionCosts)
+        self.costs.update(transitionCosts or {})
+        self.acquisitionOverhead = acquisitionOverhead # s per point on top of the frames themselves
+        self.completed = set()
+        self.settles = [] # outcome of every TEC set point change: {"fpa_temp", "time", "results": {camera: reason}}
+        self._loadCheckpoint()
+        self.plan = planSweep(self.grid, startTemp)
+        self._current = None
+
+    ### Checkpoint ###
+    def _loadCheckpoint(self):
+        # Restores the completed points and the learned transition costs
+        if not os.path.exists(self.checkpoint): return
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state["grid"] != self.grid:
+            raise Exception(f"Checkpoint {self.checkpoint} was written for a different grid. Use a new checkpoint file")
+        self.completed = set(state["completed"])
+        self.costs.update(state.get("costs", {}))
+        self.settles = state.get("settles", [])
+
+    def _saveCheckpoint(self):
+        tmp = self.checkpoint + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"grid": self.grid, "completed": sorted(self.completed), "costs": self.costs, "settles": self.settles}, f, indent=1)
+        os.replace(tmp, self.checkpoint)
+
+    @property
+    def remainingPoints(self):
+        return [point for point in self.plan if pointKey(point) not in self.completed]
+
+    ### Time estimate ###
+    def estimate(self, points=None):
+        # Estimated wall time (s) to run the given points (default: all remaining ones)
+        points = self.remainingPoints if points is None else points
+        total = 0.0
+        previous = self._current
+        for point in points:
+            total += sum(self.costs[level] for level in transitions(previous, point))
+            total += self.framesPerPoint/point["fps"] + self.acquisitionOverhead
+            previous = point
+        return total
+
+    def _learn(self, level, duration):
+        # Exponential average of the measured transition cost
+        self.costs[level] = 0.7*self.costs[level] + 0.3*duration
+
+    ### Execution ###
+    def _onAll(self, fn):
+        if len(self.cams) == 1: return [fn(self.cams[0])]
+        with ThreadPoolExecutor(len(self.cams)) as pool:
+            return list(pool.map(fn, self.cams))
+
+    def _apply(self, point):
+        # Returns False when a TEC did not settle (nothing else is applied)
+        changed = transitions(self._current, point)
+        if "fpa_temp" in changed:
+            t0 = time.time()
+            n = FPA_setPointTemps.index(point["fpa_temp"])
+            print(f"Set FPA temp to {point['fpa_temp']}oC")
+            self._onAll(lambda cam: cam.setFPATempSetPoint(n))
+            self._learn("fpa_temp", time.time()-t0)
+            results = {cam.name: cam.tecSettle.reason for cam in self.cams}
+            self.settles.append({"fpa_temp": point["fpa_temp"], "time": time.time(), "results": results})
+            self._saveCheckpoint()
+            if any(reason != "settled" for reason in results.values()):
+                self._current = None # the TEC state is unknown: set everything again at the next point
+                return False
+        settings = {"fps": point["fps"], "gain": point["gain"], "int_time_ms": point["int_time_ms"], "priority": self.priority}
+        settings = {key: value for key, value in settings.items() if key in changed or (key == "priority" and self._current is None)}
+        if settings:
+            t0 = time.time()
+            self._onAll(lambda cam: cam.configure(**settings))
+            duration = time.time()-t0
+            # Attribute the configuration time to the most expensive setting that changed
+            self._learn(next(level for level in sweepLevels if level in settings), duration)
+        self._current = point
+        return True
+
+    def run(self):
+        # Points at an FPA temperature whose TEC settle failed are skipped and not checkpointed,
+        # so running the sweep again retries them. Returns the list of skipped points
+        points = self.remainingPoints
+        print(f"## SWEEP: {len(points)} of {len(self.plan)} points to run, estimated {self.estimate(points)/60:.1f} min ##")
+        failedTemps, skipped = set(), []
+        for k, point in enumerate(points):
+            if point["fpa_temp"] in failedTemps or not self._apply(point):
+                if point["fpa_temp"] not in failedTemps:
+                    print(f"WARNING: TEC did not settle at {point['fpa_temp']}oC ({self.settles[-1]['results']}), "
+                          f"skipping the points at this temperature")
+                failedTemps.add(point["fpa_temp"])
+                skipped.append(point)
+                continue
+            self._onAll(lambda cam: self.action(cam, point))
+            self.completed.add(pointKey(point))
+            self._saveCheckpoint()
+            left = self.estimate(points[k+1:])
+            print(f"Point {k+1}/{len(points)} done ({pointKey(point)}) - est. {left/60:.1f} min left")
+        if skipped:
+            print(f"## SWEEP COMPLETED, {len(skipped)} points skipped (TEC not settled): run again to retry them ##")
+        else:
+            print("## SWEEP COMPLETED ##")
+        return skipped
+
+
+def darkFrameAction(outputDir, N=100, saveStack=True):
+    # Collects N frames and saves the stack, mean and std frames under the names used by the dark frame notebooks
+    def action(cam, point):
+        gain, fpaTemp, fps, t_ms = point["gain"], point["fpa_temp"], point["fps"], point["int_time_ms"]
+        folder = os.path.join(outputDir, cam.name, f"{fps}fps")
+        os.makedirs(folder, exist_ok=True)
+        df_stack = cam.collectFrame(N)
+        if saveStack:
+            imwrite(os.path.join(folder, f'{cam.name}_stack_{N}images_{gain}gain_FPA_at{fpaTemp}C_expTime_{t_ms}ms.tif'), df_stack)
+        imwrite(os.path.join(folder, f'{cam.name}_mean_dark_frame_from{N}images_{gain}gain_{fpaTemp}C_expTime_{t_ms}ms.tif'), np.mean(df_stack, axis=0))
+        imwrite(os.path.join(folder, f'{cam.name}_std_dark_frame_from{N}images_{gain}gain_{fpaTemp}C_expTime_{t_ms}ms.tif'), np.std(df_stack, axis=0))
+    return action
@@ -0,0 +1,77 @@
+import glob
+import os
+import re
+
+import numpy as np
+from tifffile import imread
+
+
+### PER-PIXEL DARK CURRENT / BIAS FIT ###
+# Least-squares line DN = bias + darkCurrent * t for every pixel at once, from the
+# mean dark frames of an integration time sweep. The fit only needs the running
+# sums Sy, Sxy and Syy per pixel, so the frames are streamed one at a time and
+# memory stays at a handful of float64 maps whatever the number of integration
+# times (frames can come from a list, a stack or a generator reading TIFFs).
+
+def fitDarkMaps(intTimes_ms, frames, minR2=0.9, maxResidual=None):
+    # Returns a dict of maps:
+    #   slope     - dark current (DN/ms)
+    #   intercept - bias (DN)
+    #   residual  - rms residual of the fit (DN)
+    #   r2        - coefficient of determination
+    #   good      - fit-quality mask (r2 >= minR2 and residual <= maxResidual,
+    #               maxResidual defaults to 5x the median residual)
+    x = np.asarray(intTimes_ms, dtype=np.float64)
+    n = len(x)
+    if n < 3:
+        raise Exception("At least 3 integration times are needed to fit the dark maps")
+    Sx = x.sum()
+    Sxx = (x*x).sum()
+    Sy = Sxy = Syy = y0 = None
+    count = 0
+    for t, frame in zip(x, frames):
+        frame = np.asarray(frame, dtype=np.float64)
+        if y0 is None:
+            # Sums are taken relative to the first frame to keep Syy well conditioned
+            y0 = frame.copy()
+            Sy = np.zeros_like(y0)
+            Sxy = np.zeros_like(y0)
+            Syy = np.zeros_like(y0)
+        y = frame - y0
+        Sy += y
+        Sxy += t*y
+        y *= y
+        Syy += y
+        count += 1
+    if count != n:
+        raise Exception(f"Got {count} frames for {n} integration times")
+    det = n*Sxx - Sx*Sx
+    slope = (n*Sxy - Sx*Sy) / det
+    intercept = (Sy - slope*Sx) / n
+    rss = np.maximum(Syy - intercept*Sy - slope*Sxy, 0)
+    sstot = Syy - Sy*Sy/n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = np.where(sstot > 0, 1 - rss/sstot, 0.0)
+    residual = np.sqrt(rss/n)
+    intercept += y0
+    if maxResidual is None:
+        maxResidual = 5*np.median(residual)
+    good = (r2 >= minR2) & (residual <= maxResidual)
+    return {"slope": slope, "intercept": intercept, "residual": residual, "r2": r2, "good": good}
+
+def darkCurrentDensity_nA_cm2(slope_DN_per_ms, ePerDN, detectorArea_cm2):
+    # DN/ms -> nA/cm2 (the unit of noiseModel.fromCamera(darkCurrentDensity_nA_cm2=...))
+    electronsPerSecond = slope_DN_per_ms * 1e3 * ePerDN
+    return electronsPerSecond / 6.242e18 / detectorArea_cm2 * 1e9
+
+def loadDarkSweep(folder, camera, gain, fpaTemp, N=100):
+    # Finds the mean dark frames written by the dark frame sweep, e.g.
+    # CAM1_mean_dark_frame_from100images_highgain_20C_expTime_5.0ms.tif
+    # Returns (integration times, generator of frames) sorted by integration time.
+    pattern = os.path.join(folder, f"{camera}_mean_dark_frame_from{N}images_{gain}gain_{fpaTemp}C_expTime_*ms.tif")
+    files = {}
+    for path in glob.glob(pattern):
+        match = re.search(r"_expTime_([0-9.]+)ms\.tif$", path)
+        if match: files[float(match.group(1))] = path
+    intTimes = sorted(files)
+    return np.array(intTimes), (imread(files[t]) for t in intTimes)
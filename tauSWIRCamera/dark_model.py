@@ -0,0 +1,93 @@
+import functools
+
+import numpy as np
+
+from dark_fit import fitDarkMaps
+
+
+### PER-PIXEL DARK FRAME MODEL ###
+# Predicts the dark frame of any (gain, integration time, FPA temperature) from the
+# per-pixel fits of the dark sweeps (dark_fit.fitDarkMaps):
+#     DN(t, T) = bias(T) + darkCurrent(T) * t
+# Between the measured temperatures, the bias is interpolated linearly and the dark
+# current geometrically (dark current grows exponentially with temperature); outside
+# the measured range the nearest pair of temperatures is extrapolated the same way.
+# Predicted frames are kept in an LRU cache keyed by the settings, so the correction
+# path asks for the same frame again at no cost.
+#
+#     model = darkModel.fromStore(store, "CAM1")
+#     dark = model.predict("high", 7.5, 30)
+
+def _round(value):
+    return round(float(value), 4)
+
+
+class darkModel(object):
+
+    def __init__(self, cacheSize=32):
+        self._maps = {} # gain -> {fpaTemp: (slope, intercept)}
+        self._predictCached = functools.lru_cache(maxsize=cacheSize)(self._predict)
+
+    def addFit(self, gain, fpaTemp, slope, intercept):
+        self._maps.setdefault(gain, {})[_round(fpaTemp)] = (np.asarray(slope, dtype=np.float32), np.asarray(intercept, dtype=np.float32))
+        self._predictCached.cache_clear()
+
+    def fitSweep(self, gain, fpaTemp, intTimes_ms, frames, **kwargs):
+        maps = fitDarkMaps(intTimes_ms, frames, **kwargs)
+        self.addFit(gain, fpaTemp, maps["slope"], maps["intercept"])
+        return maps
+
+    @classmethod
+    def fromStore(cls, store, camera, cacheSize=32, fitMissing=True):
+        # Uses the "dark_slope"/"dark_intercept" maps of the store. With fitMissing, the
+        # (gain, temperature) pairs that only have "dark_mean" frames are fitted first and
+        # their maps are saved to the store.
+        model = cls(cacheSize)
+        keys = [key for key in store.keys() if key[0] == camera]
+        fitted = {(key[2], key[3]) for key in keys if key[1] == "dark_slope"}
+        if fitMissing:
+            sweeps = {}
+            for key in keys:
+                if key[1] == "dark_mean" and key[5] is not None and (key[2], key[3]) not in fitted:
+                    sweeps.setdefault((key[2], key[3]), []).append(key)
+            for (gain, fpaTemp), sweep in sweeps.items():
+                if len(sweep) < 3: continue
+                sweep.sort(key=lambda key: key[5])
+                maps = fitDarkMaps([key[5] for key in sweep], (store.get(*key) for key in sweep))
+                store.put(camera, "dark_slope", gain, fpaTemp, None, None, maps["slope"].astype(np.float32), save=False)
+                store.put(camera, "dark_intercept", gain, fpaTemp, None, None, maps["intercept"].astype(np.float32), save=False)
+                fitted.add((gain, fpaTemp))
+            store.save()
+        for gain, fpaTemp in fitted:
+            model.addFit(gain, fpaTemp, store.get(camera, "dark_slope", gain, fpaTemp), store.get(camera, "dark_intercept", gain, fpaTemp))
+        return model
+
+    def predict(self, gain, intTime_ms, fpaTemp):
+        # Read-only float32 frame (shared with the cache, copy it before modifying it)
+        return self._predictCached(gain, _round(intTime_ms), _round(fpaTemp))
+
+    def cacheInfo(self):
+        return self._predictCached.cache_info()
+
+    def _predict(self, gain, intTime_ms, fpaTemp):
+        if gain not in self._maps:
+            raise KeyError(f"No dark fit for {gain} gain")
+        fits = self._maps[gain]
+        temps = sorted(fits)
+        if len(temps) == 1 or fpaTemp in fits:
+            slope, intercept = fits[fpaTemp if fpaTemp in fits else temps[0]]
+        else:
+            # Bracketing pair of measured temperatures (nearest pair outside the range)
+            k = int(np.clip(np.searchsorted(temps, fpaTemp), 1, len(temps)-1))
+            T0, T1 = temps[k-1], temps[k]
+            w = (fpaTemp - T0) / (T1 - T0)
+            s0, b0 = fits[T0]
+            s1, b1 = fits[T1]
+            intercept = b0 + w*(b1 - b0)
+            positive = (s0 > 0) & (s1 > 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                geometric = s0 * np.power(s1/s0, w)
+            slope = np.where(positive, geometric, s0 + w*(s1 - s0))
+        frame = (intercept + slope*np.float32(intTime_ms)).astype(np.float32)
+        frame.flags.writeable = False
+        return frame
@@ -0,0 +1,315 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from ccsdspy import Message
+from raw_data import (loki_cameras, camera_names, frames as rawFrames, pkt_format, process_raw_data, RAW_ROWS)
+
+
+### DATA PATH BENCHMARKS ###
+# Throughput of the acquisition data path on synthetic streams, so changes to it can be
+# compared (the ccsdspy tests only check FixedLength on the hs data):
+#   - syntheticStream builds a realistic byte stream: type-3 row messages (RAW_ROWS rows of
+#     14-bit pixels, every row of every frame) of one loki_cameras camera, type-4
+#     housekeeping messages, split into CCSDS packets (first / continuation / last
+#     segments, optional secondary header), with optional junk bytes injected between
+#     packets (corruption)
+#   - runBenchmarks times Message.decode, _process_message, process_raw_data,
+#     FixedLength.load and tauSWIRcamera.collectFrame against a local socket serving
+#     the stream, and returns MB/s, frames/s (and messages/s) for each
+#   - the results are written as JSON with the platform and git commit, and compared
+#     with an earlier file by compareResults
+#
+#     python data_path_benchmark.py results.json [baseline.json]
+
+MESSAGE_DATA_ROWS = 3
+MESSAGE_HOUSEKEEPING = 4
+CCSDS_MAX_DATA_FIELD = 2048 # bytes after the primary header (the ccsdspy packet buffer size)
+
+# Pixel area of each camera and first row of a frame, as in raw_data.frames
+cameraGeometry = {camera: (entry['frame_buffer']._width, entry['frame_buffer']._height, entry['start'])
+                  for camera, entry in rawFrames.items()}
+
+### SYNTHETIC STREAMS ###
+
+def rowMessage(camera, row, pixels, timestamp=0):
+    # Type-3 message: type, timestamp, camera, row number, 2 spare bytes, pixels, CRC
+    body = (MESSAGE_DATA_ROWS.to_bytes(4, 'little') + int(timestamp).to_bytes(8, 'little')
+            + int(camera).to_bytes(2, 'little') + int(row).to_bytes(2, 'little') + bytes(2) + pixels)
+    return body + zlib.crc32(body).to_bytes(4, 'little')
+
+def housekeepingMessage(queueBytes=0):
+    # Type-4 message with the queue length (bytes) read by _process_message
+    body = MESSAGE_HOUSEKEEPING.to_bytes(4, 'little') + bytes(16) + int(queueBytes).to_bytes(4, 'little') + bytes(40)
+    return body + zlib.crc32(body).to_bytes(4, 'little')
+
+def ccsdsPackets(message, sequenceCount=0, apid=0x100, secondaryHeader=False):
+    # Splits a message into CCSDS packets (the ccsdspy decoder expects an APID in 0x100-0x1FF)
+    payload = CCSDS_MAX_DATA_FIELD - (6 if secondaryHeader else 0)
+    segments = [message[k:k+payload] for k in range(0, len(message), payload)]
+    packets = []
+    for n, segment in enumerate(segments):
+        if len(segments) == 1: flags = 3   # unsegmented
+        elif n == 0: flags = 1             # first segment
+        elif n == len(segments)-1: flags = 2 # last segment
+        else: flags = 0                    # continuation
+        dataField = (bytes(6) if secondaryHeader else b"") + segment
+        header = bytes([(secondaryHeader << 3) | (apid >> 8), apid & 0xFF,
+                        (flags << 6) | ((sequenceCount + n) >> 8 & 0x3F), (sequenceCount + n) & 0xFF])
+        packets.append(header + (len(dataField) - 1).to_bytes(2, 'big') + dataField)
+    return packets
+
+def syntheticStream(camera=loki_cameras.swir, nFrames=4, housekeepingEvery=16, secondaryHeader=False,
+                    corruptionRate=0.0, seed=0):
+    # Byte stream of nFrames frames of one camera, with a housekeeping message every
+    # housekeepingEvery row messages and junk bytes after a fraction corruptionRate of the
+    # packets. Returns (stream bytes, dict with the counts of frames, messages and packets)
+    rng = np.random.default_rng(seed)
+    width, height, start = cameraGeometry[camera]
+    # A few distinct frames, reused (generating the pixels would dominate for large streams)
+    pool = rng.integers(0, 2**14, (min(nFrames, 2), height, width), dtype=np.uint16)
+    chunks, nMessages, nPackets, sequence = [], 0, 0, 0
+    for k in range(nFrames):
+        frame = pool[k % len(pool)]
+        for row in range(start, height, RAW_ROWS):
+            messages = [rowMessage(camera, row, frame[row:row+RAW_ROWS].tobytes(), timestamp=k*height + row)]
+            if housekeepingEvery and (nMessages + 1) % housekeepingEvery == 0:
+                messages.append(housekeepingMessage(rng.integers(0, 2**20)))
+            for message in messages:
+                packets = ccsdsPackets(message, sequence, secondaryHeader=secondaryHeader)
+                sequence = (sequence + len(packets)) % 2**14
+                for packet in packets:
+                    chunks.append(packet)
+                    if corruptionRate and rng.random() < corruptionRate:
+                        # Junk that cannot start a packet header
+                        chunks.append(bytes(int(rng.integers(1, 33))))
+                nMessages += 1
+                nPackets += len(packets)
+    stream = b"".join(chunks)
+    return stream, {"frames": nFrames, "messages": nMessages, "packets": nPackets, "bytes": len(stream),
+                    "frameBytes": width*height*2}
+
+
+class _streamReader(object):
+    # File-like reader of a stream, returning at most `segment` bytes per read (TCP-like
+    # segments when given) and raising EOFError at the end (Message.decode would block)
+
+    def __init__(self, data, segment=None):
+        self._data = memoryview(data)
+        self._pos = 0
+        self._segment = segment
+
+    def read(self, n):
+        if self._pos >= len(self._data):
+            raise EOFError
+        if self._segment: n = min(n, self._segment)
+        chunk = bytes(self._data[self._pos:self._pos+n])
+        self._pos += len(chunk)
+        return chunk
+
+
+def decodeMessages(stream, segment=None):
+    # Every complete message of a stream (bytearrays)
+    messages = []
+    msg = Message(_streamReader(stream, segment))
+    with contextlib.redirect_stderr(io.StringIO()): # the decoder reports every junk chunk
+        try:
+            while True:
+                if msg.decode(): messages.append(msg.buffer)
+        except EOFError:
+            pass
+    return messages
+
+def _resetFrames():
+    for entry in rawFrames.values():
+        entry['started'] = False
+        entry['frame_buffer'].clear()
+
+
+### BENCHMARKS ###
+
+def _timed(function, repeat):
+    # Best time of `repeat` runs (s) and the last result
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+def _rates(seconds, nBytes, nFrames=None, nMessages=None, **extra):
+    result = {"seconds": seconds, "MB_s": nBytes / seconds / 1e6}
+    if nFrames is not None: result["frames_s"] = nFrames / seconds
+    if nMessages is not None: result["messages_s"] = nMessages / seconds
+    result.update(extra)
+    return result
+
+def benchmarkDecode(stream, info, segment=None, repeat=3):
+    seconds, messages = _timed(lambda: decodeMessages(stream, segment), repeat)
+    return _rates(seconds, len(stream), info["frames"], len(messages), messagesDecoded=len(messages),
+                  messagesSent=info["messages"])
+
+def _completeFrames(messages):
+    # Number of frames completed by _process_message over a list of messages
+    from tauSWIRcamera import _process_message
+    _resetFrames()
+    return sum(1 for message in messages if any(name in camera_names.values() for name in _process_message(message)))
+
+def benchmarkCorruptedDecode(stream, info, corruptionRate, repeat=3):
+    # Message.decode on a stream with junk bytes: the rates count the frames that still
+    # decode to complete frames, next to the fraction of messages and frames recovered
+    seconds, messages = _timed(lambda: decodeMessages(stream), repeat)
+    nFrames = _completeFrames(messages)
+    return _rates(seconds, len(stream), nFrames, len(messages), corruptionRate=corruptionRate,
+                  messagesDecoded=len(messages), messagesSent=info["messages"], recovered=len(messages) / info["messages"],
+                  framesDecoded=nFrames, framesSent=info["frames"], framesRecovered=nFrames / info["frames"])
+
+def benchmarkProcessMessage(messages, info, repeat=3):
+    seconds, nFrames = _timed(lambda: _completeFrames(messages), repeat)
+    return _rates(seconds, sum(map(len, messages)), nFrames, len(messages))
+
+def benchmarkProcessRawData(messages, info, repeat=3):
+    rows = [message[4:-4] for message in messages
+            if int.from_bytes(message[0:4], byteorder='little') == MESSAGE_DATA_ROWS]
+    def run():
+        _resetFrames()
+        return sum(1 for row in rows if process_raw_data(row)[0])
+    seconds, nFrames = _timed(run, repeat)
+    return _rates(seconds, sum(map(len, rows)), nFrames, len(rows))
+
+def benchmarkFixedLength(nPackets=100000, repeat=3):
+    # raw_data.pkt_format on one buffer of nPackets headers (vectorized) and on one 12-byte
+    # header at a time (as process_raw_data calls it)
+    rng = np.random.default_rng(0)
+    data = bytearray(rng.integers(0, 256, nPackets*12, dtype=np.uint8).tobytes())
+    batch, _ = _timed(lambda: pkt_format.load(data), repeat)
+    single = [data[k*12:(k+1)*12] for k in range(min(nPackets, 5000))]
+    perRow, _ = _timed(lambda: [pkt_format.load(header) for header in single], repeat)
+    return {"batch": _rates(batch, len(data), nMessages=nPackets),
+            "perRow": _rates(perRow, 12*len(single), nMessages=len(single))}
+
+def _serveStream(stream):
+    # Local TCP server sending the stream in a loop to every connection. Returns (port, stop)
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    stopped = threading.Event()
+    def serve():
+        while not stopped.is_set():
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            with connection:
+                try:
+                    while not stopped.is_set():
+                        connection.sendall(stream)
+                except OSError:
+                    pass # the client closed the stream
+    threading.Thread(target=serve, daemon=True).start()
+    def stop():
+        stopped.set()
+        server.close()
+    return server.getsockname()[1], stop
+
+def benchmarkCollectFrame(stream, info, numFrames=20, repeat=3):
+    # tauSWIRcamera.collectFrame against a local socket serving the stream (SWIR frames),
+    # with the emulated Tau control channel
+    from tauSWIRcamera import tauSWIRcamera
+    from tau_emulator import tauEmulator
+    port, stop = _serveStream(stream)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cam = tauSWIRcamera("127.0.0.1", port, transport=tauEmulator())
+        def run():
+            _resetFrames()
+            return len(cam.collectFrame(numFrames))
+        seconds, nFrames = _timed(run, repeat)
+    finally:
+        stop()
+    # collectFrame skips the first frame: numFrames+1 frames go through the data path
+    nBytes = (numFrames + 1) * info["bytes"] / info["frames"]
+    return _rates(seconds, nBytes, nFrames + 1)
+
+def runBenchmarks(scale=1.0, repeat=3, cameras=None, corruptionRate=0.01):
+    # Returns {benchmark: {camera: rates}}. scale multiplies the stream lengths
+    cameras = cameras or [loki_cameras.visible, loki_cameras.swir, loki_cameras.mwir, loki_cameras.lwir,
+                          loki_cameras.visible_hd]
+    results = {"Message.decode": {}, "Message.decode (TCP segments)": {}, "Message.decode (secondary header)": {},
+               "_process_message": {}, "process_raw_data": {}}
+    for camera in cameras:
+        name = loki_cameras(camera).name
+        width, height, _ = cameraGeometry[camera]
+        nFrames = max(2, int(round(scale * 8 * 640*512 / (width*height))))
+        stream, info = syntheticStream(camera, nFrames)
+        results["Message.decode"][name] = benchmarkDecode(stream, info, repeat=repeat)
+        results["Message.decode (TCP segments)"][name] = benchmarkDecode(stream, info, segment=1448, repeat=repeat)
+        messages = decodeMessages(stream)
+        results["_process_message"][name] = benchmarkProcessMessage(messages, info, repeat)
+        results["process_raw_data"][name] = benchmarkProcessRawData(messages, info, repeat)
+        stream, info = syntheticStream(camera, nFrames, secondaryHeader=True)
+        results["Message.decode (secondary header)"][name] = benchmarkDecode(stream, info, repeat=repeat)
+        print(f"{name}: {results['Message.decode'][name]['MB_s']:.1f} MB/s decode, "
+              f"{results['_process_message'][name]['frames_s']:.1f} frames/s processed")
+    results["FixedLength.load"] = benchmarkFixedLength(int(100000*scale), repeat)
+    stream, info = syntheticStream(loki_cameras.swir, 4)
+    results["collectFrame"] = {"SWIR": benchmarkCollectFrame(stream, info, max(2, int(20*scale)), repeat)}
+    print(f"collectFrame: {results['collectFrame']['SWIR']['frames_s']:.1f} frames/s")
+    # Last: junk in the stream may leave the decoder state changed
+    stream, info = syntheticStream(loki_cameras.swir, max(2, int(8*scale)), corruptionRate=corruptionRate)
+    corrupted = benchmarkCorruptedDecode(stream, info, corruptionRate, repeat)
+    results["Message.decode (corrupted)"] = {"SWIR": corrupted}
+    print(f"Corrupted stream: {corrupted['frames_s']:.1f} frames/s decoded, {corrupted['framesRecovered']:.0%} of the frames "
+          f"and {corrupted['recovered']:.0%} of the messages recovered")
+    return results
+
+
+### RESULTS ###
+
+def _gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def saveResults(path, results):
+    report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _gitCommit(), "python": platform.python_version(),
+              "numpy": np.__version__, "platform": platform.platform(), "processor": platform.processor(),
+              "results": results}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def compareResults(baselinePath, path):
+    # Prints the MB/s ratio (new / baseline) of every benchmark found in both files
+    with open(baselinePath) as f: baseline = json.load(f)["results"]
+    with open(path) as f: results = json.load(f)["results"]
+    ratios = {}
+    for benchmark, cases in results.items():
+        for case, rates in cases.items():
+            old = baseline.get(benchmark, {}).get(case)
+            if old is None: continue
+            ratios[(benchmark, case)] = rates["MB_s"] / old["MB_s"]
+            print(f"{benchmark:36s} {case:10s} {old['MB_s']:9.2f} -> {rates['MB_s']:9.2f} MB/s "
+                  f"(x{ratios[(benchmark, case)]:.2f})")
+    return ratios
+
+
+### MAIN ###
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "data_path_benchmark.json"
+    saveResults(path, runBenchmarks())
+    print(f"Results written to {path}")
+    if len(sys.argv) > 2:
+        compareResults(sys.argv[2], path)
@@ -0,0 +1,189 @@
+import io
+import json
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+### FRAME ARCHIVE ###
+# Single-file archive of 14-bit frames with their metadata:
+#   - pixels bit-packed to 14 bits (4 pixels in 7 bytes, 12.5% smaller than uint16
+#     before any compression), vectorized pack/unpack
+#   - frames grouped in chunks, each optionally zlib-compressed on a thread pool
+#     (zlib releases the GIL) while acquisition continues
+#   - a per-frame metadata table (timestamp, FPA temperature, gain, integration time,
+#     FPS) and the chunk index stored in a footer, so openArchive(path)[k] seeks to and decodes
+#     only the chunk holding frame k
+#
+#     with frameArchiveWriter("dark_20C.tfa") as archive:
+#         for frame in cam.iterFrames(100): archive.append(frame, gain="high", intTime_ms=5, fpaTemp=20)
+#     archive = openArchive("dark_20C.tfa"); archive[10], archive.meta["fpaTemp"]
+#
+# Layout: MAGIC | chunk 0 | chunk 1 | ... | footer (npz: metadata, chunk table, header) | footer offset (8 bytes)
+
+MAGIC = b"TAUARCH1"
+metaFields = [("timestamp", np.float64), ("fpaTemp", np.float32), ("gain", "U6"), ("intTime_ms", np.float32), ("fps", np.float32)]
+
+def pack14(frames):
+    # uint16 pixels (< 2**14) -> bytes, 4 pixels per 7 bytes, little-endian bit order
+    # (the pixel count must be a multiple of 4)
+    frames = np.asarray(frames)
+    if frames.size and (frames.max() >= 2**14 or (frames.dtype.kind != 'u' and frames.min() < 0)):
+        raise Exception(f"Pixel values out of the 14-bit range: {frames.min()} to {frames.max()}")
+    p = np.ascontiguousarray(frames, dtype=np.uint16).reshape(-1, 4)
+    p0, p1, p2, p3 = p[:, 0], p[:, 1], p[:, 2], p[:, 3]
+    out = np.empty((len(p), 7), dtype=np.uint8)
+    out[:, 0] = p0
+    out[:, 1] = (p0 >> 8) | (p1 << 6)
+    out[:, 2] = p1 >> 2
+    out[:, 3] = (p1 >> 10) | (p2 << 4)
+    out[:, 4] = p2 >> 4
+    out[:, 5] = (p2 >> 12) | (p3 << 2)
+    out[:, 6] = p3 >> 6
+    return out.tobytes()
+
+def unpack14(data, count):
+    # Inverse of pack14: returns `count` uint16 pixels
+    b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 7).astype(np.uint16)
+    out = np.empty((len(b), 4), dtype=np.uint16)
+    out[:, 0] = b[:, 0] | ((b[:, 1] & 0x3F) << 8)
+    out[:, 1] = (b[:, 1] >> 6) | (b[:, 2] << 2) | ((b[:, 3] & 0x0F) << 10)
+    out[:, 2] = (b[:, 3] >> 4) | (b[:, 4] << 4) | ((b[:, 5] & 0x03) << 12)
+    out[:, 3] = (b[:, 5] >> 2) | (b[:, 6] << 6)
+    return out.reshape(-1)[:count]
+
+def _encodeChunk(frames, level):
+    data = pack14(frames)
+    return zlib.compress(data, level) if level else data
+
+
+class frameArchiveWriter(object):
+
+    def __init__(self, path, shape=(512, 640), framesPerChunk=16, compressLevel=1, workers=4):
+        if (shape[0]*shape[1]) % 4:
+            raise Exception("The number of pixels per frame must be a multiple of 4")
+        self.path = path
+        self.shape = tuple(shape)
+        self.framesPerChunk = framesPerChunk
+        self.compressLevel = compressLevel # zlib level, 0 = no compression
+        self._file = io.open(path, 'wb')
+        self._file.write(MAGIC)
+        self._pool = ThreadPoolExecutor(workers)
+        self._maxPending = 2*workers # chunks in flight before append blocks (bounds the memory)
+        self._pending = deque()  # chunks being encoded, written in order
+        self._buffer = np.empty((framesPerChunk,) + self.shape, dtype=np.uint16)
+        self._nBuffered = 0
+        self._chunks = []        # (file offset, length)
+        self._meta = []
+
+    def append(self, frame, timestamp=None, fpaTemp=np.nan, gain="", intTime_ms=np.nan, fps=np.nan):
+        self._buffer[self._nBuffered] = frame
+        self._nBuffered += 1
+        self._meta.append((time.time() if timestamp is None else timestamp, fpaTemp, gain, intTime_ms, fps))
+        if self._nBuffered == self.framesPerChunk:
+            self._flushBuffer()
+
+    def _flushBuffer(self):
+        if not self._nBuffered: return
+        frames = self._buffer[:self._nBuffered].copy()
+        self._pending.append(self._pool.submit(_encodeChunk, frames, self.compressLevel))
+        self._nBuffered = 0
+        # Write the chunks that are done, keeping the order
+        while self._pending and (self._pending[0].done() or len(self._pending) > self._maxPending):
+            self._writeChunk(self._pending.popleft().result())
+
+    def _writeChunk(self, data):
+        self._chunks.append((self._file.tell(), len(data)))
+        self._file.write(data)
+
+    def close(self):
+        if self._file.closed: return
+        self._flushBuffer()
+        while self._pending:
+            self._writeChunk(self._pending.popleft().result())
+        self._pool.shutdown()
+        header = {"shape": self.shape, "framesPerChunk": self.framesPerChunk, "compressLevel": self.compressLevel}
+        footer = io.BytesIO()
+        np.savez(footer, meta=np.array(self._meta, dtype=metaFields), chunks=np.array(self._chunks, dtype=np.int64).reshape(-1, 2),
+                 header=np.array(json.dumps(header)))
+        offset = self._file.tell()
+        self._file.write(footer.getvalue())
+        self._file.write(struct.pack('<Q', offset))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class frameArchive(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._file = io.open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise Exception(f"{path} is not a frame archive")
+        self._file.seek(-8, io.SEEK_END)
+        (offset,) = struct.unpack('<Q', self._file.read(8))
+        end = self._file.seek(0, io.SEEK_END) - 8
+        self._file.seek(offset)
+        footer = np.load(io.BytesIO(self._file.read(end - offset)))
+        header = json.loads(str(footer["header"]))
+        self.shape = tuple(header["shape"])
+        self.framesPerChunk = header["framesPerChunk"]
+        self.compressLevel = header["compressLevel"]
+        self.meta = footer["meta"]
+        self._chunks = footer["chunks"]
+        self._cached = (None, None) # last decoded chunk
+
+    def __len__(self):
+        return len(self.meta)
+
+    def _chunk(self, n):
+        if self._cached[0] != n:
+            offset, length = self._chunks[n]
+            self._file.seek(offset)
+            data = self._file.read(length)
+            if self.compressLevel: data = zlib.decompress(data)
+            nFrames = min(self.framesPerChunk, len(self) - n*self.framesPerChunk)
+            pixels = unpack14(data, nFrames*self.shape[0]*self.shape[1])
+            self._cached = (n, pixels.reshape((nFrames,) + self.shape))
+        return self._cached[1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return np.stack([self[k] for k in range(*index.indices(len(self)))])
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self): raise IndexError(index)
+        chunk, slot = divmod(index, self.framesPerChunk)
+        return self._chunk(chunk)[slot]
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def openArchive(path):
+    return frameArchive(path)
+
+def recordFrames(cam, path, numFrames, **writerKwargs):
+    # Streams numFrames frames of a camera into an archive, with the current settings as metadata
+    # (the FPA temperature is read once per chunk)
+    with frameArchiveWriter(path, cam.fpa_size, **writerKwargs) as archive:
+        for k, frame in enumerate(cam.iterFrames(numFrames)):
+            if k % archive.framesPerChunk == 0:
+                fpaTemp = cam.getFPAtemp()
+            archive.append(frame, fpaTemp=fpaTemp, gain=getattr(cam, "gainMode", ""),
+                           intTime_ms=getattr(cam, "intTime_ms", np.nan), fps=getattr(cam, "fps", np.nan))
+    return frameArchive(path)
@@ -0,0 +1,147 @@
+import numpy as np
+
+from bad_pixels import classifyPixels, writeOutlierReport
+
+
+### EXACT 14-BIT HISTOGRAMS ###
+# One integer bin per digital number (2**14 = 16384 bins), accumulated with
+# np.bincount over any number of streamed frames, so the result does not depend on a
+# binning choice and the statistics (mean, std, percentiles, +/-k sigma outliers) are
+# computed exactly from the counts. Optionally one histogram per row and/or per
+# column is kept as well (row/column banding).
+#
+#     hist = frameHistogram(perRow=True)
+#     for frame in cam.collectFrame(100): hist.add(frame)
+#     hist.mean(), hist.std(), hist.percentile([1, 50, 99]), hist.outliers(5)
+
+class frameHistogram(object):
+
+    def __init__(self, bits=14, perRow=False, perColumn=False):
+        self.nBins = 2**bits
+        self.values = np.arange(self.nBins, dtype=np.float64)
+        self.counts = np.zeros(self.nBins, dtype=np.int64)
+        self.perRow = perRow
+        self.perColumn = perColumn
+        self.rowCounts = None    # (rows, nBins)
+        self.columnCounts = None # (columns, nBins)
+        self._offsets = {}
+        self.nFrames = 0
+
+    def _digital(self, frame):
+        frame = np.asarray(frame)
+        if frame.dtype.kind == 'f':
+            # e.g. a mean frame: rounded to the nearest DN
+            frame = np.rint(frame)
+        if frame.dtype != np.uint16:
+            frame = np.clip(frame, 0, self.nBins-1).astype(np.uint16)
+        elif frame.max() >= self.nBins:
+            frame = np.minimum(frame, self.nBins-1)
+        return frame
+
+    def _addLines(self, counts, frames, axis):
+        # Adds the histograms of every row (axis=1) or column (axis=2) of a stack to the
+        # persistent (lines, nBins) counters, in place on the index line*nBins + value.
+        # Only the bins hit are touched: a bincount of the whole table would allocate
+        # and zero lines*nBins counts on every call
+        lines = frames.shape[axis]
+        if counts is None:
+            counts = np.zeros((lines, self.nBins), dtype=np.int64)
+        if axis not in self._offsets:
+            offsets = np.arange(lines, dtype=np.int64) * self.nBins
+            self._offsets[axis] = offsets[:, None] if axis == 1 else offsets[None, :]
+        index = frames + self._offsets[axis]
+        np.add.at(counts.reshape(-1), index.ravel(), 1)
+        return counts
+
+    def add(self, frame, chunk=16):
+        # Adds one frame or a stack of frames to the histograms (stacks are binned
+        # `chunk` frames per bincount)
+        frames = self._digital(frame)
+        if frames.ndim == 2:
+            frames = frames[None]
+        for k in range(0, len(frames), chunk):
+            self._add(frames[k:k+chunk])
+        return self
+
+    def _add(self, frames):
+        self.counts += np.bincount(frames.ravel(), minlength=self.nBins)
+        if self.perRow:
+            self.rowCounts = self._addLines(self.rowCounts, frames, 1)
+        if self.perColumn:
+            self.columnCounts = self._addLines(self.columnCounts, frames, 2)
+        self.nFrames += len(frames)
+
+    def merge(self, other):
+        self.counts += other.counts
+        for name in ("rowCounts", "columnCounts"):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            if theirs is not None:
+                setattr(self, name, theirs.copy() if mine is None else mine + theirs)
+        self.nFrames += other.nFrames
+        return self
+
+    ### Statistics (from the counts) ###
+    def _moments(self, counts):
+        n = counts.sum(axis=-1)
+        mean = (counts @ self.values) / n
+        var = (counts @ (self.values**2)) / n - mean**2
+        return n, mean, np.sqrt(np.maximum(var, 0))
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+    def mean(self):
+        return float(self._moments(self.counts)[1])
+
+    def std(self):
+        return float(self._moments(self.counts)[2])
+
+    def min(self):
+        return int(np.flatnonzero(self.counts)[0])
+
+    def max(self):
+        return int(np.flatnonzero(self.counts)[-1])
+
+    def percentile(self, q):
+        # Lower percentile (the smallest DN with at least q% of the pixels at or below it)
+        cumulative = np.cumsum(self.counts)
+        targets = np.asarray(q, dtype=np.float64) / 100 * cumulative[-1]
+        return np.searchsorted(cumulative, np.maximum(targets, 1), side='left')
+
+    def outliers(self, k=5):
+        # Number of pixels below / above mean -/+ k*std
+        mean, std = self.mean(), self.std()
+        low = self.counts[self.values < mean - k*std].sum()
+        high = self.counts[self.values > mean + k*std].sum()
+        return int(low), int(high)
+
+    def rowStats(self):
+        # (mean, std) of every row
+        return self._moments(self.rowCounts)[1:]
+
+    def columnStats(self):
+        # (mean, std) of every column
+        return self._moments(self.columnCounts)[1:]
+
+
+def writeStatisticsReport(path, meanFrame, stdFrame, nSigma=5):
+    # The bias/dark statistics file of the notebooks, with the distribution statistics
+    # taken from the exact histogram of the mean frame and the outlier table of bad_pixels
+    hist = frameHistogram().add(meanFrame)
+    low, high = hist.outliers(nSigma)
+    p1, p50, p99 = hist.percentile([1, 50, 99])
+    with open(path, 'w') as f:
+        f.write(f'Mean of Mean Frame: {np.mean(meanFrame)}\n')
+        f.write(f'Std of Mean Frame: {np.std(meanFrame)}\n')
+        f.write(f'Mean of Std of Pixels: {np.mean(stdFrame)}\n')
+        f.write(f'Max of Std of Pixels: {np.max(stdFrame)}\n')
+        f.write(f'Min of Std of Pixels: {np.min(stdFrame)}\n')
+        f.write(f'Median of Mean Frame: {p50}\n')
+        f.write(f'1st percentile of Mean Frame: {p1}\n')
+        f.write(f'99th percentile of Mean Frame: {p99}\n')
+        f.write(f'Number of pixels outside +/- {nSigma}sigma range: {low + high}\n')
+        f.write(f'Num hot pixels (>{nSigma}sigma): {high}\n')
+        f.write(f'Num cold pixels (<{nSigma}sigma): {low}\n\n')
+    writeOutlierReport(path, meanFrame, stdFrame, classifyPixels(meanFrame, stdFrame, nSigma), mode='a')
+    return hist
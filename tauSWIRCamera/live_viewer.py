@@ -0,0 +1,195 @@
+import sys
+import threading
+import time
+
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore
+
+from histogram import frameHistogram
+
+
+### LIVE VIEWER ###
+# Replaces the display loop of focus calibration/live_stream.ipynb (one socket per
+# collectFrame(1), frame >> 6, PIL image, display/clear_output: a few fps):
+#   - frameSession keeps one acquisition stream open (tauSWIRcamera.iterFrames) on a
+#     background thread and holds only the newest frame: the display takes the latest
+#     one, frames it did not get to are counted as dropped and never queued
+#   - displayLUT maps 14-bit DN to 8 bits with one table lookup per pixel; the table is
+#     rebuilt from percentiles of the exact histogram of a subsampled frame (auto-contrast)
+#     every few frames only
+#   - liveViewer draws the 8-bit frame in a pyqtgraph ImageItem (fixed levels, no
+#     per-frame autoscaling) with an FPS / dropped frames overlay
+#
+#     python live_viewer.py 129.123.5.125 4000
+#     runViewer(cam)                               # from a session with a camera
+#
+# Runs with QT_QPA_PLATFORM=offscreen as well (e.g. for tests, liveViewer.grab()).
+
+class frameSession(object):
+
+    def __init__(self, cam):
+        self.cam = cam
+        self._lock = threading.Lock()
+        self._frame = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.received = 0   # frames read from the stream
+        self.displayed = 0  # frames taken by latest()
+        self.error = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        frames = self.cam.iterFrames()
+        try:
+            for frame in frames:
+                with self._lock:
+                    self._frame = frame
+                    self.received += 1
+                if self._stop.is_set(): break
+        except Exception as e:
+            self.error = e
+        finally:
+            frames.close() # closes the stream socket
+
+    def latest(self):
+        # Newest frame not returned yet, or None
+        with self._lock:
+            frame, self._frame = self._frame, None
+            if frame is not None: self.displayed += 1
+        return frame
+
+    @property
+    def dropped(self):
+        # Frames replaced by a newer one before they could be displayed
+        return self.received - self.displayed - (self._frame is not None)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class displayLUT(object):
+
+    def __init__(self, bits=14, low=0.5, high=99.5, step=4):
+        self.bits = bits
+        self.low, self.high = low, high # auto-contrast percentiles
+        self.step = step                # subsampling of the frame for the histogram
+        # One entry per uint16 value, so out of range pixels need no clipping (they saturate)
+        self.table = np.full(2**16, 255, dtype=np.uint8)
+        self.levels = None
+        self.setLevels(0, 2**bits - 1)
+
+    def setLevels(self, black, white):
+        black, white = int(black), max(int(white), int(black) + 1)
+        if self.levels == (black, white): return
+        values = np.arange(2**self.bits, dtype=np.float32)
+        self.table[:2**self.bits] = np.clip((values - black) * (255 / (white - black)), 0, 255).astype(np.uint8)
+        self.levels = (black, white)
+
+    def autoContrast(self, frame):
+        hist = frameHistogram(self.bits).add(frame[::self.step, ::self.step])
+        self.setLevels(*hist.percentile([self.low, self.high]))
+
+    def apply(self, frame, out=None):
+        return np.take(self.table, frame, out=out)
+
+
+class liveViewer(object):
+
+    def __init__(self, session, contrastInterval=15, overlayInterval=0.5, title="Tau SWIR live"):
+        self.app = pg.mkQApp(title)
+        self.session = session
+        self.lut = displayLUT()
+        self.contrastInterval = contrastInterval # frames between auto-contrast updates (0: fixed levels)
+        self.overlayInterval = overlayInterval   # s between overlay updates
+        self._image8 = None
+        self._nShown = 0
+        self._rate = (time.perf_counter(), 0, 0)
+        self.displayFPS = 0.0
+        self.cameraFPS = 0.0
+
+        self.window = pg.GraphicsLayoutWidget(title=title)
+        view = self.window.addViewBox(lockAspect=True, invertY=True)
+        self.image = pg.ImageItem(axisOrder='row-major')
+        view.addItem(self.image)
+        self.overlay = pg.TextItem(anchor=(0, 0), color='y', fill=(0, 0, 0, 150))
+        self.overlay.setParentItem(view) # fixed in the view corner (not panned with the image)
+        self._timer = QtCore.QTimer()
+        self._timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self._timer.timeout.connect(self.update)
+
+    def update(self):
+        frame = self.session.latest()
+        if frame is None: return
+        if self._image8 is None or self._image8.shape != frame.shape:
+            self._image8 = np.empty(frame.shape, dtype=np.uint8)
+            self.lut.autoContrast(frame)
+        elif self.contrastInterval and self._nShown % self.contrastInterval == 0:
+            self.lut.autoContrast(frame)
+        self.lut.apply(frame, out=self._image8)
+        self.image.setImage(self._image8, autoLevels=False, levels=(0, 255))
+        self._nShown += 1
+        now = time.perf_counter()
+        t0, shown0, received0 = self._rate
+        if now - t0 >= self.overlayInterval:
+            self.displayFPS = (self._nShown - shown0) / (now - t0)
+            self.cameraFPS = (self.session.received - received0) / (now - t0)
+            self._rate = (now, self._nShown, self.session.received)
+            black, white = self.lut.levels
+            self.overlay.setText(f"display {self.displayFPS:5.1f} fps | camera {self.cameraFPS:5.1f} fps | "
+                                 f"dropped {self.session.dropped} | levels {black}-{white} DN")
+
+    def start(self, interval_ms=5):
+        # Polls faster than the frame rate: a new frame is shown as soon as it is there
+        self.session.start()
+        self._timer.start(interval_ms)
+        self.window.show()
+        return self
+
+    def stop(self):
+        self._timer.stop()
+        self.session.stop()
+
+    def grab(self):
+        # Current window content as a QImage (works on the offscreen platform)
+        return self.window.grab().toImage()
+
+
+def runViewer(cam, **kwargs):
+    viewer = liveViewer(frameSession(cam), **kwargs).start()
+    try:
+        pg.exec()
+    finally:
+        viewer.stop()
+    return viewer
+
+
+### MAIN ###
+if __name__ == "__main__":
+    from tauSWIRcamera import tauSWIRcamera
+    hostname = sys.argv[1] if len(sys.argv) > 1 else "129.123.5.125"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    cam = tauSWIRcamera(hostname, port)
+    try:
+        runViewer(cam)
+    finally:
+        cam.close()
@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+
+
+### NOISE / SNR MODEL ###
+# Mean signal, noise and SNR of the camera over a whole grid of settings
+#     (gain x integration time x FPA temperature x signal [x pixel])
+# evaluated in one set of broadcast NumPy operations. Per gain mode:
+#     k       = wellSize / 2**digitization (or measured)   (e-/DN)
+#     signal  = QE * photonFlux * t                        (e-)
+#     dark    = darkCurrent * 2**((T-refTemp)/doublingTemp) * t
+#     noise   = sqrt(signal + dark + (readNoise*k)**2 + k**2/12)
+#     mean    = bias + (signal + dark) / k                 (DN)
+# Read noise and bias level come from the bias frames (DN), dark current from the
+# dark sweeps (e-/s/px at refTemp); each can be a scalar or a per-pixel map.
+#
+#     model = noiseModel.fromCamera(tauSWIRcamera)
+#     grid = model.evaluate(["low", "medium", "high"], np.arange(1, 33), [20, 40], [1e4, 1e5, 1e6])
+#     gain, t_ms, snr = model.bestExposure(2e5, fpaTemp=20)
+
+# CAM1 bias frame statistics at 20oC (bias_frame/CAM1): "Mean of Std of Pixels" and "Mean of Mean Frame"
+nominalReadNoise_DN = {"low": 95.5, "medium": 85.3, "high": 94.7}
+nominalBias_DN = {"low": 577.9, "medium": 1059.5, "high": 1139.2}
+
+def _perGain(values, gains):
+    # dict (or single value for every gain) -> array with the gains on the first axis
+    arrays = [np.asarray(values[gain] if isinstance(values, dict) else values, dtype=np.float64) for gain in gains]
+    return np.stack(np.broadcast_arrays(*arrays))
+
+
+class noiseModel(object):
+
+    def __init__(self, wellSizes, digitization, QE, readNoise_DN, darkCurrent_e_s=0.0, bias_DN=0.0,
+                 refTemp=20.0, doublingTemp=6.0, conversionGain=None):
+        self.wellSizes = wellSizes          # {gain: e-}
+        self.digitization = digitization    # bits
+        self.QE = QE
+        self.readNoise_DN = readNoise_DN    # {gain: DN} (or one value for all gains)
+        self.darkCurrent_e_s = darkCurrent_e_s # {gain: e-/s/px at refTemp} (or one value for all gains)
+        self.bias_DN = bias_DN              # {gain: DN} (or one value for all gains)
+        self.refTemp = refTemp              # oC
+        self.doublingTemp = doublingTemp    # oC, dark current doubles every doublingTemp
+        self.conversionGain = conversionGain # {gain: e-/DN} measured (see ptc.py), default wellSize/2**digitization
+
+    @classmethod
+    def fromCamera(cls, cam, darkCurrentDensity_nA_cm2=0.0, **kwargs):
+        # Camera constants (tauSWIRcamera class or instance) with the nominal read noise / bias levels
+        darkCurrent = darkCurrentDensity_nA_cm2 * 1e-9 * cam.detectorArea_cm2 * 6.242e18 # e-/s/px
+        kwargs.setdefault("readNoise_DN", nominalReadNoise_DN)
+        kwargs.setdefault("bias_DN", nominalBias_DN)
+        return cls(cam._wellSizes, cam.digitization, cam.QE, darkCurrent_e_s=darkCurrent, **kwargs)
+
+    @classmethod
+    def fromStore(cls, cam, store, camera, fpaTemp=20, perPixel=False, **kwargs):
+        # Measured inputs from a calibration_store.calibrationStore: read noise and bias level
+        # from the bias frame statistics, dark current from the "dark_slope" maps (DN/ms).
+        # With perPixel the maps are used instead of their means.
+        readNoise, bias, darkCurrent = {}, {}, {}
+        for gain, wellSize in cam._wellSizes.items():
+            k = wellSize / 2**cam.digitization
+            readNoise[gain] = nominalReadNoise_DN[gain]
+            bias[gain] = nominalBias_DN[gain]
+            try:
+                _, frame = store.nearest(camera, "bias_std", gain, fpaTemp)
+                readNoise[gain] = np.asarray(frame) if perPixel else float(np.mean(frame))
+            except KeyError:
+                pass
+            try:
+                key, frame = store.nearest(camera, "bias_mean", gain, fpaTemp)
+                meta = store.meta(*key)
+                if frame is not None:
+                    bias[gain] = np.asarray(frame) if perPixel else float(np.mean(frame))
+                elif "Mean of Mean Frame" in meta:
+                    bias[gain] = meta["Mean of Mean Frame"]
+                if not perPixel and "Mean of Std of Pixels" in meta:
+                    readNoise[gain] = meta["Mean of Std of Pixels"]
+            except KeyError:
+                pass
+            try:
+                key, slope = store.nearest(camera, "dark_slope", gain, fpaTemp)
+                # DN/ms at the stored temperature -> e-/s at refTemp
+                slope = np.asarray(slope) if perPixel else float(np.median(slope))
+                scale = 2**((fpaTemp - key[3]) / kwargs.get("doublingTemp", 6.0))
+                darkCurrent[gain] = np.maximum(slope, 0) * 1e3 * k * scale
+            except KeyError:
+                darkCurrent[gain] = 0.0
+        kwargs.setdefault("refTemp", fpaTemp)
+        return cls(cam._wellSizes, cam.digitization, cam.QE, readNoise, darkCurrent, bias, **kwargs)
+
+    def electronsPerDN(self, gain):
+        # Conversion gain (e-/DN) of a gain mode: measured if available, else wellSize/2**digitization
+        if self.conversionGain is not None and gain in self.conversionGain:
+            return self.conversionGain[gain]
+        return self.wellSizes[gain] / 2**self.digitization
+
+    def evaluate(self, gains, intTimes_ms, fpaTemps, signals):
+        # signals: photon flux (photons/px/s). Returns a dict of arrays of shape
+        # (len(gains), len(intTimes_ms), len(fpaTemps), len(signals)) + pixel shape (if any map is per pixel)
+        gains = list(gains)
+        t = np.asarray(intTimes_ms, dtype=np.float64) * 1e-3
+        T = np.asarray(fpaTemps, dtype=np.float64)
+        flux = np.asarray(signals, dtype=np.float64)
+        readNoise = _perGain(self.readNoise_DN, gains)
+        darkCurrent = _perGain(self.darkCurrent_e_s, gains)
+        bias = _perGain(self.bias_DN, gains)
+        pixelDims = max(readNoise.ndim, darkCurrent.ndim, bias.ndim) - 1
+        def axis(values, position):
+            # Put a 1-D grid vector on its grid axis, with room for the pixel axes
+            shape = [1]*(4 + pixelDims)
+            shape[position] = len(values)
+            return values.reshape(shape)
+        def perGain(values):
+            values = values.reshape(values.shape[:1] + (1,)*(pixelDims - (values.ndim-1)) + values.shape[1:])
+            return values.reshape(values.shape[:1] + (1, 1, 1) + values.shape[1:])
+        k = axis(np.array([self.electronsPerDN(gain) for gain in gains], dtype=np.float64), 0)
+        wellSize = axis(np.array([self.wellSizes[gain] for gain in gains], dtype=np.float64), 0)
+        t = axis(t, 1)
+        signal_e = self.QE * axis(flux, 3) * t
+        dark_e = perGain(darkCurrent) * 2**((axis(T, 2) - self.refTemp) / self.doublingTemp) * t
+        read_e = perGain(readNoise) * k
+        noise_e = np.sqrt(signal_e + dark_e + read_e**2 + k**2/12)
+        mean_DN = perGain(bias) + (signal_e + dark_e) / k
+        saturated = (mean_DN >= 2**self.digitization - 1) | (signal_e + dark_e >= wellSize)
+        snr = np.where(saturated, 0.0, signal_e / noise_e)
+        return {"gains": gains, "signal_e": signal_e, "dark_e": dark_e, "noise_e": noise_e,
+                "dark_DN": dark_e / k, "noise_DN": noise_e / k, "mean_DN": mean_DN,
+                "saturated": saturated, "snr": snr}
+
+    def bestExposure(self, signal, fpaTemp=20, gains=None, intTimes_ms=None, fps=None, maxFill=0.9):
+        # Gain and integration time with the highest SNR for a scene of `signal` photons/px/s,
+        # keeping the mean below maxFill of the ADC range (and the integration time within the
+        # frame period if fps is given). Returns (gain, int time (ms), snr).
+        gains = list(self.wellSizes) if gains is None else gains
+        intTimes_ms = np.linspace(0.1, 33, 330) if intTimes_ms is None else np.asarray(intTimes_ms)
+        if fps is not None:
+            intTimes_ms = intTimes_ms[intTimes_ms < math.floor(1e3/fps)]
+        grid = self.evaluate(gains, intTimes_ms, [fpaTemp], [signal])
+        snr = grid["snr"].reshape(len(gains), len(intTimes_ms), -1).mean(axis=2)
+        mean = grid["mean_DN"].reshape(len(gains), len(intTimes_ms), -1).max(axis=2)
+        snr = np.where(mean <= maxFill*(2**self.digitization - 1), snr, -np.inf)
+        g, i = np.unravel_index(np.argmax(snr), snr.shape)
+        if not np.isfinite(snr[g, i]):
+            return None, None, 0.0
+        return gains[g], float(intTimes_ms[i]), float(snr[g, i])
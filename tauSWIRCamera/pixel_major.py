@@ -0,0 +1,142 @@
+import numpy as np
+
+
+### PIXEL-MAJOR STACK ###
+# Frame-major stacks (frames, rows, columns) make the time series of one pixel a
+# strided read across the whole file (df_stack[:, 100, 150] in noise_level.ipynb).
+# transposeStack rewrites a stack as tiles of pixels, each stored as one
+# contiguous (pixels, time) block:
+#     out[tileRow, tileColumn, pixel, frame]
+# using a blocked transpose: one band of tile rows is read for a chunk of frames at
+# a time, sized from the memory budget. The temporal analyses below work on such
+# (pixels, time) blocks, vectorized over the pixels, and analyzeStack runs them tile
+# by tile into per-pixel maps. The file does not record the tile shape, so it is given
+# again when opening it.
+#
+#     transposeStack(tifffile.memmap(stackPath), "stack_pixel_major.npy")
+#     maps = analyzeStack(pixelMajorStack("stack_pixel_major.npy", tile=(32, 32)), fps=30)
+
+def transposeStack(stack, path, tile=(32, 32), memoryBudget_MB=256):
+    # stack: (frames, rows, columns) array or memory map. Rows/columns beyond a whole number of tiles are dropped.
+    nFrames, rows, cols = stack.shape
+    tilesY, tilesX = rows // tile[0], cols // tile[1]
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=stack.dtype,
+                                    shape=(tilesY, tilesX, tile[0]*tile[1], nFrames))
+    # A band is tile[0] rows of every frame of the chunk (x2 for the transposed copy)
+    bandBytes = tile[0] * tilesX*tile[1] * stack.dtype.itemsize * 2
+    chunkFrames = max(1, int(memoryBudget_MB*2**20 // bandBytes))
+    for ty in range(tilesY):
+        for k in range(0, nFrames, chunkFrames):
+            band = np.asarray(stack[k:k+chunkFrames, ty*tile[0]:(ty+1)*tile[0], :tilesX*tile[1]])
+            band = band.reshape(len(band), tile[0], tilesX, tile[1])
+            out[ty, :, :, k:k+len(band)] = band.transpose(2, 1, 3, 0).reshape(tilesX, tile[0]*tile[1], len(band))
+    out.flush()
+    return pixelMajorStack(path, tile)
+
+
+class pixelMajorStack(object):
+
+    def __init__(self, path, tile):
+        # tile: (rows, columns) of the tiles, as given to transposeStack
+        self.data = np.load(path, mmap_mode='r')
+        self.tilesY, self.tilesX, nPixels, self.nFrames = self.data.shape
+        self.tile = tuple(tile)
+        if self.tile[0]*self.tile[1] != nPixels:
+            raise Exception(f"Tile {self.tile} does not match the {nPixels} pixels per tile of {path}")
+        self.shape = (self.tilesY*self.tile[0], self.tilesX*self.tile[1])
+
+    def tileSeries(self, ty, tx):
+        # (pixels, time) block of one tile, pixels in row-major order within the tile
+        return self.data[ty, tx]
+
+    def pixel(self, row, col):
+        ty, r = divmod(row, self.tile[0])
+        tx, c = divmod(col, self.tile[1])
+        return self.data[ty, tx, r*self.tile[1] + c]
+
+    def toMap(self, tileValues):
+        # (tilesY, tilesX, pixels, ...) -> (rows, columns, ...)
+        extra = tileValues.shape[3:]
+        values = tileValues.reshape((self.tilesY, self.tilesX, self.tile[0], self.tile[1]) + extra)
+        axes = (0, 2, 1, 3) + tuple(range(4, values.ndim))
+        return values.transpose(axes).reshape(self.shape + extra)
+
+
+### TEMPORAL ANALYSES (series: (pixels, time)) ###
+
+def powerSpectrum(series, fps):
+    # One-sided power spectral density of every pixel (DN^2/Hz). Returns (frequencies, psd)
+    x = np.asarray(series, dtype=np.float64)
+    x = x - x.mean(axis=-1, keepdims=True)
+    n = x.shape[-1]
+    psd = np.abs(np.fft.rfft(x, axis=-1))**2 / (fps*n)
+    psd[..., 1:-1 if n % 2 == 0 else None] *= 2
+    return np.fft.rfftfreq(n, d=1/fps), psd
+
+def spectralSlope(frequencies, psd, band=None):
+    # Log-log slope of the PSD of every pixel (0: white, -1: 1/f), fitted over band=(fmin, fmax)
+    use = frequencies > 0
+    if band is not None:
+        use &= (frequencies >= band[0]) & (frequencies <= band[1])
+    x = np.log(frequencies[use])
+    y = np.log(np.maximum(psd[..., use], 1e-30))
+    x = x - x.mean()
+    return (y * x).sum(axis=-1) / (x*x).sum()
+
+def allanVariance(series, clusterSizes=None):
+    # Non-overlapping Allan variance of every pixel for each cluster size m (frames).
+    # Returns (clusterSizes, allan) with allan of shape (pixels, len(clusterSizes)).
+    x = np.asarray(series, dtype=np.float64)
+    n = x.shape[-1]
+    if clusterSizes is None:
+        clusterSizes = 2**np.arange(int(np.log2(n // 2)) + 1)
+    cumulative = np.concatenate([np.zeros(x.shape[:-1] + (1,)), np.cumsum(x, axis=-1)], axis=-1)
+    allan = []
+    for m in clusterSizes:
+        k = n // m
+        means = (cumulative[..., m:k*m+1:m] - cumulative[..., 0:(k-1)*m+1:m]) / m
+        allan.append(0.5 * np.mean(np.diff(means, axis=-1)**2, axis=-1))
+    return np.asarray(clusterSizes), np.stack(allan, axis=-1)
+
+def rtsSteps(series, window=8, threshold=6.0):
+    # Random telegraph signal detection: a step is where the means of the `window` frames
+    # before and after differ by more than `threshold` times their expected scatter
+    # (from the frame-to-frame noise, which is insensitive to the steps themselves).
+    # Returns (number of steps, largest step (DN)) per pixel.
+    x = np.asarray(series, dtype=np.float64)
+    n = x.shape[-1]
+    sigma = np.median(np.abs(np.diff(x, axis=-1)), axis=-1) / (0.6745*np.sqrt(2))
+    cumulative = np.concatenate([np.zeros(x.shape[:-1] + (1,)), np.cumsum(x, axis=-1)], axis=-1)
+    before = (cumulative[..., window:n-window+1] - cumulative[..., :n-2*window+1]) / window
+    after = (cumulative[..., 2*window:] - cumulative[..., window:n-window+1]) / window
+    step = after - before
+    score = np.abs(step) / (sigma[..., None]*np.sqrt(2/window) + 1e-12)
+    above = score > threshold
+    # Count each run of detections once
+    starts = above[..., 1:] & ~above[..., :-1]
+    nSteps = starts.sum(axis=-1) + above[..., 0]
+    largest = np.where(above, np.abs(step), 0).max(axis=-1, initial=0)
+    return nSteps, largest
+
+def analyzeStack(store, fps, clusterSizes=None, band=None, rtsWindow=8, rtsThreshold=6.0):
+    # Runs the analyses tile by tile on a pixelMajorStack. Returns per-pixel maps:
+    #   std, psdSlope, allan (rows, columns, len(clusterSizes)), rtsSteps, rtsLargestStep, and the axes
+    shape = (store.tilesY, store.tilesX, store.tile[0]*store.tile[1])
+    maps = {name: np.zeros(shape) for name in ("std", "psdSlope", "rtsSteps", "rtsLargestStep")}
+    allan = None
+    for ty in range(store.tilesY):
+        for tx in range(store.tilesX):
+            series = np.asarray(store.tileSeries(ty, tx), dtype=np.float64)
+            maps["std"][ty, tx] = series.std(axis=-1)
+            frequencies, psd = powerSpectrum(series, fps)
+            maps["psdSlope"][ty, tx] = spectralSlope(frequencies, psd, band)
+            clusterSizes, tileAllan = allanVariance(series, clusterSizes)
+            if allan is None:
+                allan = np.zeros(shape + (len(clusterSizes),))
+            allan[ty, tx] = tileAllan
+            maps["rtsSteps"][ty, tx], maps["rtsLargestStep"][ty, tx] = rtsSteps(series, rtsWindow, rtsThreshold)
+    result = {name: store.toMap(values) for name, values in maps.items()}
+    result["allan"] = store.toMap(allan)
+    result["clusterSizes"] = clusterSizes
+    result["frequencies"] = frequencies
+    return result
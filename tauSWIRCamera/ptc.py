@@ -0,0 +1,132 @@
+import numpy as np
+
+from noise_model import noiseModel
+
+
+### PHOTON TRANSFER CURVE ###
+# Measures the conversion gain (e-/DN), read noise and full well of every gain mode
+# from pairs of flat frames over an integration time sweep, instead of the values
+# hard-coded in noise_level.ipynb. For each pair (a, b) of consecutive frames of a
+# uniformly illuminated scene:
+#     signal   = mean((a+b)/2)
+#     variance = var(a-b)/2          (fixed pattern cancels in the difference)
+# both per ROI tile, accumulated from sums while the frames stream in
+# (tauSWIRcamera.iterFrames), so no stack is kept. Per tile the shot noise limited part
+# of the curve is fitted with
+#     variance = (signal - bias)/K + readNoise**2
+# and the full well is where the variance peaks (before it collapses at saturation).
+#
+#     results = measureGains(cam, np.linspace(0.1, 30, 25))
+#     model = noiseModelFromPTC(cam, results)
+
+def _tileSum(image, tile):
+    rows, cols = image.shape[0] // tile[0], image.shape[1] // tile[1]
+    return image[:rows*tile[0], :cols*tile[1]].reshape(rows, tile[0], cols, tile[1]).sum(axis=(1, 3))
+
+
+class ptcAccumulator(object):
+    # Streaming sums of one PTC point, per tile
+
+    def __init__(self, shape, tile=(64, 64)):
+        self.tile = tile
+        self.tiles = (shape[0] // tile[0], shape[1] // tile[1])
+        self._crop = (self.tiles[0]*tile[0], self.tiles[1]*tile[1])
+        self.nPairs = 0
+        self.sumSignal = np.zeros(self.tiles)
+        self.sumDiff = np.zeros(self.tiles)
+        self.sumDiff2 = np.zeros(self.tiles)
+        self._diff = np.empty(self._crop, dtype=np.float64)
+
+    def addPair(self, a, b):
+        a = a[:self._crop[0], :self._crop[1]]
+        b = b[:self._crop[0], :self._crop[1]]
+        np.subtract(a, b, out=self._diff, dtype=np.float64)
+        self.sumDiff += _tileSum(self._diff, self.tile)
+        self.sumDiff2 += _tileSum(np.square(self._diff, out=self._diff), self.tile)
+        np.add(a, b, out=self._diff, dtype=np.float64)
+        self.sumSignal += _tileSum(self._diff, self.tile) / 2
+        self.nPairs += 1
+
+    def result(self):
+        # (signal, variance) per tile (DN, DN^2)
+        n = self.nPairs * self.tile[0] * self.tile[1]
+        signal = self.sumSignal / n
+        variance = (self.sumDiff2/n - (self.sumDiff/n)**2) / 2
+        return signal, variance
+
+
+def measurePTC(cam, intTimes_ms, nPairs=8, tile=(64, 64)):
+    # PTC points at the current gain: returns (int times, signal, variance), the last two of
+    # shape (points, tile rows, tile columns)
+    signals, variances = [], []
+    for t_ms in intTimes_ms:
+        cam.setIntTime(t_ms)
+        accumulator = ptcAccumulator(cam.fpa_size, tile)
+        frames = cam.iterFrames(2*nPairs)
+        for a in frames:
+            accumulator.addPair(a, next(frames))
+        signal, variance = accumulator.result()
+        signals.append(signal)
+        variances.append(variance)
+        print(f"Int. time {t_ms}ms: signal {np.median(signal):.1f} DN, variance {np.median(variance):.1f} DN^2")
+    return np.asarray(intTimes_ms), np.stack(signals), np.stack(variances)
+
+def fitPTC(signal, variance, bias_DN, linearFraction=0.7):
+    # Fits every tile at once. Only the points below linearFraction of the signal at the
+    # variance peak are used for the line. Returns a dict of per-tile maps:
+    #   conversionGain (e-/DN), readNoise_DN, fullWell_e, and the number of points used
+    peak = np.argmax(variance, axis=0)
+    peakSignal = np.take_along_axis(signal, peak[None], axis=0)[0]
+    x = signal - bias_DN
+    use = (x > 0) & (x <= linearFraction*(peakSignal - bias_DN))
+    w = use.astype(np.float64)
+    n = w.sum(axis=0)
+    Sx = (w*x).sum(axis=0)
+    Sy = (w*variance).sum(axis=0)
+    Sxx = (w*x*x).sum(axis=0)
+    Sxy = (w*x*variance).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = n*Sxx - Sx*Sx
+        slope = np.where(n >= 2, (n*Sxy - Sx*Sy) / det, np.nan)
+        offset = (Sy - slope*Sx) / n
+        conversionGain = 1 / slope
+        readNoise = np.sqrt(np.maximum(offset, 0))
+    fullWell = (peakSignal - bias_DN) * conversionGain
+    return {"conversionGain": conversionGain, "readNoise_DN": readNoise, "readNoise_e": readNoise*conversionGain,
+            "fullWell_e": fullWell, "nPoints": n}
+
+def measureGains(cam, intTimes_ms, gains=("low", "medium", "high"), nPairs=8, tile=(64, 64), bias_DN=None,
+                 linearFraction=0.7):
+    # PTC of every gain mode. bias_DN: {gain: DN} (scalar or map), default the nominal bias
+    # levels of noise_model. Returns {gain: fit dict, with the tile medians and the raw curve}
+    if bias_DN is None:
+        bias_DN = cam.noiseModel.bias_DN
+    results = {}
+    for gain in gains:
+        cam.setSensorGain(gain)
+        intTimes, signal, variance = measurePTC(cam, intTimes_ms, nPairs, tile)
+        bias = bias_DN[gain] if isinstance(bias_DN, dict) else bias_DN
+        if np.ndim(bias) == 2:
+            bias = _tileSum(np.asarray(bias, dtype=np.float64), tile) / (tile[0]*tile[1])
+        fit = fitPTC(signal, variance, bias, linearFraction)
+        fit.update({"intTimes_ms": intTimes, "signal": signal, "variance": variance})
+        for name in ("conversionGain", "readNoise_DN", "readNoise_e", "fullWell_e"):
+            fit[name + "_median"] = float(np.nanmedian(fit[name]))
+        print(f"{gain} gain: {fit['conversionGain_median']:.2f} e-/DN, read noise {fit['readNoise_e_median']:.1f} e-, "
+              f"full well {fit['fullWell_e_median']:.0f} e-")
+        results[gain] = fit
+    return results
+
+def noiseModelFromPTC(cam, results, **kwargs):
+    # noise_model.noiseModel with the measured conversion gain, read noise and full well
+    wellSizes = dict(cam._wellSizes)
+    readNoise = cam.noiseModel.readNoise_DN
+    readNoise = dict(readNoise) if isinstance(readNoise, dict) else {gain: readNoise for gain in wellSizes}
+    conversionGain = {}
+    for gain, fit in results.items():
+        wellSizes[gain] = fit["fullWell_e_median"]
+        readNoise[gain] = fit["readNoise_DN_median"]
+        conversionGain[gain] = fit["conversionGain_median"]
+    kwargs.setdefault("bias_DN", cam.noiseModel.bias_DN)
+    kwargs.setdefault("darkCurrent_e_s", cam.noiseModel.darkCurrent_e_s)
+    return noiseModel(wellSizes, cam.digitization, cam.QE, readNoise, conversionGain=conversionGain, **kwargs)
@@ -0,0 +1,106 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import tifffile
+from tifffile import imwrite
+
+from calibration_store import isFlatFolder
+
+
+### BATCH PROCESSING OF ARCHIVED STACKS ###
+# Recomputes the mean and std frames of the *_stack_{N}images_*.tif files written by
+# the sweeps (calibration_sweep.darkFrameAction and the notebooks). Stacks written by
+# imwrite are contiguous, so they are memory-mapped (tifffile.memmap) and reduced a
+# chunk of frames at a time; files are spread over a process pool. The memory budget
+# is split between the workers and sets the chunk size, so the total memory use does
+# not depend on the stack sizes.
+#
+#     processArchive("/Volumes/SSD/FINIS CALIBRATION DATA/dark_frame_integrationPriority", workers=8)
+
+_stackName = re.compile(r"^(?P<cam>CAM\d)_stack_(?P<N>\d+)images_(?P<gain>low|medium|high)gain_FPA_at(?P<T>-?\d+)C_expTime_(?P<t>[0-9.]+)ms\.tif$")
+
+class _pageReader(object):
+    # Slices of a stack that cannot be memory-mapped (e.g. compressed), decoded page by page
+
+    def __init__(self, path):
+        self._tif = tifffile.TiffFile(path)
+        self.shape = (len(self._tif.pages),) + self._tif.pages[0].shape
+
+    def __getitem__(self, index):
+        frames = self._tif.asarray(key=range(*index.indices(self.shape[0])))
+        return frames.reshape((-1,) + self.shape[1:])
+
+def _openStack(path):
+    try:
+        return tifffile.memmap(path, mode='r')
+    except ValueError:
+        return _pageReader(path)
+
+def stackStatistics(path, chunkFrames=16):
+    # Mean and std (np.std, ddof=0) of a stack along the frames, reduced chunkFrames at a time.
+    # The sums are taken relative to the first frame to keep the variance well conditioned.
+    stack = _openStack(path)
+    n = stack.shape[0]
+    y0 = np.asarray(stack[0:1], dtype=np.float64)[0]
+    S = np.zeros_like(y0)
+    SS = np.zeros_like(y0)
+    for k in range(0, n, chunkFrames):
+        chunk = np.asarray(stack[k:k+chunkFrames], dtype=np.float64)
+        chunk -= y0
+        S += chunk.sum(axis=0)
+        SS += np.einsum('kij,kij->ij', chunk, chunk)
+    mean = S / n
+    std = np.sqrt(np.maximum(SS/n - mean*mean, 0))
+    return mean + y0, std
+
+def derivedNames(path, root=None):
+    # Names of the mean / std frames of a stack, as written by the dark frame notebooks.
+    # Stacks under a folder named flat... (relative to root) get flat_frame names instead, so
+    # calibration_store.importCalibrationTree does not take them for dark frames
+    folder, name = os.path.split(path)
+    match = _stackName.match(name)
+    if match is None: return None
+    f = match.groupdict()
+    kind = "flat" if isFlatFolder(folder, root or os.sep) else "dark"
+    common = f"{kind}_frame_from{f['N']}images_{f['gain']}gain_{f['T']}C_expTime_{f['t']}ms.tif"
+    return os.path.join(folder, f"{f['cam']}_mean_{common}"), os.path.join(folder, f"{f['cam']}_std_{common}")
+
+def _processStack(path, outputs, chunkFrames):
+    mean, std = stackStatistics(path, chunkFrames)
+    imwrite(outputs[0], mean)
+    imwrite(outputs[1], std)
+    return path, outputs
+
+def processArchive(root, outputDir=None, workers=None, memoryBudget_MB=1024, overwrite=False, frameShape=(512, 640)):
+    # Processes every stack under root (products next to the stacks, or under outputDir with
+    # the same tree). Returns the list of (stack, (mean path, std path)) written.
+    jobs = []
+    for folder, _, files in os.walk(root):
+        for name in sorted(files):
+            names = derivedNames(os.path.join(folder, name), root)
+            if names is None: continue
+            if outputDir is not None:
+                names = tuple(os.path.join(outputDir, os.path.relpath(path, root)) for path in names)
+            if not overwrite and all(os.path.exists(path) for path in names): continue
+            jobs.append((os.path.join(folder, name), names))
+    if not jobs:
+        return []
+    workers = workers or os.cpu_count()
+    # Per worker: 3 float64 maps (first frame and the two sums) + the float64 chunk
+    frameBytes = frameShape[0]*frameShape[1]*8
+    chunkFrames = max(1, int(memoryBudget_MB*2**20 / workers / frameBytes) - 3)
+    print(f"## {len(jobs)} stacks, {workers} workers, {chunkFrames} frames per chunk ##")
+    done = []
+    with ProcessPoolExecutor(workers) as pool:
+        futures = []
+        for path, names in jobs:
+            for output in names:
+                os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+            futures.append(pool.submit(_processStack, path, names, chunkFrames))
+        for k, future in enumerate(as_completed(futures)):
+            path, names = future.result()
+            done.append((path, names))
+            print(f"{k+1}/{len(jobs)} {os.path.basename(path)}")
+    return done
@@ -0,0 +1,242 @@
+import functools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import tifffile
+
+
+### STEREO REGISTRATION ###
+# stereo/stereo_registration.ipynb runs StackReg(...).register_transform(ref, mov) on
+# every image pair. The rig does not move between frames, so stereoCalibration
+# estimates the CAM2 -> CAM1 transform once, from the mean of a calibration set of pairs,
+# saves it, and turns it into remap tables: for every CAM1 pixel the four CAM2 source
+# pixels and their bilinear weights. Aligning a frame is then four gathers and a
+# weighted sum (an integer translation is a plain slice), with no re-estimation.
+#
+#     calib = stereoCalibration.estimate(cam1Frames, cam2Frames, "RIGID_BODY")
+#     calib.save("stereo_CAM2_to_CAM1.json")
+#     calib = stereoCalibration.load("stereo_CAM2_to_CAM1.json")
+#     aligned = calib.align(cam2Frame)               # in CAM1 pixel coordinates
+#
+# The matrix follows pystackreg: it maps CAM1 (reference) pixel coordinates (x, y, 1),
+# or (x, y, x*y, 1) for BILINEAR, to CAM2 (moving) coordinates.
+#
+# For pairs where the rig may have moved, registerPair estimates the translation by FFT
+# phase correlation first (apodization window cached per frame shape) and only
+# then, optionally, refines it with a StackReg mode starting from the pre-aligned pair,
+# which is faster and avoids StackReg locking onto a wrong local optimum for large
+# shifts. registerSequence runs it over a sequence of pairs on a process pool:
+#
+#     results = registerSequence(cam1Paths, cam2Paths, refine="RIGID_BODY", workers=8)
+#     results[0]["matrix"], results[0]["peak"], results[0]["ncc"]
+
+transformations = ("TRANSLATION", "RIGID_BODY", "SCALED_ROTATION", "AFFINE", "BILINEAR")
+
+def _meanImage(frames):
+    frames = np.asarray(frames, dtype=np.float64)
+    return frames.mean(axis=0) if frames.ndim == 3 else frames
+
+def _registrationMatrix(ref, mov, transformation):
+    from pystackreg import StackReg
+    return StackReg(getattr(StackReg, transformation)).register(ref, mov)
+
+def sourceCoordinates(matrix, shape):
+    # CAM2 (x, y) coordinates of every CAM1 pixel, each of the given shape
+    y, x = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float64)
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.shape == (4, 4): # BILINEAR
+        terms = (x, y, x*y, np.ones_like(x))
+    else:
+        terms = (x, y, np.ones_like(x))
+    xs = sum(m*t for m, t in zip(matrix[0], terms))
+    ys = sum(m*t for m, t in zip(matrix[1], terms))
+    return xs, ys
+
+
+class stereoCalibration(object):
+
+    def __init__(self, matrix, transformation="RIGID_BODY", shape=(512, 640), fill=0.0, meta=None):
+        if transformation not in transformations:
+            raise Exception(f"Invalid transformation {transformation}. Options: {', '.join(transformations)}")
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.transformation = transformation
+        self.shape = tuple(shape)
+        self.fill = fill # value of the CAM1 pixels that fall outside CAM2
+        self.meta = meta or {}
+        self._buildTables()
+
+    @classmethod
+    def estimate(cls, refFrames, movFrames, transformation="RIGID_BODY", **kwargs):
+        # refFrames / movFrames: CAM1 / CAM2 frame or stack of frames of the same scene(s).
+        # Stacks are averaged first, so the transform is estimated once, on low noise images.
+        ref, mov = _meanImage(refFrames), _meanImage(movFrames)
+        matrix = _registrationMatrix(ref, mov, transformation)
+        calib = cls(matrix, transformation, ref.shape, **kwargs)
+        residual = np.abs(calib.align(mov) - ref)[calib.valid]
+        calib.meta.update({"nFrames": int(np.asarray(refFrames).shape[0]) if np.ndim(refFrames) == 3 else 1,
+                           "meanAbsResidual": float(residual.mean())})
+        return calib
+
+    def _buildTables(self):
+        xs, ys = sourceCoordinates(self.matrix, self.shape)
+        rows, cols = self.shape
+        self.valid = (xs >= 0) & (xs <= cols-1) & (ys >= 0) & (ys <= rows-1)
+        shift = np.rint(self.matrix[:2, -1])
+        linear = self.matrix[:2, :-1]
+        if np.allclose(linear, np.eye(*linear.shape)) and np.allclose(self.matrix[:2, -1], shift, atol=1e-3):
+            # Integer translation: CAM1 pixel (y, x) is CAM2 pixel (y + dy, x + dx)
+            self._shift = (int(shift[1]), int(shift[0]))
+            return
+        self._shift = None
+        x0 = np.clip(np.floor(xs), 0, cols-2)
+        y0 = np.clip(np.floor(ys), 0, rows-2)
+        fx = np.clip(xs - x0, 0, 1).astype(np.float32)
+        fy = np.clip(ys - y0, 0, 1).astype(np.float32)
+        i00 = (y0*cols + x0).astype(np.intp)
+        # Flat source indices and weights of the 4 neighbours, (4, rows, cols)
+        self._index = np.stack([i00, i00 + 1, i00 + cols, i00 + cols + 1])
+        self._weights = np.stack([(1-fx)*(1-fy), fx*(1-fy), (1-fx)*fy, fx*fy])
+        self._gather = np.empty(self._index.shape, dtype=np.float32)
+
+    def align(self, frame, out=None):
+        # CAM2 frame -> CAM1 pixel grid (float32)
+        if out is None:
+            out = np.empty(self.shape, dtype=np.float32)
+        if self._shift is not None:
+            dy, dx = self._shift
+            rows, cols = self.shape
+            out[...] = self.fill
+            out[max(0, -dy):rows-max(0, dy), max(0, -dx):cols-max(0, dx)] = \
+                frame[max(0, dy):rows-max(0, -dy), max(0, dx):cols-max(0, -dx)]
+            return out
+        np.take(np.asarray(frame, dtype=np.float32).ravel(), self._index, out=self._gather)
+        self._gather *= self._weights
+        np.sum(self._gather, axis=0, out=out)
+        out[~self.valid] = self.fill
+        return out
+
+    def alignStack(self, frames):
+        out = np.empty((len(frames),) + self.shape, dtype=np.float32)
+        for k, frame in enumerate(frames):
+            self.align(frame, out=out[k])
+        return out
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({"transformation": self.transformation, "matrix": self.matrix.tolist(),
+                       "shape": list(self.shape), "fill": self.fill, "meta": self.meta}, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            saved = json.load(f)
+        return cls(saved["matrix"], saved["transformation"], saved["shape"], saved["fill"], saved["meta"])
+
+
+### PHASE CORRELATION PRE-ALIGNMENT ###
+
+@functools.lru_cache(maxsize=8)
+def _phaseWindow(shape):
+    # Apodization window of a frame shape (limits the edge leakage of the FFT), read-only
+    window = np.outer(np.hanning(shape[0]), np.hanning(shape[1]))
+    window.flags.writeable = False
+    return window
+
+def phaseCorrelation(ref, mov):
+    # Translation (dx, dy) such that mov(x + dx, y + dy) ~ ref(x, y), with sub-pixel
+    # refinement of the correlation peak, and the peak height (1: identical up to the
+    # shift, ~0: no correlation)
+    ref = np.asarray(ref, dtype=np.float64)
+    mov = np.asarray(mov, dtype=np.float64)
+    window = _phaseWindow(ref.shape)
+    Fref = np.fft.rfft2((ref - ref.mean()) * window)
+    Fmov = np.fft.rfft2((mov - mov.mean()) * window)
+    cross = Fmov * np.conj(Fref)
+    cross /= np.maximum(np.abs(cross), 1e-12)
+    surface = np.fft.irfft2(cross, s=ref.shape)
+    py, px = np.unravel_index(np.argmax(surface), surface.shape)
+    peak = surface[py, px]
+    shift = []
+    for p, n, neighbours in ((px, ref.shape[1], surface[py, [(px-1) % ref.shape[1], (px+1) % ref.shape[1]]]),
+                             (py, ref.shape[0], surface[[(py-1) % ref.shape[0], (py+1) % ref.shape[0]], px])):
+        # Parabola through the peak and its two neighbours
+        left, right = neighbours
+        denominator = left - 2*peak + right
+        delta = 0.5*(left - right)/denominator if denominator < 0 else 0.0
+        p = p + delta
+        shift.append(p - n if p > n/2 else p)
+    return float(shift[0]), float(shift[1]), float(peak)
+
+def translationMatrix(dx, dy, size=3):
+    matrix = np.eye(size)
+    matrix[0, -1], matrix[1, -1] = dx, dy
+    return matrix
+
+def _alignedPair(ref, mov, matrix, transformation):
+    calib = stereoCalibration(matrix, transformation, ref.shape)
+    return calib.align(mov), ref, calib.valid
+
+def _normalizedCorrelation(a, b, valid):
+    a = a[valid] - a[valid].mean()
+    b = b[valid] - b[valid].mean()
+    return float((a*b).sum() / np.sqrt((a*a).sum() * (b*b).sum()))
+
+def _loadFrame(frame):
+    # Frame or path of a TIFF frame (stacks are averaged)
+    return _meanImage(tifffile.imread(frame) if isinstance(frame, str) else frame)
+
+def _inputShift(ox, oy, size):
+    # Matrix of the substitution (x, y) -> (x - ox, y - oy) in the input terms of a matrix
+    # ((x, y, 1), or (x, y, x*y, 1) for BILINEAR)
+    matrix = translationMatrix(-ox, -oy, size)
+    if size == 4:
+        matrix[2, :] = [-oy, -ox, 1, ox*oy]
+    return matrix
+
+def registerPair(ref, mov, refine=None):
+    # Phase correlation translation, optionally refined by a StackReg mode on the overlap
+    # of the pair pre-aligned by the integer part of the shift (no filled borders for
+    # StackReg to fit). Returns a dict with the CAM2 -> CAM1 matrix, the phase correlation
+    # shift and peak, the normalized cross-correlation (ncc) of the aligned pair and
+    # whether the refinement was kept
+    ref, mov = _loadFrame(ref), _loadFrame(mov)
+    dx, dy, peak = phaseCorrelation(ref, mov)
+    matrix = translationMatrix(dx, dy)
+    ncc = _normalizedCorrelation(*_alignedPair(ref, mov, matrix, "TRANSLATION"))
+    refined = False
+    if refine is not None:
+        sx, sy = int(round(dx)), int(round(dy))
+        rows, cols = ref.shape
+        x0, x1 = max(0, -sx), cols - max(0, sx)
+        y0, y1 = max(0, -sy), rows - max(0, sy)
+        # Crop matrix: CAM1 crop -> CAM2 crop coordinates, moved back to full frame coordinates
+        crop = _registrationMatrix(ref[y0:y1, x0:x1], mov[y0+sy:y1+sy, x0+sx:x1+sx], refine)
+        size = len(crop)
+        candidate = translationMatrix(x0 + sx, y0 + sy, size) @ crop @ _inputShift(x0, y0, size)
+        candidate[2:] = np.eye(size)[2:]
+        candidateNcc = _normalizedCorrelation(*_alignedPair(ref, mov, candidate, refine))
+        # The refinement is kept only if it improves the match (StackReg can diverge)
+        if candidateNcc > ncc:
+            matrix, ncc, refined = candidate, candidateNcc, True
+    return {"matrix": matrix, "shift": (float(dx), float(dy)), "peak": peak, "ncc": ncc, "refined": refined}
+
+def _registerJob(k, ref, mov, refine):
+    return k, registerPair(ref, mov, refine)
+
+def registerSequence(refFrames, movFrames, refine=None, workers=None):
+    # registerPair over a sequence of CAM1/CAM2 pairs (frames, or TIFF paths loaded by the
+    # workers), on a process pool. Returns the results in the order of the pairs
+    if len(refFrames) != len(movFrames):
+        raise Exception("The CAM1 and CAM2 sequences must have the same length")
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        return [registerPair(ref, mov, refine) for ref, mov in zip(refFrames, movFrames)]
+    results = [None]*len(refFrames)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(_registerJob, k, ref, mov, refine) for k, (ref, mov) in enumerate(zip(refFrames, movFrames))]
+        for future in futures:
+            k, result = future.result()
+            results[k] = result
+    return results
@@ -1,17 +1,21 @@
 from socket import (socket, AF_INET, SOCK_STREAM, SHUT_RDWR)
 from ccsdspy import Message
 import time
+import asyncio
+import functools
 from raw_data import process_raw_data
-import re
-import subprocess
-import math
 from tifffile import (TiffWriter, TiffFile)
 import matplotlib.pyplot as plt
 from IPython.display import display, clear_output
 import numpy as np
+from tau_channel import (tauControlChannel, tauOneShotChannel)
+from tau_cache import tauRegisterCache
+from tau_commands import (commands, gainModes, priorities, FPA_setPointTemps)
+from tec_settle import tecSettleEngine
+from noise_model import noiseModel
 
 
-### CAMERA CONNECTION INFORMATION ###
+### CAMERA CONNECTION INFORMATION (defaults, see tauSWIRcamera address/command/transport) ###
 cameraAddress = "rroci@129.123.5.125"
 cameraCommand = "taucmd -f /dev/ttyUSB0"
 
@@ -31,30 +35,6 @@ def _process_message(data):
         data_point['Queue_Length'] = queue_length #units: bytes, It should <100MB
     return data_point
 
-def extract_hex_values_from_response(input_string):
-    # Find all occurrences of the phrase "Received response from Tau (len: N)"
-    matches = re.finditer(r'Received response from Tau \(len: (\d+)\)', input_string)
-
-    # Find the last match
-    last_match = None
-    for match in matches:
-        last_match = match
-
-    if last_match:
-        # Get the length N from the last match
-        length_n = int(last_match.group(1))
-
-        # Get the substring after the last match
-        substring_after_last_match = input_string[last_match.end():]
-
-        # Extract N hexadecimal values using a regular expression
-        # hex_values = re.findall(r'([0-9A-Fa-f]+)', substring_after_last_match)[:length_n]
-        hex_values = re.findall(r'\b0x[0-9A-Fa-f]{2}\b', substring_after_last_match)[:length_n]
-        return hex_values
-    else:
-        return []
-    
-
 class tauSWIRcamera:
     fpa_size = [512, 640]
     pitch = 15              # um, detector size
@@ -62,198 +42,230 @@ class tauSWIRcamera:
     maxFPS = 60
     digitization = 14
     QE = 0.6
-    _validGainModes = {"high":0,"medium":1,"low":2}
+    _validGainModes = gainModes
     _wellSizes = {"low": 1.35e6, "medium" : 113e3, "high": 38e3}
     CAM1_SerialNumber = 10682
     CAM2_SerialNumber = 10683
     cameraNames = {CAM1_SerialNumber: "CAM1", CAM2_SerialNumber: "CAM2"}
 
-    def __init__(self, hostname, port, syncMode = "DISABLED"):
+    def __init__(self, hostname, port, syncMode = "DISABLED", persistentControl = True, cacheRegisters = False,
+                 transport = None, address = None, command = None):
         # Check if syncMode input is valid
         if syncMode not in ["DISABLED", "MASTER", "SLAVE"]: 
             raise "Invalid sync mode. Options: DISABLED, MASTER, SLAVE"
         # Record connection parameters
         self.hostname = hostname
         self.port = port
+        # Open the Tau control channel. Any object with query/queryBatch/close can be
+        # plugged in as transport, e.g. tau_emulator.tauEmulator to run without the camera.
+        # By default one ssh session to the camera board is reused by every command.
+        address = address or cameraAddress
+        command = command or cameraCommand
+        if transport is not None:
+            self._channel = transport
+        elif persistentControl:
+            self._channel = tauControlChannel(address, command)
+        else:
+            self._channel = tauOneShotChannel(address, command)
+        # Optional cache of the last confirmed value of each Tau parameter (see tau_cache.py)
+        self._cache = tauRegisterCache() if cacheRegisters else None
+        # Optional live correction of the collected frames (see setFrameCorrection)
+        self._frameCorrection = None
+        # Noise model used by darkFrameMeanCounts/getNoiseCount_Std, nominal until replaced
+        # by a measured one, e.g. noiseModel.fromStore(self, store, self.name)
+        self.noiseModel = noiseModel.fromCamera(self)
         # Run setup script
         self._runSetupScript(syncMode)
+        self.fpaTempSetPoint = FPA_setPointTemps[1] # set by the setup script
+        self.tecSettle = None # tec_settle.tecSettleEngine of the last set point change (reason, trace)
         # Identify camera as CAM1 or CAM2 based on the serial number
         self.cameraSerialNumber = self.getSerialNumber()
         self.name = self.cameraNames[self.cameraSerialNumber]
 
     def _runSetupScript(self, syncMode):
         print("## START CAMERA SETUP ##")
-
-
-        # 1 - DISABLE ANALOG MODE AND ZOOM 
-        print(f"1. Analog mode set to: DISABLED")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"0F","0002","-d 2"], capture_output=True)
-
-        # 2 - SET EXTERNAL SYNC MODE
-        print(f"2. External Sync Mode set to: {syncMode}")
-        if syncMode == "MASTER":
-            cmd = "0002"
-        elif syncMode == "SLAVE":
-            cmd = "0001"
-        else:
-            cmd = "0000"
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"21",cmd,"-d 2"], capture_output=True)
-
-        # 3 - SET AGC ALGORITHM TO MANUAL
-        print("3. AGC set to: MANUAL")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"13","0003","-d 2"], capture_output=True)
-
-        # 3 - SET BRIGHTNESS LEVEL
-        print("3. Brightness Level set to: 0")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"15","0000","-d 2"], capture_output=True)
-
-        # 3 - SET CONTRAST LEVEL
-        print("3. Contrast Level set to: 0")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"14","0000","-d 2"], capture_output=True)
-
-        # 4 - DISABLE AUTO-EXPOSURE
-        print("4. Auto-Exposure set to: DISABLED")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"ED","02120000","-d 2"], capture_output=True)
-
-        # 5 - SET CMOS BIT DEPTH TO 14BITS
-        print("5. CMOS bit depth set to: 14-BITS")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"12",f"0600","-d 2"], capture_output=True)
-
-        # 6 - SET CAMERA LINK BIT DEPTH TO 14BITS
-        print("6. Camera Link bit depth set to: 14-BITS")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"12","0700","-d 2"], capture_output=True)
-
-        # 7 - SET INTEGRATION MODE UNRESTRICTED
-        print("7. Integration mode set to: ITR only (Integrate Then Read)")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"ED","020E012300000001","-d 2"], capture_output=True)
-        # print("7. Integration mode set to: UNRESTRICTED")
-        # subprocess.run(["ssh", cameraAddress, cameraCommand,"ED","020E012300000000","-d 2"], capture_output=True)
-
-        # 8 - SET FPA SET POINT TEMP TO 20C
-        print("8. FPA Set Point Temperature set to: 20oC")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"ED",f"020F00010001","-d 2"], capture_output=True)
-
-        # 9 - SET THIS SETTINGS AS POWER-ON DEFAULT
-        print("9. Settings set as Power-on Default")
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"01","-d 2"], capture_output=True)
-
+        setup = [
+            # 1 - DISABLE ANALOG MODE AND ZOOM 
+            ("1. Analog mode set to: DISABLED", "set-analog-mode", 2),
+            # 2 - SET EXTERNAL SYNC MODE
+            (f"2. External Sync Mode set to: {syncMode}", "set-sync-mode", syncMode),
+            # 3 - SET AGC ALGORITHM TO MANUAL
+            ("3. AGC set to: MANUAL", "set-AGC", 3),
+            # 3 - SET BRIGHTNESS LEVEL
+            ("3. Brightness Level set to: 0", "set-brightness", 0),
+            # 3 - SET CONTRAST LEVEL
+            ("3. Contrast Level set to: 0", "set-contrast", 0),
+            # 4 - DISABLE AUTO-EXPOSURE
+            ("4. Auto-Exposure set to: DISABLED", "set-auto-exposure", False),
+            # 5 - SET CMOS BIT DEPTH TO 14BITS
+            ("5. CMOS bit depth set to: 14-BITS", "set-CMOS-bit-depth", 14),
+            # 6 - SET CAMERA LINK BIT DEPTH TO 14BITS
+            ("6. Camera Link bit depth set to: 14-BITS", "set-CL-bit-depth", 14),
+            # 7 - SET INTEGRATION MODE ITR ONLY (False would be UNRESTRICTED)
+            ("7. Integration mode set to: ITR only (Integrate Then Read)", "set-ITR-only", True),
+            # 8 - SET FPA SET POINT TEMP TO 20C
+            ("8. FPA Set Point Temperature set to: 20oC", "set-TEC-setpoint", 1),
+            # 9 - SET THIS SETTINGS AS POWER-ON DEFAULT (must stay last)
+            ("9. Settings set as Power-on Default", "save-settings", None),
+        ]
+        # The whole script is sent to the camera in a single batch
+        self._commandBatch([(name, value) for _, name, value in setup])
+        for message, _, _ in setup:
+            print(message)
         print("## CAMERA SETUP COMPLETED ##")
 
-    def _decode_tau_response(self, hex_response, command):
-        if command == "get-int-time": # GET INT TIME
-            reply_length = 4 # number of bytes
-            # hex_values_rsp = hex_response[-reply_length-2:-2]
-            hex_values_rsp = [hex_value[2:] for hex_value in hex_response[-reply_length-2:-2]]
-            combined_hex_value = "".join(hex_values_rsp)
-            # Remove the "0x" prefix if present and convert to decimal
-            decimal_value = int(combined_hex_value, 16)
-            integration_time_ms = decimal_value / 5704.807
-            return integration_time_ms
-        elif command == "get-FPA-temp": # READ_SENSOR
-            reply_length = 2 # number of bytes
-            hex_values_rsp = [hex_value[2:] for hex_value in hex_response[-reply_length-2:-2]]
-            combined_hex_value = "".join(hex_values_rsp)
-            decimal_value = int(combined_hex_value, 16)
-            return decimal_value/10
-        elif command == "get-TEC-param": # READ_SENSOR
-            reply_length = 6 # number of bytes
-            hex_values_rsp = [hex_value[2:] for hex_value in hex_response[-reply_length-2:-2]]
-            TECisON = True if hex_values_rsp[3] == '01' else False
-            TEC_entry = hex_values_rsp[5]
-            FPA_setPointTemp = {"00": 0, "01": 20, "02": 40, "03": 45}
-            print("TEC is ON") if TECisON else print("TEC is OFF")
-            print(f"FPA set point temperature (oC): {FPA_setPointTemp[TEC_entry]}")
-        elif command == "get-Gain": # COOLED_CORE_ COMMAND
-            reply_length = 8 # number of bytes
-            hex_values_rsp = [hex_value[2:] for hex_value in hex_response[-reply_length-2:-2]]
-            gainN = int(hex_values_rsp[-1][-1])
-            return list(self._validGainModes.keys())[list(self._validGainModes.values()).index(gainN)]
-        elif command == "get-Priority": # COOLED_CORE_ COMMAND
-            reply_length = 8 # number of bytes
-            hex_values_rsp = [hex_value[2:] for hex_value in hex_response[-reply_length-2:-2]]
-            X = int(hex_values_rsp[-1][-1])
-            if X == 1 : return "Integration"
-            elif X == 2: return "Readout"
-            else:  return -1
-        elif command == "get-FPS": # COOLED_CORE_ COMMAND
-            reply_length = 12 # number of bytes
-            hex_values_rsp = [hex_value[2:] for hex_value in hex_response[-reply_length-2:-2]]
-            fps_hex = hex_values_rsp[3]
-            fps = int(fps_hex,16)
-            return fps
-        elif command == "get-serial-number":
-            reply_length = 8 # number of bytes
-            hex_values_rsp = [hex_value[2:] for hex_value in hex_response[-reply_length-2:-2]]
-            serialNumber_hex = "".join(hex_values_rsp[2:4])
-            serialNumber = int(serialNumber_hex,16)
-            return serialNumber
-        elif command == "get-CMOS-bit-depth":
-            reply_length = 2 # number of bytes
-            hex_values_rsp = [hex_value[2:] for hex_value in hex_response[-reply_length-2:-2]]
-            resp_hex = int(hex_values_rsp[1],16)          
-            if resp_hex == 0 : return 14
-            elif resp_hex == 1:  return 8
+    def _command(self, name, value=None):
+        command = commands[name]
+        return command.decodeResponse(self._channel.query(command.args(value)))
+
+    def _commandBatch(self, calls, tolerant=False):
+        # calls: list of (command name, value), sent to the camera in one batch.
+        # With tolerant=True a reply that cannot be decoded gives None instead of an error.
+        responses = self._channel.queryBatch([commands[name].args(value) for name, value in calls])
+        values = []
+        for (name, _), response in zip(calls, responses):
+            try:
+                values.append(commands[name].decodeResponse(response))
+            except Exception:
+                if not tolerant: raise
+                values.append(None)
+        return values
+
+    def close(self):
+        # Close the Tau control channel
+        self._channel.close()
+
+    ### CONFIGURATION ###
+    # Writes and read-backs are ordered as they must be applied: the FPS first,
+    # because an FPS change resets the gain, then gain, integration time and priority.
+    _configOrder = ["fps", "gain", "int_time_ms", "priority"]
+    _registerReads = {
+        "fps": "get-FPS",
+        "gain": "get-Gain",
+        "int_time_ms": "get-int-time",
+        "priority": "get-Priority",
+        "cmos_bits": "get-CMOS-bit-depth",
+        "serial": "get-serial-number",
+    }
+    _registerWrites = {
+        "fps": "set-FPS",
+        "gain": "set-Gain",
+        "int_time_ms": "set-int-time",
+        "priority": "set-Priority",
+        "cmos_bits": "set-CMOS-bit-depth",
+    }
+
+    def _configMatches(self, param, requested, actual):
+        if actual is None: return False
+        if param == "int_time_ms":
+            return abs(actual - requested)/requested < 0.02 # Tolerate 2% difference
+        return actual == requested
+
+    def configure(self, fps=None, gain=None, int_time_ms=None, priority=None, settleTimeout=2.0):
+        requested = {"fps": fps, "gain": gain, "int_time_ms": int_time_ms, "priority": priority}
+        requested = {param: requested[param] for param in self._configOrder if requested[param] is not None}
+        if not requested: return {}
+        if "gain" in requested and requested["gain"] not in self._validGainModes:
+            raise Exception("Invalid gain mode. Options: high, medium, low")
+        if "priority" in requested and requested["priority"] not in priorities:
+            raise Exception("Invalid priority. Options: Integration, Readout")
+        # Skip the parameters that the register cache already holds at the requested value.
+        # A write also resets its dependents (e.g. FPS -> gain), so those are written again.
+        actual = {}
+        if self._cache is not None:
+            for param in requested:
+                found, value = self._cache.get(param)
+                if found and self._configMatches(param, requested[param], value):
+                    actual[param] = value
+            for param in self._configOrder:
+                if param in requested and param not in actual:
+                    for dependent in self._cache.invalidates.get(param, ()):
+                        actual.pop(dependent, None)
+        toWrite = {param: requested[param] for param in requested if param not in actual}
+        if toWrite:
+            if self._cache is not None:
+                for param in toWrite: self._cache.written(param)
+            actual.update(self._applyConfig(toWrite, settleTimeout))
+            if self._cache is not None:
+                for param in toWrite: self._cache.confirm(param, actual[param])
+        # Record the new state
+        if "fps" in requested:
+            self.fps = actual["fps"]
+            print(f"Frame rate set to: {actual['fps']}")
+        if "gain" in requested:
+            self.gainMode = actual["gain"]
+            self.wellSize = self._wellSizes[self.gainMode]
+            self.quantizationStepSize = self.wellSize / (2**self.digitization)
+            print(f"Gain set to: {self.gainMode} - Wellsize: {self.wellSize} e-")
+        if "int_time_ms" in requested:
+            self.intTime_ms = actual["int_time_ms"]
+            print(f"Int. Time set to: {self.intTime_ms:.2f}ms")
+        if "priority" in requested:
+            print(f"Priority set to: {actual['priority']}")
+        return actual
+
+    def _applyConfig(self, requested, settleTimeout, fpsSwitchTime=0.5):
+        # Send every write followed by the read-back of every parameter in one batch
+        pending = list(requested)
+        t0 = time.time()
+        while True:
+            tWrite = time.time()
+            actual = self._writeAndReadConfig({param: requested[param] for param in pending}, requested)
+            pending = self._configMismatches(requested, actual)
+            # The camera may still be switching frame rate: poll the read-back for a while before writing again
+            while "fps" in pending and time.time()-tWrite < fpsSwitchTime and time.time()-t0 < settleTimeout:
+                time.sleep(0.1)
+                actual = self._writeAndReadConfig({}, requested)
+                pending = self._configMismatches(requested, actual)
+            if not pending: return actual
+            if time.time()-t0 >= settleTimeout:
+                raise Exception(f"Error on configuring the camera! Not accepted: {', '.join(pending)}")
+            # Write again whatever was not accepted (or was reset by the FPS change)
+
+    def refresh(self):
+        # Drop the register cache and read every cached parameter again in one batch
+        params = [param for param in self._registerReads if param != "serial"]
+        actual = self._writeAndReadConfig({}, params)
+        if self._cache is not None:
+            self._cache.invalidate()
+            for param in params: self._cache.confirm(param, actual[param])
+        return actual
+
+    def _readRegister(self, param):
+        if self._cache is not None:
+            found, value = self._cache.get(param)
+            if found: return value
+        value = self._command(self._registerReads[param])
+        if self._cache is not None: self._cache.confirm(param, value)
+        return value
+
+    def _writeAndReadConfig(self, writes, reads):
+        writes = [(self._registerWrites[param], value) for param, value in writes.items()]
+        params = list(reads)
+        values = self._commandBatch(writes + [(self._registerReads[param], None) for param in params], tolerant=True)
+        return dict(zip(params, values[len(writes):]))
+
+    def _configMismatches(self, requested, actual):
+        return [param for param in requested if not self._configMatches(param, requested[param], actual[param])]
 
-    
     def setSensorGain(self, gainMode):
-        if gainMode not in self._validGainModes: 
-            raise "Invalid gain mode. Options: high, medium, low"
-        else:
-            self.gainMode = gainMode
-            subprocess.run(["ssh", cameraAddress, cameraCommand,"ED",f"020E00140000000{self._validGainModes[gainMode]}","-d 2"], capture_output=True)
-            if self.getSensorGain() == gainMode : 
-                self.wellSize = self._wellSizes[gainMode]
-                self.quantizationStepSize = self.wellSize / (2**self.digitization)
-                print(f"Gain set to: {gainMode} - Wellsize: {self.wellSize} e-")
-            else:
-                raise "Error on setting the gain!"
+        self.configure(gain=gainMode)
             
     def setIntTime(self, int_time_ms):
-        multiplier = 5707.807
-        result = int(int_time_ms * multiplier)
-        # Convert decimal number to hexadecimal and remove '0x' prefix
-        hexadecimal_string = hex(result)[2:]
-        # Ensure the hexadecimal string has 8 digits by padding with zeros if necessary
-        hexadecimal_string = hexadecimal_string.zfill(8)
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"A1",hexadecimal_string,"-d 2"], capture_output=True)
-        # Now check if the gain change was accepted
-        intTimeFromCamera = self.getIntTime()
-        if abs(intTimeFromCamera - int_time_ms)/int_time_ms < 0.02 : # Tolerate 1% difference
-            print(f"Int. Time set to: {intTimeFromCamera:.2f}ms")
-            self.intTime_ms = intTimeFromCamera
-        else:
-            raise "Error on setting the integration time!"
+        self.configure(int_time_ms=int_time_ms)
 
     def setPriority(self, priority):
-        X = {"Integration":1, "Readout":2}
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"ED",f"020E011A0000000{X[priority]}","-d 2"], capture_output=True)
-        # Now check if the change was accepted
-        actualPriority = self.getPriority()
-        if actualPriority ==  priority: 
-            print(f"Priority set to: {priority}")
-        else:
-            raise "Error on setting the priority!"
+        self.configure(priority=priority)
 
     def setFPS(self, fps):
-        # Convert to hexadecimal with leading '0x' prefix
-        fps_hex = hex(fps)
-        # Extract the hexadecimal part without the '0x' prefix
-        fps_hex = fps_hex[2:]
-        # Ensure the hexadecimal string is two digits by padding with leading zeros if necessary
-        fps_hex = fps_hex.zfill(2)
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"ED",f"021000{fps_hex}0001000102000280","-d 2"], capture_output=True)
-        # Now check if the gain change was accepted
-        time.sleep(1)
-        actualFPS = self.getFPS()
-        if actualFPS ==  fps: 
-            print(f"Frame rate set to: {fps}")
-        else:
-            raise "Error on setting the frame rate!"
+        self.configure(fps=fps)
         
     def setCMOSBitDepth(self, bits):
-        # Options
-        options = {14: 0, 8: 1}
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"12",f"060{options[bits]}","-d 2"], capture_output=True)
+        if self._cache is not None:
+            found, value = self._cache.get("cmos_bits")
+            if found and value == bits: return
+            self._cache.written("cmos_bits")
+        self._command("set-CMOS-bit-depth", bits)
         # Now check if the gain change was accepted
         time.sleep(2/30)
         actualCMOSBitsDepth = self.getCMOSBitDepth()
@@ -262,147 +274,234 @@ class tauSWIRcamera:
         else:
             raise "Error on setting the CMOS bit depth!"
         
-    def setFPATempSetPoint(self,n, plot=False):
+    def setFPATempSetPoint(self,n, plot=False, tolerance=0.2, timeout=60, pollInterval=0.25):
         # The temperature setpoint is set based on the information provided in the "Table 3-4, TEC Control Table Showing Default Values", page 17 of the Tau-Swir-Product-specificaiton
-        FPA_temp_setpoint_options = [0, 20, 40, 45] #oC
-        FPA_temp_tolerance_max = [2,22,42, 75] #oC
-        FPA_temp_tolerance_min = [-40,18,38,43] #oC
-        FPA_temp_setpoint = FPA_temp_setpoint_options[n]
         print("Previous TEC parameters:")
         self.getTECparam()
-        subprocess.run(["ssh", cameraAddress, cameraCommand,"ED",f"020F0001000{n}","-d 2"], capture_output=True)
-        time.sleep(2/30)
-        # Now check if the set point was accepted
-        print("New TEC parameters:")
-        self.getTECparam()
-        # Wait until temperature is close to set point
-        temp_actual = self.getFPAtemp()
-        # condition = temp_actual<=FPA_temp_tolerance_max[n] and temp_actual>=FPA_temp_tolerance_min[n] 
-        condition = abs(self.getFPAtemp() - FPA_temp_setpoint) < .2
-        t0 = time.time()
-        timeOut = False
-        temp_values = []
-        time_values = []
-
-        while(condition==False and timeOut==False):
-            temp_actual = self.getFPAtemp()
-            time_values.append(time.time()-t0)
-            temp_values.append(temp_actual)
-            # condition = temp_actual<=FPA_temp_tolerance_max[n] and temp_actual>=FPA_temp_tolerance_min[n] 
-            condition = abs(self.getFPAtemp() - FPA_temp_setpoint) < .2
-            print(f"Current temp (oC): {temp_actual}, Set-point: {FPA_temp_setpoint} - delta: {(temp_actual-FPA_temp_setpoint):.1f}     ", end="\r") 
-            time.sleep(.5)
-            temp_actual = self.getFPAtemp()
-            condition = temp_actual<=FPA_temp_tolerance_max[n] and temp_actual>=FPA_temp_tolerance_min[n] 
-            print(f"Current temp (oC): {temp_actual}, Set-point: {FPA_temp_setpoint} - delta: {(temp_actual-FPA_temp_setpoint):.1f} ...", end="\r") 
-            time.sleep(.5)
-            if time.time()-t0 > 60: 
-                timeOut=True
-                print("Warning: TEC failed to achieve setpoint temperature!!!")
-                print("Review TEC parameters:")
-                self.getTECparam()
-        time.sleep(1)
+        engine = self._settleFPATemp(n, tolerance, timeout, pollInterval, verbose=True)
+        self._reportSettle(engine)
+        time_values, temp_values = engine.trace
         if plot == True:
             fig, ax = plt.subplots()
             ax.set_xlabel('Time (s)')
             ax.set_ylabel('FPA Temperature (oC)')
             ax.plot(time_values, temp_values, color='blue')
+        return time_values, temp_values
+
+    def _settleFPATemp(self, n, tolerance, timeout, pollInterval, verbose=False):
+        # Sends the set point and waits until the fitted FPA temperature trajectory reaches it
+        # (see tec_settle.py). Shared by setFPATempSetPoint and asetFPATempSetPoint
+        engine = tecSettleEngine(FPA_setPointTemps[n], tolerance=tolerance, timeout=timeout)
+        self._command("set-TEC-setpoint", n)
+        time.sleep(2/30)
+        if verbose:
+            # Now check if the set point was accepted
+            print("New TEC parameters:")
+            self.getTECparam()
+        t0 = time.time()
+        while True:
+            temp_actual = self.getFPAtemp()
+            if engine.add(time.time()-t0, temp_actual): break
+            if verbose: self._printSettle(engine, temp_actual)
+            time.sleep(pollInterval)
+        self.tecSettle = engine
+        if engine.settled:
+            self.fpaTempSetPoint = engine.setpoint
+        return engine
+
+    def _printSettle(self, engine, temp_actual):
+        remaining = engine.remaining()
+        remaining = f" - est. {remaining:.0f}s left" if remaining is not None else ""
+        print(f"Current temp (oC): {temp_actual}, Set-point: {engine.setpoint} - delta: {(temp_actual-engine.setpoint):.1f}{remaining}     ", end="\r")
+
+    def _reportSettle(self, engine):
+        time_values, temp_values = engine.trace
+        if engine.settled: 
+            print(f"FPA temperature settled at {temp_values[-1]}oC (set-point: {engine.setpoint}oC) after {time_values[-1]:.1f}s")
+        else:
+            print("Warning: TEC failed to achieve setpoint temperature!!!")
+            if engine.reason == "stalled":
+                print(f"FPA temperature is levelling off at {engine.T_inf:.1f}oC")
+            print("Review TEC parameters:")
+            self.getTECparam()
 
     def getFPS(self):
-        ans = subprocess.run(["ssh", cameraAddress, cameraCommand,"ED","0114","-d 2"], capture_output=True)
-        hex_response = extract_hex_values_from_response(ans.stderr.decode())
-        return self._decode_tau_response(hex_response, "get-FPS")
+        return self._readRegister("fps")
 
     def getPriority(self):
-        ans = subprocess.run(["ssh", cameraAddress, cameraCommand,"ED","0112011A00000000","-d 2"], capture_output=True)
-        hex_response = extract_hex_values_from_response(ans.stderr.decode())
-        return self._decode_tau_response(hex_response, "get-Priority")
+        return self._readRegister("priority")
         
     def getTECparam(self):
-        ans = subprocess.run(["ssh", cameraAddress, cameraCommand,"ED","0113","-d 2"], capture_output=True)
-        hex_response = extract_hex_values_from_response(ans.stderr.decode())
-        self._decode_tau_response(hex_response, "get-TEC-param")
+        TECisON, FPA_setPointTemp = self._command("get-TEC-param")
+        print("TEC is ON") if TECisON else print("TEC is OFF")
+        print(f"FPA set point temperature (oC): {FPA_setPointTemp}")
+        return TECisON, FPA_setPointTemp
 
     def getFPAtemp(self):
-        ans = subprocess.run(["ssh", cameraAddress, cameraCommand, "20","0000","-d 2"], capture_output=True)
-        hex_response = extract_hex_values_from_response(ans.stderr.decode())
-        return self._decode_tau_response(hex_response, "get-FPA-temp")
+        return self._command("get-FPA-temp")
     
     def getSerialNumber(self):
-        ans = subprocess.run(["ssh", cameraAddress, cameraCommand, "04","-d 2"], capture_output=True)
-        hex_response = extract_hex_values_from_response(ans.stderr.decode())
-        return self._decode_tau_response(hex_response, "get-serial-number")
+        return self._readRegister("serial")
     
     def getCMOSBitDepth(self):
-        ans = subprocess.run(["ssh", cameraAddress, cameraCommand, "12","0800","-d 2"], capture_output=True)
-        hex_response = extract_hex_values_from_response(ans.stderr.decode())
-        return self._decode_tau_response(hex_response, "get-CMOS-bit-depth")
+        return self._readRegister("cmos_bits")
 
     def getSensorGain(self):
-        ans = subprocess.run(["ssh", cameraAddress, cameraCommand, "ED","0112001400000000","-d 2"], capture_output=True)
-        hex_response = extract_hex_values_from_response(ans.stderr.decode())
-        return self._decode_tau_response(hex_response, "get-Gain")
+        return self._readRegister("gain")
 
     def getIntTime(self):
-        ans = subprocess.run(["ssh", cameraAddress, cameraCommand, "A1","-d 2"], capture_output=True)
-        hex_response = extract_hex_values_from_response(ans.stderr.decode())
-        return self._decode_tau_response(hex_response, "get-int-time")
+        return self._readRegister("int_time_ms")
+
+    ### ASYNCIO CONTROL ###
+    # Async variants of the getters and setters, e.g. `await cam.agetFPAtemp()`.
+    # The commands go through the same control channel as the synchronous methods
+    # (its lock keeps one command at a time on the camera serial port), but run in a
+    # worker thread, so the event loop stays free: the TECs of both cameras can settle
+    # concurrently with asyncio.gather while telemetry is polled and a data stream runs.
+    async def _acall(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    async def agetFPS(self):
+        return await self._acall(self.getFPS)
+
+    async def agetPriority(self):
+        return await self._acall(self.getPriority)
+
+    async def agetTECparam(self):
+        return await self._acall(self._command, "get-TEC-param")
+
+    async def agetFPAtemp(self):
+        return await self._acall(self.getFPAtemp)
+
+    async def agetSerialNumber(self):
+        return await self._acall(self.getSerialNumber)
+
+    async def agetCMOSBitDepth(self):
+        return await self._acall(self.getCMOSBitDepth)
+
+    async def agetSensorGain(self):
+        return await self._acall(self.getSensorGain)
+
+    async def agetIntTime(self):
+        return await self._acall(self.getIntTime)
+
+    async def aconfigure(self, **settings):
+        return await self._acall(self.configure, **settings)
+
+    async def asetSensorGain(self, gainMode):
+        await self.aconfigure(gain=gainMode)
+
+    async def asetIntTime(self, int_time_ms):
+        await self.aconfigure(int_time_ms=int_time_ms)
+
+    async def asetPriority(self, priority):
+        await self.aconfigure(priority=priority)
+
+    async def asetFPS(self, fps):
+        await self.aconfigure(fps=fps)
+
+    async def asetCMOSBitDepth(self, bits):
+        await self._acall(self.setCMOSBitDepth, bits)
+
+    async def asetFPATempSetPoint(self, n, tolerance=0.2, timeout=60, pollInterval=0.25):
+        # Same as setFPATempSetPoint, with the settle loop in a worker thread.
+        # Returns the recorded trace: (time_values, temp_values)
+        engine = await self._acall(self._settleFPATemp, n, tolerance, timeout, pollInterval)
+        if not engine.settled:
+            print(f"Warning: TEC failed to achieve setpoint temperature ({engine.setpoint}oC): {engine.reason}")
+        return engine.trace
+
+    async def acollectFrame(self, numFrames, filename = "", returnFPAtemp = False):
+        return await self._acall(self.collectFrame, numFrames, filename, returnFPAtemp)
     
-    def darkFrameMeanCounts(self):
-        darkCurrent = self.darkCurrentDensity * 1e-9 * self.detectorArea_cm2 * 6.242e18 # e-/s/px
-        electrons =  self.intTime_ms * 1e-3 * darkCurrent
-        counts = round(electrons/self.quantizationStepSize)
+    def _noiseAtCurrentSettings(self, fpaTemp):
+        fpaTemp = self.fpaTempSetPoint if fpaTemp is None else fpaTemp
+        return self.noiseModel.evaluate([self.gainMode], [self.intTime_ms], [fpaTemp], [0.0])
+
+    def darkFrameMeanCounts(self, fpaTemp=None):
+        # Expected dark signal (DN above the bias) at the current gain / integration time
+        counts = round(float(np.mean(self._noiseAtCurrentSettings(fpaTemp)["dark_DN"])))
         if counts > (2**self.digitization): counts = 2**self.digitization - 1
         return counts
-    
-    def getNoiseCount_Std(self):
-        if self.gainMode == "high":
-            NEI_ref = self.ref_NEI_highGain   # photons/cm2/s
-            t_ref = self.ref_IntTime_highGain #ms
-        elif self.gainMode == "medium":
-            NEI_ref = self.ref_NEI_highGain   # photons/cm2/s
-            t_ref = self.ref_IntTime_highGain #ms
-        elif self.gainMode == "low":
-            NEI_ref = self.ref_NEI_lowGain   # photons/cm2/s
-            t_ref = self.ref_IntTime_lowGain #ms
-
-        NEI_electronsFlux = NEI_ref * self.detectorArea_cm2 * self.QE * math.sqrt(t_ref/self.intTime_ms) # e-/s
-        NOISE_electrons = NEI_electronsFlux * self.intTime_ms * 1e-3 # e-
-        counts = round(NOISE_electrons/self.quantizationStepSize)
-        return counts
 
-    def collectFrame(self, numFrames, filename = "", returnFPAtemp = False):
+    def getNoiseCount_Std(self, fpaTemp=None):
+        # Expected temporal noise of a dark frame (DN) at the current gain / integration time
+        return round(float(np.mean(self._noiseAtCurrentSettings(fpaTemp)["noise_DN"])))
+
+    def setFrameCorrection(self, corrector):
+        # frame_correction.frameCorrector applied to every frame of collectFrame (None to disable),
+        # e.g. frameCorrector.fromStore(store, self.name, self.gainMode, self.fpaTempSetPoint, self.intTime_ms).
+        # collectFrame checks it against the current settings (see _currentFrameCorrection)
+        self._frameCorrection = corrector
+
+    def _currentSettings(self):
+        # Gain, integration time, FPA temperature set point and FPS the camera is at
+        if not all(hasattr(self, name) for name in ("fps", "gainMode", "intTime_ms")):
+            state = self.refresh() # one batch read of the current settings
+            self.fps, self.gainMode, self.intTime_ms = state["fps"], state["gain"], state["int_time_ms"]
+        return {"gain": self.gainMode, "int_time_ms": self.intTime_ms, "fpa_temp": self.fpaTempSetPoint, "fps": self.fps}
+
+    def _currentFrameCorrection(self):
+        # The frame correction for the current settings: rebuilt from its calibration store after
+        # a configure()/setIntTime()/TEC change, an error if it cannot be
+        corrector = self._frameCorrection
+        if corrector is None or corrector.settings is None: return corrector
+        settings = self._currentSettings()
+        if corrector.matches(**settings): return corrector
+        rebuilt = corrector.forSettings(**settings)
+        if rebuilt is None:
+            self._frameCorrection = None
+            raise Exception(f"Frame correction built for {corrector.settings} does not match the camera settings {settings}. "
+                            "Set a new one with setFrameCorrection")
+        print(f"Frame correction rebuilt for {settings['gain']} gain, {settings['int_time_ms']:.2f}ms, {settings['fpa_temp']}oC")
+        self._frameCorrection = rebuilt
+        return rebuilt
+
+    def iterFrames(self, numFrames=None):
+        # Yields the raw frames of one acquisition stream as they arrive, without keeping
+        # them (numFrames=None: until the generator is closed), e.g. for streaming statistics
         # Open the stream of data
         stream = socket(AF_INET, SOCK_STREAM)
         stream.connect((self.hostname, self.port))
         msg = Message(stream)
-        # Collect frames
         N = 0
+        try:
+            while numFrames is None or N < numFrames+1: # (Bruno) I added one to skip the first frame (because it's usually bad)
+                if not msg.decode(): continue
+                frame = _process_message(msg.buffer)
+
+                if 'SWIR' in frame:
+                    N +=1
+                    if N==1: # Skip the first frame
+                        continue
+                    yield frame["SWIR"]
+                elif 'Queue_Length' in frame:
+                    if frame['Queue_Length']>100:
+                        print(f"WARNING: Possible sync error! Queue Usage: {frame['Queue_Length']}MB")
+        finally:
+            # Close the stream of data
+            stream.close()
+
+    def collectFrame(self, numFrames, filename = "", returnFPAtemp = False):
+        # Collect frames
         imglist = []
         fpaTemp = np.array([])
-        
-        while N < numFrames+1: # (Bruno) I added one to skip the first frame (because it's usually bad)
-            if not msg.decode(): continue
-            frame = _process_message(msg.buffer)
-
-            if 'SWIR' in frame:
-                N +=1
-                if N==1: # Skip the first frame
-                    continue
-                imglist.append(frame["SWIR"])
-                if returnFPAtemp == True:
-                    temp_actual = self.getFPAtemp()
-                    fpaTemp = np.append(fpaTemp, temp_actual)
-            elif 'Queue_Length' in frame:
-                if frame['Queue_Length']>100:
-                    print(f"WARNING: Possible sync error! Queue Usage: {frame['Queue_Length']}MB")
-
-        # Close the stream of data
-        # print(" ")
-        stream.close()
+        corrector = self._currentFrameCorrection()
+        for k, frame in enumerate(self.iterFrames(numFrames)):
+            if corrector is not None:
+                # Corrected in place into a stack allocated once
+                if isinstance(imglist, list):
+                    imglist = np.empty((numFrames,) + corrector.shape, dtype=np.float32)
+                corrector.apply(frame, out=imglist[k])
+            else:
+                imglist.append(frame)
+            if returnFPAtemp == True:
+                temp_actual = self.getFPAtemp()
+                fpaTemp = np.append(fpaTemp, temp_actual)
+
+        frames = imglist if isinstance(imglist, np.ndarray) else np.stack(imglist)
         if returnFPAtemp == True:
-            return np.stack(imglist), fpaTemp
+            return frames, fpaTemp
         else:
-            return np.stack(imglist)
-
-
+            return frames
@@ -0,0 +1,52 @@
+### TAU REGISTER CACHE ###
+# Keeps the last value of each Tau parameter that was confirmed by a read-back,
+# so the camera class can skip writes and reads that would not change anything.
+#
+# Invalidation rules:
+#   - writing a parameter invalidates it until its read-back confirms the new value
+#   - writing a parameter also invalidates every parameter listed for it in
+#     `invalidates` (an FPS change resets the gain and may clamp the integration time)
+#   - invalidate() with no arguments drops everything, e.g. after a camera power
+#     cycle or when the camera was changed by another program
+# Live readings (FPA temperature, TEC status) are never cached.
+
+class tauRegisterCache(object):
+    invalidates = {
+        "fps": ("gain", "int_time_ms"),
+    }
+
+    def __init__(self):
+        self._values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def get(self, name):
+        # Returns (found, value)
+        if name in self._values:
+            self.hits += 1
+            return True, self._values[name]
+        self.misses += 1
+        return False, None
+
+    def confirm(self, name, value):
+        if value is None:
+            self._values.pop(name, None)
+        else:
+            self._values[name] = value
+
+    def written(self, name):
+        self._values.pop(name, None)
+        for dependent in self.invalidates.get(name, ()):
+            self._values.pop(dependent, None)
+
+    def invalidate(self, *names):
+        if not names:
+            self._values.clear()
+        for name in names:
+            self._values.pop(name, None)
+
+    def snapshot(self):
+        return dict(self._values)
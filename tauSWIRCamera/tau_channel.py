@@ -0,0 +1,197 @@
+import os
+import selectors
+import subprocess
+import threading
+import time
+import uuid
+
+
+### TAU CONTROL CHANNELS ###
+# A channel takes the arguments of one taucmd call (e.g. ["ED","0114"]) and
+# returns the text printed by taucmd, which is then parsed by the camera class.
+#
+# tauOneShotChannel keeps the original behaviour: a new ssh process (process
+# spawn + SSH handshake) for every command.
+# tauControlChannel keeps a single ssh session open with a remote shell reading
+# commands from stdin. Each command is written as one line followed by an echo of
+# a unique marker, so the responses can be streamed back over the same channel.
+#
+# Both channels also accept a batch of commands (queryBatch), which is sent to the
+# board in one remote invocation and returns one response per command.
+#
+# Channels are thread-safe: a lock keeps a single command (or batch) on the
+# camera serial port at a time, which lets the camera's asyncio methods run
+# commands from worker threads.
+
+def _split_by_markers(text, markers):
+    # Split the output of a batch on the end markers echoed after each command
+    responses = []
+    for marker in markers:
+        idx = text.find(marker)
+        if idx < 0:
+            raise ConnectionError("Incomplete response to a batch of Tau commands")
+        responses.append(text[:idx])
+        end = text.find("\n", idx)
+        text = text[end+1:] if end >= 0 else ""
+    return responses
+
+
+class tauOneShotChannel(object):
+
+    def __init__(self, address, command):
+        self.address = address
+        self.command = command
+        self.nCommands = 0
+        self._lock = threading.Lock()
+
+    def query(self, args):
+        with self._lock:
+            return self._query(args)
+
+    def queryBatch(self, argsList):
+        with self._lock:
+            return self._queryBatch(argsList)
+
+    def _query(self, args):
+        ans = subprocess.run(["ssh", self.address, self.command, *args, "-d 2"], capture_output=True)
+        self.nCommands += 1
+        return ans.stderr.decode()
+
+    def _queryBatch(self, argsList):
+        # One ssh process running every command of the batch in sequence
+        markers = [f"__TAUCMD_DONE_{n}__" for n in range(len(argsList))]
+        script = "".join(f"{self.command} {' '.join(args)} -d 2 2>&1; echo {marker} $?\n"
+                         for args, marker in zip(argsList, markers))
+        ans = subprocess.run(["ssh", self.address, "sh"], input=script.encode(), capture_output=True)
+        self.nCommands += len(argsList)
+        return _split_by_markers(ans.stdout.decode(errors="replace"), markers)
+
+    def close(self):
+        pass
+
+
+class tauControlChannel(object):
+
+    def __init__(self, address, command, timeout=10):
+        self.address = address
+        self.command = command
+        self.timeout = timeout # s, maximum wait for a single response
+        self.nCommands = 0
+        self._proc = None
+        self._selector = None
+        self._pending = b""
+        self._session = uuid.uuid4().hex[:8]
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _spawnArgs(self):
+        # -T: no pseudo-terminal, so the remote shell does not echo our commands back
+        return ["ssh", "-T", "-o", "ServerAliveInterval=15", self.address, "sh"]
+
+    @property
+    def isOpen(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def open(self):
+        if self.isOpen: return
+        self._proc = subprocess.Popen(self._spawnArgs(), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL, bufsize=0)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._proc.stdout, selectors.EVENT_READ)
+        self._pending = b""
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._proc is None: return
+        try:
+            self._proc.stdin.write(b"exit\n")
+            self._proc.stdin.close()
+            self._proc.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            self._proc.kill()
+            self._proc.wait()
+        self._cleanup()
+
+    def _kill(self):
+        if self._proc is None: return
+        self._proc.kill()
+        self._proc.wait()
+        self._cleanup()
+
+    def _cleanup(self):
+        self._selector.close()
+        if not self._proc.stdin.closed: self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._proc = None
+        self._selector = None
+        self._pending = b""
+
+    def _marker(self):
+        self.nCommands += 1
+        return f"__TAUCMD_DONE_{self._session}_{self.nCommands}__"
+
+    def _commandLine(self, args, marker):
+        # stderr is merged into stdout because taucmd prints the Tau response on stderr
+        return f"{self.command} {' '.join(args)} -d 2 2>&1; echo {marker} $?\n"
+
+    def _readUntil(self, marker):
+        token = marker.encode()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            idx = self._pending.find(token)
+            if idx >= 0:
+                end = self._pending.find(b"\n", idx)
+                if end >= 0:
+                    text = self._pending[:idx]
+                    self._pending = self._pending[end+1:]
+                    return text.decode(errors="replace")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No response from {self.address} after {self.timeout}s")
+            if not self._selector.select(remaining): continue
+            chunk = os.read(self._proc.stdout.fileno(), 65536)
+            if not chunk:
+                raise ConnectionError(f"Control channel to {self.address} closed")
+            self._pending += chunk
+
+    def query(self, args):
+        with self._lock:
+            return self._query(args)
+
+    def queryBatch(self, argsList):
+        with self._lock:
+            return self._queryBatch(argsList)
+
+    def _query(self, args):
+        # If the session dropped (network hiccup, camera board reboot) reconnect once and resend
+        for attempt in range(2):
+            self.open()
+            marker = self._marker()
+            try:
+                self._proc.stdin.write(self._commandLine(args, marker).encode())
+                return self._readUntil(marker)
+            except (OSError, ConnectionError):
+                self._kill()
+                if attempt: raise
+
+    def _queryBatch(self, argsList):
+        # Write the whole batch at once, then collect the responses in order
+        for attempt in range(2):
+            self.open()
+            markers = [self._marker() for args in argsList]
+            try:
+                self._proc.stdin.write("".join(self._commandLine(args, marker)
+                                               for args, marker in zip(argsList, markers)).encode())
+                return [self._readUntil(marker) for marker in markers]
+            except (OSError, ConnectionError):
+                self._kill()
+                if attempt: raise
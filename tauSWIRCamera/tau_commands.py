@@ -0,0 +1,103 @@
+import re
+from collections import namedtuple
+
+
+### TAU COMMAND REGISTRY ###
+# Every Tau command used by the driver is described once here, with:
+#   function     - Tau function code, as passed to taucmd
+#   prefix       - fixed leading part of the argument (hex string)
+#   encode       - value -> hex string appended to the prefix (None for commands without a value)
+#   replyLength  - number of data bytes in the reply (0 when the reply is not used)
+#   decode       - reply data (bytes) -> value
+# Setters and getters of the camera class, the setup script and the batched
+# configuration all build their taucmd arguments and decode their replies from this table.
+
+gainModes = {"high":0,"medium":1,"low":2}
+priorities = {"Integration":1, "Readout":2}
+bitDepths = {14: 0, 8: 1}
+FPA_setPointTemps = [0, 20, 40, 45] #oC, "Table 3-4, TEC Control Table Showing Default Values" of the Tau-Swir-Product-specificaiton
+
+intTimeTicksPerMs_write = 5707.807
+intTimeTicksPerMs_read = 5704.807
+
+class tauCommand(namedtuple("tauCommand", ["function", "prefix", "encode", "replyLength", "decode"])):
+
+    def args(self, value=None):
+        data = self.prefix
+        if self.encode is not None:
+            data += self.encode(value)
+        return [self.function, data] if data else [self.function]
+
+    def decodeResponse(self, text):
+        # Decode the taucmd output of this command
+        if self.decode is None: return None
+        return self.decodeReply(parse_tau_reply(text))
+
+    def decodeReply(self, reply):
+        # The reply ends with the data bytes followed by the 2-byte CRC
+        if self.decode is None: return None
+        if len(reply) < self.replyLength + 2:
+            raise Exception(f"Short reply from Tau: expected {self.replyLength} data bytes, got {reply.hex()}")
+        return self.decode(reply[-self.replyLength-2:-2])
+
+def _uint(data):
+    return int.from_bytes(data, byteorder='big')
+
+def _decode_gain(data):
+    gainN = data[-1] & 0x0F
+    return next((mode for mode, n in gainModes.items() if n == gainN), None)
+
+def _decode_priority(data):
+    X = data[-1] & 0x0F
+    return next((p for p, n in priorities.items() if n == X), -1)
+
+def _decode_TEC_param(data):
+    # (TEC is ON, FPA set point temperature in oC)
+    return data[3] == 0x01, FPA_setPointTemps[data[5]]
+
+def _decode_CMOS_bit_depth(data):
+    return next((bits for bits, n in bitDepths.items() if n == data[1]), None)
+
+commands = {
+    # Getters
+    "get-int-time":       tauCommand("A1", "", None, 4, lambda data: _uint(data) / intTimeTicksPerMs_read),
+    "get-FPA-temp":       tauCommand("20", "0000", None, 2, lambda data: int.from_bytes(data, byteorder='big', signed=True) / 10),
+    "get-TEC-param":      tauCommand("ED", "0113", None, 6, _decode_TEC_param),
+    "get-Gain":           tauCommand("ED", "0112001400000000", None, 8, _decode_gain),
+    "get-Priority":       tauCommand("ED", "0112011A00000000", None, 8, _decode_priority),
+    "get-FPS":            tauCommand("ED", "0114", None, 12, lambda data: data[3]),
+    "get-serial-number":  tauCommand("04", "", None, 8, lambda data: _uint(data[2:4])),
+    "get-CMOS-bit-depth": tauCommand("12", "0800", None, 2, _decode_CMOS_bit_depth),
+    # Setters
+    "set-int-time":       tauCommand("A1", "", lambda ms: f"{int(ms * intTimeTicksPerMs_write):08x}", 0, None),
+    "set-Gain":           tauCommand("ED", "020E0014", lambda mode: f"{gainModes[mode]:08x}", 0, None),
+    "set-Priority":       tauCommand("ED", "020E011A", lambda priority: f"{priorities[priority]:08x}", 0, None),
+    "set-FPS":            tauCommand("ED", "021000", lambda fps: f"{fps:02x}0001000102000280", 0, None),
+    "set-CMOS-bit-depth": tauCommand("12", "06", lambda bits: f"{bitDepths[bits]:02x}", 0, None),
+    "set-TEC-setpoint":   tauCommand("ED", "020F0001", lambda n: f"{n:04x}", 0, None),
+    # Setup
+    "set-analog-mode":    tauCommand("0F", "", lambda code: f"{code:04x}", 0, None),
+    "set-sync-mode":      tauCommand("21", "", lambda mode: {"DISABLED": "0000", "SLAVE": "0001", "MASTER": "0002"}[mode], 0, None),
+    "set-AGC":            tauCommand("13", "", lambda code: f"{code:04x}", 0, None),
+    "set-brightness":     tauCommand("15", "", lambda level: f"{level:04x}", 0, None),
+    "set-contrast":       tauCommand("14", "", lambda level: f"{level:04x}", 0, None),
+    "set-auto-exposure":  tauCommand("ED", "0212", lambda enabled: f"{int(enabled):04x}", 0, None),
+    "set-CL-bit-depth":   tauCommand("12", "07", lambda bits: f"{bitDepths[bits]:02x}", 0, None),
+    "set-ITR-only":       tauCommand("ED", "020E0123", lambda enabled: f"{int(enabled):08x}", 0, None),
+    "save-settings":      tauCommand("01", "", None, 0, None),
+}
+
+
+### RESPONSE PARSER ###
+# taucmd prints "Received response from Tau (len: N)" followed by the N bytes of
+# the reply as 0x.. tokens. Only the last response of the output is used.
+_RESPONSE_TAG = "Received response from Tau (len: "
+_HEX_BYTE = re.compile(r'\b0x([0-9A-Fa-f]{2})\b')
+
+def parse_tau_reply(text):
+    idx = text.rfind(_RESPONSE_TAG)
+    if idx < 0: return b""
+    start = idx + len(_RESPONSE_TAG)
+    end = text.index(")", start)
+    length = int(text[start:end])
+    return bytes.fromhex("".join(_HEX_BYTE.findall(text, end)[:length]))
@@ -0,0 +1,192 @@
+import math
+import random
+import threading
+import time
+
+from tau_commands import (FPA_setPointTemps, bitDepths, gainModes, intTimeTicksPerMs_write)
+
+
+### TAU CONTROL-PLANE EMULATOR ###
+# Drop-in replacement for the ssh control channels (tau_channel.py) that answers
+# the Tau commands used by the camera class locally, in the same text format as
+# taucmd. It keeps the register state, simulates the TEC as a first-order system
+# and can inject latency and errors, so the driver, the sweeps and any control
+# latency work can be run and benchmarked without the camera:
+#
+#     cam = tauSWIRcamera(hostname, port, transport=tauEmulator(latency=0.05))
+#
+# Latency model: every round trip (query or batch) costs `latency` seconds plus
+# `commandLatency` seconds per command. With `errorRate` > 0 a command is dropped
+# at random (not applied, taucmd prints no response), like a serial timeout.
+# `timeScale` > 1 speeds up the simulated TEC relative to wall time.
+
+def _crc16(data):
+    # CRC-16/CCITT (XModem) used by the Tau serial protocol
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return crc
+
+def _tau_packet(function, data):
+    header = bytes([0x6E, 0x00, 0x00, function]) + len(data).to_bytes(2, byteorder='big')
+    header += _crc16(header).to_bytes(2, byteorder='big')
+    packet = header + data
+    return packet + _crc16(packet).to_bytes(2, byteorder='big')
+
+def format_tau_reply(packet):
+    # taucmd style output, as parsed by tau_commands.parse_tau_reply
+    return f"Received response from Tau (len: {len(packet)})\n" + " ".join(f"0x{byte:02X}" for byte in packet) + "\n"
+
+
+class tauEmulator(object):
+
+    def __init__(self, serialNumber=10682, latency=0.0, commandLatency=0.0, errorRate=0.0,
+                 timeScale=1.0, ambientTemp=30.0, tecTau=8.0, tempNoise=0.03, seed=None):
+        self.serialNumber = serialNumber
+        self.latency = latency              # s per round trip
+        self.commandLatency = commandLatency # s per command
+        self.errorRate = errorRate
+        self.timeScale = timeScale
+        self.tecTau = tecTau                # s, TEC time constant
+        self.tempNoise = tempNoise          # oC, std of the FPA temperature readings
+        self.nCommands = 0
+        self.nRoundTrips = 0
+        self.nErrors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+        self._lastUpdate = 0.0
+        self.registers = {
+            "fps": 30,
+            "gain": gainModes["low"],
+            "int_time_ticks": int(1 * intTimeTicksPerMs_write),
+            "priority": 1,
+            "cmos_bits": bitDepths[14],
+            "cl_bits": bitDepths[14],
+            "analog_mode": 0,
+            "sync_mode": 0,
+            "agc": 0,
+            "brightness": 0,
+            "contrast": 0,
+            "auto_exposure": 1,
+            "itr_only": 0,
+            "tec_on": 1,
+            "tec_setpoint": 1,
+        }
+        self.fpaTemp = ambientTemp
+
+    ### Channel interface ###
+    def query(self, args):
+        with self._lock:
+            self._wait(self.latency + self.commandLatency)
+            self.nRoundTrips += 1
+            return self._execute(list(args))
+
+    def queryBatch(self, argsList):
+        with self._lock:
+            self._wait(self.latency + self.commandLatency*len(argsList))
+            self.nRoundTrips += 1
+            return [self._execute(list(args)) for args in argsList]
+
+    def close(self):
+        pass
+
+    def _wait(self, seconds):
+        if seconds > 0: time.sleep(seconds)
+
+    ### Simulation ###
+    def _now(self):
+        return (time.monotonic() - self._t0) * self.timeScale
+
+    def _updateTEC(self):
+        now = self._now()
+        dt = now - self._lastUpdate
+        self._lastUpdate = now
+        if self.registers["tec_on"]:
+            target = FPA_setPointTemps[self.registers["tec_setpoint"]]
+            self.fpaTemp = target + (self.fpaTemp - target) * math.exp(-dt / self.tecTau)
+
+    def _setFPS(self, fps):
+        self.registers["fps"] = fps
+        # An FPS change puts the sensor back in low gain and clamps the integration time to the frame period
+        self.registers["gain"] = gainModes["low"]
+        maxTicks = int(1e3 / fps * intTimeTicksPerMs_write)
+        self.registers["int_time_ticks"] = min(self.registers["int_time_ticks"], maxTicks)
+
+    def _execute(self, args):
+        self.nCommands += 1
+        if self.errorRate and self._rng.random() < self.errorRate:
+            self.nErrors += 1
+            return "Error: timeout waiting for response from Tau\n"
+        function = int(args[0], 16)
+        data = bytes.fromhex(args[1]) if len(args) > 1 else b""
+        reply = self._dispatch(function, data)
+        if reply is None:
+            return f"Error: unsupported command {' '.join(args)}\n"
+        return format_tau_reply(_tau_packet(function, reply))
+
+    def _dispatch(self, function, data):
+        r = self.registers
+        if function == 0x01: # SET_DEFAULTS
+            return b""
+        elif function == 0x04: # SERIAL_NUMBER
+            return bytes(2) + self.serialNumber.to_bytes(2, byteorder='big') + bytes(4)
+        elif function == 0x0F: # VIDEO_MODE
+            r["analog_mode"] = int.from_bytes(data, byteorder='big')
+            return data
+        elif function == 0x12: # BIT_DEPTH / CMOS bit depth
+            if data[0] == 0x06: r["cmos_bits"] = data[1]
+            elif data[0] == 0x07: r["cl_bits"] = data[1]
+            elif data[0] == 0x08: return bytes([0x08, r["cmos_bits"]])
+            return data
+        elif function == 0x13: # AGC_TYPE
+            r["agc"] = int.from_bytes(data, byteorder='big')
+            return data
+        elif function == 0x14: # CONTRAST
+            r["contrast"] = int.from_bytes(data, byteorder='big')
+            return data
+        elif function == 0x15: # BRIGHTNESS
+            r["brightness"] = int.from_bytes(data, byteorder='big')
+            return data
+        elif function == 0x20: # READ_SENSOR (FPA temperature)
+            self._updateTEC()
+            temp = self.fpaTemp + self._rng.gauss(0, self.tempNoise)
+            return int(round(temp*10)).to_bytes(2, byteorder='big', signed=True)
+        elif function == 0x21: # EXTERNAL_SYNC
+            r["sync_mode"] = int.from_bytes(data, byteorder='big')
+            return data
+        elif function == 0xA1: # INTEGRATION TIME
+            if data:
+                r["int_time_ticks"] = int.from_bytes(data, byteorder='big')
+                return data
+            return r["int_time_ticks"].to_bytes(4, byteorder='big')
+        elif function == 0xED: # COOLED_CORE_COMMAND
+            return self._cooledCore(data)
+
+    def _cooledCore(self, data):
+        r = self.registers
+        if data == bytes.fromhex("0114"): # get frame rate
+            return bytes([0x01, 0x14, 0x00, r["fps"]]) + bytes.fromhex("0001000102000280")
+        elif data[:2] == bytes.fromhex("0210"): # set frame rate
+            self._setFPS(data[3])
+            return b""
+        elif data == bytes.fromhex("0113"): # get TEC parameters
+            self._updateTEC()
+            return bytes([0x01, 0x13, 0x00, r["tec_on"], 0x00, r["tec_setpoint"]])
+        elif data[:4] == bytes.fromhex("020F0001"): # set TEC set point
+            self._updateTEC()
+            r["tec_setpoint"] = data[5]
+            return b""
+        elif data[:2] == bytes.fromhex("0212"): # auto-exposure
+            r["auto_exposure"] = int.from_bytes(data[2:], byteorder='big')
+            return b""
+        registers = {0x0014: "gain", 0x011A: "priority", 0x0123: "itr_only"}
+        address = int.from_bytes(data[2:4], byteorder='big')
+        if data[:2] == bytes.fromhex("020E") and address in registers: # write sensor register
+            r[registers[address]] = int.from_bytes(data[4:8], byteorder='big')
+            return b""
+        elif data[:2] == bytes.fromhex("0112") and address in registers: # read sensor register
+            return bytes.fromhex("0112") + data[2:4] + r[registers[address]].to_bytes(4, byteorder='big')
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+### TEC SETTLE ENGINE ###
+# Decides when the FPA temperature has settled after a TEC set point change.
+# The readings are fitted online with a first-order response
+#     T(t) = T_inf + A * exp(-t/tau)
+# (for each tau of a fixed grid, refined around the best one, T_inf and A come from a
+# closed-form linear least squares; the tau with the smallest residual wins). The settle
+# is over as soon as the fitted temperature and the fitted asymptote T_inf are both within
+# `tolerance` of the set point: a first-order response cannot leave the band from there.
+# The raw readings are not required to be in the band as well, so the loop ends when the
+# fitted trajectory enters it rather than on the first in-band reading.
+# If the fit levels off outside the tolerance band the engine stops early too (stalled),
+# rather than running into the timeout. Because the asymptote of a slow response is
+# underestimated until enough of it is seen, a stall is only declared once the motion
+# left in the fit (|slope|*tau) is short of the band for `stallRefits` refits in a row,
+# spanning `stallTaus` fitted time constants.
+
+class tecSettleEngine(object):
+    _taus = np.geomspace(0.5, 600, 48) # s, candidate time constants
+
+    def __init__(self, setpoint, tolerance=0.2, minSamples=4, window=600, stallRefits=8, stallTaus=2, timeout=60):
+        self.setpoint = setpoint            # oC
+        self.tolerance = tolerance          # oC
+        self.minSamples = minSamples
+        self.window = window                # number of most recent samples used by the fit
+        self.stallRefits = stallRefits      # consecutive refits out of reach of the band before a stall
+        self.stallTaus = stallTaus          # time constants they must span
+        self.timeout = timeout              # s
+        self._t = []
+        self._T = []
+        self.settled = False
+        self.reason = None # "settled", "stalled" or "timeout" once done
+        self.T_inf = None
+        self.tau = None
+        self.slope = None
+        self.residual = None
+        self.T_now = None
+        self._stallSince = None
+        self._stallRefits = 0
+
+    @property
+    def trace(self):
+        return np.array(self._t), np.array(self._T)
+
+    def _solve(self, t, T, taus):
+        # Closed-form T_inf, A and residual sum of squares for every tau
+        # basis[k, i] = exp(-t_i/tau_k)
+        basis = np.exp(-t[None, :] / taus[:, None])
+        n = len(t)
+        sx = basis.sum(axis=1)
+        sxx = (basis*basis).sum(axis=1)
+        sy = T.sum()
+        sxy = basis @ T
+        det = n*sxx - sx*sx
+        valid = det > 1e-12 * n*n
+        det = np.where(valid, det, 1)
+        A = (n*sxy - sx*sy) / det
+        T_inf = (sy - A*sx) / n
+        rss = ((T[None, :] - T_inf[:, None] - A[:, None]*basis)**2).sum(axis=1)
+        return T_inf, A, np.where(valid, rss, np.inf), basis[:, -1]
+
+    def _fit(self):
+        t = np.array(self._t[-self.window:])
+        T = np.array(self._T[-self.window:])
+        t = t - t[0] # time from the oldest sample of the window, so the basis stays within (0, 1]
+        T_inf, A, rss, last = self._solve(t, T, self._taus)
+        k = int(np.argmin(rss))
+        if not np.isfinite(rss[k]):
+            # Flat readings: nothing to fit
+            return T.mean(), 0.0, T.mean(), 0.0, 0.0
+        # The asymptote is sensitive to tau: refine between the neighbours of the best grid point
+        taus = np.geomspace(self._taus[max(k-1, 0)], self._taus[min(k+1, len(self._taus)-1)], 33)
+        T_inf, A, rss, last = self._solve(t, T, taus)
+        k = int(np.argmin(rss))
+        decay = A[k] * last[k] # A * exp(-t/tau) at the latest sample
+        T_now = T_inf[k] + decay
+        slope = -decay / taus[k]
+        return T_inf[k], taus[k], T_now, slope, np.sqrt(rss[k]/len(t))
+
+    def add(self, t, temp):
+        # Add a reading (s since the set point change, oC). Returns True when done.
+        self._t.append(t)
+        self._T.append(temp)
+        if len(self._t) >= self.minSamples:
+            self.T_inf, self.tau, self.T_now, self.slope, self.residual = self._fit()
+            goodFit = self.residual <= self.tolerance
+            inBand = abs(self.T_now - self.setpoint) <= self.tolerance
+            # A first-order response is monotonic: once the fitted temperature is in the band
+            # and its asymptote is in the band too, it stays there
+            if goodFit and inBand and abs(self.T_inf - self.setpoint) <= self.tolerance:
+                self.settled, self.reason = True, "settled"
+            elif goodFit and self._stalling():
+                self._stallSince = t if self._stallSince is None else self._stallSince
+                if self._stallRefits >= self.stallRefits and t - self._stallSince >= self.stallTaus*self.tau:
+                    self.reason = "stalled"
+                self._stallRefits += 1
+            else:
+                self._stallSince, self._stallRefits = None, 0
+        if self.reason is None and t > self.timeout:
+            self.reason = "timeout"
+        return self.reason is not None
+
+    def _stalling(self):
+        # The motion left in the fitted response (|slope|*tau) cannot close the distance to the band,
+        # and the latest readings are out of the band as well
+        distance = abs(self.T_now - self.setpoint) - self.tolerance
+        return distance > 0 and abs(self.slope)*self.tau < distance \
+            and abs(self.T_inf - self.setpoint) > self.tolerance \
+            and all(abs(T - self.setpoint) > self.tolerance for T in self._T[-self.minSamples:])
+
+    def remaining(self):
+        # Predicted time (s) until the fitted temperature enters the tolerance band
+        if self.tau is None or not np.isfinite(self.tau): return None
+        if abs(self.T_inf - self.setpoint) > self.tolerance: return None
+        T_now = self._T[-1]
+        gap = abs(T_now - self.T_inf)
+        margin = self.tolerance - abs(self.T_inf - self.setpoint)
+        if gap <= margin: return 0.0
+        return self.tau * np.log(gap / margin)
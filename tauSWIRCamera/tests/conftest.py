@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The modules of tauSWIRCamera import each other by their flat names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tau_emulator import tauEmulator
+
+
+@pytest.fixture
+def emulator():
+    # TEC time constant of 0.5s and no temperature offset, so settles take a couple of seconds
+    return tauEmulator(tecTau=0.5, ambientTemp=20.0, seed=0)
+
+@pytest.fixture
+def cam(emulator):
+    from tauSWIRcamera import tauSWIRcamera
+    return tauSWIRcamera("127.0.0.1", 0, cacheRegisters=True, transport=emulator)
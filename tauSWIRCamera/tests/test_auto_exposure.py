@@ -0,0 +1,49 @@
+import numpy as np
+
+import auto_exposure
+from auto_exposure import autoExposure
+
+
+class clock(object):
+    # Stands in for time.time in auto_exposure, advanced by the test
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_queued_frames_are_drained_after_a_change(cam, monkeypatch):
+    now = clock()
+    monkeypatch.setattr(auto_exposure.time, "time", now)
+    cam.configure(fps=30, gain="high", int_time_ms=1.0)
+    ae = autoExposure(cam, framesPerUpdate=1, settleFrames=2)
+    period = 1 / cam.fps
+    dark = np.full((512, 640), 1500, np.uint16)
+    assert ae.update(dark)
+    assert cam.intTime_ms > 1.0
+    # Frames queued before the change arrive back to back and are all skipped
+    for _ in range(20):
+        now.now += 0.01 * period
+        assert not ae.update(dark) and ae.fenced
+    # Then the first live frames, exposed while the change took effect
+    for _ in range(2):
+        now.now += period
+        assert not ae.update(dark) and ae.fenced
+    now.now += period
+    ae.update(dark)
+    assert not ae.fenced
+    assert len(ae.history) == 2
+
+
+def test_drain_is_bounded(cam, monkeypatch):
+    now = clock()
+    monkeypatch.setattr(auto_exposure.time, "time", now)
+    cam.configure(fps=30, gain="high", int_time_ms=1.0)
+    ae = autoExposure(cam, framesPerUpdate=1, settleFrames=0, maxDrainFrames=5)
+    dark = np.full((512, 640), 1500, np.uint16)
+    assert ae.update(dark)
+    fenced = 0
+    while ae.update(dark) is False and ae.fenced:
+        fenced += 1
+    assert fenced == 5
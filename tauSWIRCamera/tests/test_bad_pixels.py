@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from bad_pixels import neighbourTable, repairFrame
+from frame_correction import frameCorrector
+
+
+def test_neighbours_are_closest_good_pixels():
+    mask = np.zeros((5, 5), dtype=bool)
+    mask[2, 2] = True
+    badIndex, table = neighbourTable(mask)
+    assert badIndex.tolist() == [12]
+    assert sorted(table[0].tolist()) == [6, 7, 8, 11, 13, 16, 17, 18]
+
+def test_cluster_in_corner_gets_enough_neighbours():
+    mask = np.zeros((6, 6), dtype=bool)
+    mask[:3, :3] = True
+    badIndex, table = neighbourTable(mask, nNeighbours=8)
+    assert len(badIndex) == 9
+    assert not mask.reshape(-1)[table].any()
+    frame = np.arange(36, dtype=np.float32).reshape(6, 6)
+    assert np.isfinite(repairFrame(frame.copy(), badIndex, table)).all()
+
+def test_too_few_good_pixels_raises():
+    with pytest.raises(ValueError, match="Too few good pixels"):
+        neighbourTable(np.ones((3, 3), dtype=bool))
+    mask = np.ones((3, 3), dtype=bool)
+    mask[0, 0] = False
+    with pytest.raises(ValueError):
+        neighbourTable(mask, nNeighbours=2)
+    # All dead (e.g. classified from an all-zero std frame): fails instead of hanging
+    with pytest.raises(ValueError):
+        frameCorrector(np.zeros((3, 3)), badPixels=np.ones((3, 3), dtype=np.uint8))
+
+def test_no_bad_pixels():
+    badIndex, table = neighbourTable(np.zeros((4, 4), dtype=bool))
+    assert badIndex.shape == (0,) and table.shape == (0, 8)
@@ -0,0 +1,55 @@
+import numpy as np
+from tifffile import imwrite
+
+from calibration_store import calibrationStore, importCalibrationTree
+from stack_batch import derivedNames, processArchive
+
+stackName = "CAM1_stack_4images_highgain_FPA_at20C_expTime_5.0ms.tif"
+
+def _stack(path, level):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    imwrite(str(path), np.full((4, 8, 10), level, dtype=np.uint16), photometric='minisblack')
+
+def test_mixed_dark_and_flat_tree(tmp_path):
+    # Dark and flat stacks with the same settings and file name
+    tree = tmp_path / "tree"
+    _stack(tree / "dark_frame" / "CAM1" / "30fps" / stackName, 1000)
+    _stack(tree / "flat_frame" / "CAM1" / "30fps" / stackName, 9000)
+    done = processArchive(str(tree), workers=1)
+    assert len(done) == 2
+    names = sorted(name for _, outputs in done for name in outputs)
+    assert sum("_dark_frame_" in name for name in names) == 2 and sum("_flat_frame_" in name for name in names) == 2
+
+    store = calibrationStore(str(tmp_path / "store"))
+    importCalibrationTree(store, str(tree))
+    assert store.get("CAM1", "dark_mean", "high", 20, 30, 5.0).mean() == 1000
+    assert store.get("CAM1", "dark_std", "high", 20, 30, 5.0).max() == 0
+    assert store.get("CAM1", "flat_mean", "high", 20, 30, 5.0).mean() == 9000
+    # (9000 - 1000) everywhere: a gain of 1
+    assert np.allclose(store.get("CAM1", "flat_gain", "high", 20, 30, 5.0), 1)
+
+def test_dark_names_under_flat_folder_are_ignored(tmp_path):
+    tree = tmp_path / "tree"
+    folder = tree / "flat_frame" / "CAM1" / "30fps"
+    folder.mkdir(parents=True)
+    imwrite(str(folder / "CAM1_mean_dark_frame_from4images_highgain_20C_expTime_5.0ms.tif"), np.full((8, 10), 9000.0))
+    store = calibrationStore(str(tmp_path / "store"))
+    importCalibrationTree(store, str(tree))
+    assert len(store) == 0
+
+def test_derived_names():
+    assert derivedNames("/data/dark/CAM1/30fps/" + stackName, "/data")[0].endswith(
+        "CAM1_mean_dark_frame_from4images_highgain_20C_expTime_5.0ms.tif")
+    assert derivedNames("/data/flat_frame/CAM1/30fps/" + stackName, "/data")[1].endswith(
+        "CAM1_std_flat_frame_from4images_highgain_20C_expTime_5.0ms.tif")
+    assert derivedNames("/data/dark/other.tif") is None
+
+
+def test_put_keeps_earlier_memmaps(tmp_path):
+    store = calibrationStore(str(tmp_path / "store"))
+    store.put("CAM1", "dark_mean", "high", 20, None, 1.0, np.full((4, 4), 100, np.float32))
+    old = store.get("CAM1", "dark_mean", "high", 20, intTime_ms=1.0)
+    store.put("CAM1", "dark_mean", "high", 20, None, 1.0, np.full((4, 4), 200, np.float32))
+    assert np.all(old == 100)
+    assert np.all(store.get("CAM1", "dark_mean", "high", 20, intTime_ms=1.0) == 200)
+    assert not list((tmp_path / "store" / "arrays").glob("*.tmp"))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from calibration_store import calibrationStore
+from data_path_benchmark import _resetFrames, _serveStream, cameraGeometry, loki_cameras, syntheticStream
+from frame_correction import frameCorrector
+from tau_emulator import tauEmulator
+
+
+@pytest.fixture
+def streamingCam(tmp_path):
+    # Camera on the emulated control channel, with a local server streaming synthetic SWIR frames
+    from tauSWIRcamera import tauSWIRcamera
+    stream, _ = syntheticStream(loki_cameras.swir, 4)
+    port, stop = _serveStream(stream)
+    _resetFrames()
+    cam = tauSWIRcamera("127.0.0.1", port, cacheRegisters=True, transport=tauEmulator(ambientTemp=20.0, seed=0))
+    cam.configure(fps=30, gain="high", int_time_ms=1.0)
+    yield cam
+    stop()
+
+@pytest.fixture
+def store(tmp_path):
+    width, height, _ = cameraGeometry[loki_cameras.swir]
+    store = calibrationStore(str(tmp_path / "store"))
+    for t_ms in (1.0, 2.0):
+        store.put("CAM1", "dark_mean", "high", 20, None, t_ms, np.full((height, width), 100*t_ms, dtype=np.float32))
+    return store
+
+def test_matches():
+    corrector = frameCorrector(np.zeros((2, 2)), settings={"gain": "high", "int_time_ms": 5.0, "fpa_temp": 20, "fps": None})
+    assert corrector.matches("high", 5.05, 20, 30)
+    assert not corrector.matches("high", 6.0, 20, 30)
+    assert not corrector.matches("low", 5.0, 20, 30)
+    assert not corrector.matches("high", 5.0, 40, 30)
+    assert frameCorrector(np.zeros((2, 2))).matches("low", 1.0, 0)
+
+def test_collect_frame_rebuilds_stale_correction(streamingCam, store):
+    cam = streamingCam
+    corrector = frameCorrector.fromStore(store, "CAM1", "high", 20, intTime_ms=1.0)
+    cam.setFrameCorrection(corrector)
+    assert cam._currentFrameCorrection() is corrector
+    cam.setIntTime(2.0)
+    frames = cam.collectFrame(2)
+    assert cam._frameCorrection is not corrector
+    assert cam._frameCorrection.settings["int_time_ms"] == pytest.approx(2.0, rel=0.01)
+    assert cam._frameCorrection.offset.mean() == 200
+    assert frames.dtype == np.float32 and frames.shape == (2,) + corrector.shape
+
+def test_stale_correction_without_store_raises(streamingCam):
+    cam = streamingCam
+    width, height, _ = cameraGeometry[loki_cameras.swir]
+    settings = {"gain": "high", "int_time_ms": 1.0, "fpa_temp": 20, "fps": None}
+    cam.setFrameCorrection(frameCorrector(np.zeros((height, width)), settings=settings))
+    cam.setSensorGain("low")
+    with pytest.raises(Exception, match="does not match"):
+        cam.collectFrame(2)
+    assert cam._frameCorrection is None
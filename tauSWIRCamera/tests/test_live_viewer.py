@@ -0,0 +1,68 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+pytest.importorskip("pyqtgraph")
+
+from live_viewer import displayLUT, frameSession, liveViewer
+
+
+class fakeCamera(object):
+    # Streams a fixed list of frames as fast as they are read, then waits until closed
+    def __init__(self, frames):
+        self.frames = frames
+        self.done = threading.Event()
+        self.closed = threading.Event()
+
+    def iterFrames(self, numFrames=None):
+        try:
+            yield from self.frames
+            self.done.set()
+            self.closed.wait(5)
+        finally:
+            self.closed.set()
+
+def _frames(n=50):
+    rng = np.random.default_rng(0)
+    return [rng.integers(1000, 9000, (64, 80), dtype=np.uint16) for _ in range(n)]
+
+def test_session_keeps_only_latest_frame():
+    frames = _frames()
+    cam = fakeCamera(frames)
+    session = frameSession(cam).start()
+    assert cam.done.wait(5)
+    frame = session.latest()
+    assert frame is frames[-1]
+    assert (session.received, session.displayed, session.dropped) == (50, 1, 49)
+    assert session.latest() is None
+    cam.closed.set()
+    session.stop()
+    assert not session.running
+    assert session.error is None
+
+def test_lut_levels_from_percentiles():
+    lut = displayLUT(low=0, high=100, step=1)
+    frame = np.array([[1000, 5000], [3000, 9000]], dtype=np.uint16)
+    lut.autoContrast(frame)
+    assert lut.levels == (1000, 9000)
+    assert lut.apply(frame).tolist() == [[0, 127], [63, 255]]
+
+def test_viewer_draws_offscreen():
+    frames = _frames(5)
+    cam = fakeCamera(frames)
+    viewer = liveViewer(frameSession(cam), overlayInterval=0)
+    try:
+        viewer.start()
+        assert cam.done.wait(5)
+        viewer.update()
+        image = viewer.grab()
+        assert not image.isNull() and image.width() > 0 and image.height() > 0
+        assert viewer.image.image.dtype == np.uint8 and viewer.image.image.shape == (64, 80)
+        assert "dropped 4" in viewer.overlay.toPlainText()
+    finally:
+        cam.closed.set()
+        viewer.stop()
+        viewer.window.close()
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from pixel_major import pixelMajorStack, transposeStack
+
+
+def test_non_square_tiles(tmp_path):
+    stack = np.arange(5*64*96, dtype=np.uint16).reshape(5, 64, 96)
+    path = str(tmp_path / "stack_pixel_major.npy")
+    assert transposeStack(stack, path, tile=(16, 32), memoryBudget_MB=0.01).tile == (16, 32)
+    store = pixelMajorStack(path, tile=(16, 32))
+    assert (store.tilesY, store.tilesX, store.shape) == (4, 3, (64, 96))
+    for row, col in [(0, 0), (17, 40), (63, 95)]:
+        assert np.array_equal(store.pixel(row, col), stack[:, row, col])
+    tiles = store.data[..., 0].reshape(4, 3, 16*32)
+    assert np.array_equal(store.toMap(tiles), stack[0])
+    with pytest.raises(Exception):
+        pixelMajorStack(path, tile=(32, 32))
@@ -0,0 +1,167 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from calibration_sweep import calibrationSweep, defaultTransitionCosts, planSweep
+from tau_commands import commands, gainModes, parse_tau_reply
+from tau_emulator import _tau_packet, format_tau_reply
+from tec_settle import tecSettleEngine
+
+
+### REPLY DECODING ###
+
+def test_parse_tau_reply_roundtrip():
+    packet = _tau_packet(0x20, (-123).to_bytes(2, byteorder='big', signed=True))
+    text = "Sending command...\n" + format_tau_reply(packet)
+    assert parse_tau_reply(text) == packet
+    assert commands["get-FPA-temp"].decodeResponse(text) == -12.3
+
+def test_parse_tau_reply_uses_last_response():
+    first = format_tau_reply(_tau_packet(0x04, bytes(8)))
+    last = _tau_packet(0x04, bytes([0, 0, 0x29, 0xBA]) + bytes(4))
+    assert parse_tau_reply(first + format_tau_reply(last)) == last
+    assert commands["get-serial-number"].decodeResponse(first + format_tau_reply(last)) == 10682
+
+def test_parse_tau_reply_without_response():
+    assert parse_tau_reply("Error: timeout waiting for response from Tau\n") == b""
+    with pytest.raises(Exception, match="Short reply"):
+        commands["get-FPA-temp"].decodeResponse("Error: timeout waiting for response from Tau\n")
+
+
+### CONFIGURATION AND REGISTER CACHE ###
+
+def test_configure_writes_registers(cam, emulator):
+    actual = cam.configure(fps=30, gain="high", int_time_ms=5.0, priority="Integration")
+    assert actual["fps"] == 30 and actual["gain"] == "high"
+    assert actual["int_time_ms"] == pytest.approx(5.0, rel=0.02)
+    assert emulator.registers["gain"] == gainModes["high"]
+    assert (cam.fps, cam.gainMode) == (30, "high")
+
+def test_configure_skips_cached_values(cam, emulator):
+    cam.configure(fps=30, gain="high", int_time_ms=5.0)
+    roundTrips = emulator.nRoundTrips
+    cam.configure(gain="high", int_time_ms=5.0)
+    assert emulator.nRoundTrips == roundTrips
+    assert cam.getSensorGain() == "high" and emulator.nRoundTrips == roundTrips
+
+def test_fps_change_invalidates_gain(cam, emulator):
+    cam.configure(fps=30, gain="high")
+    cam.configure(fps=60)
+    # The emulated camera is back in low gain after the FPS change: the cache must not hide it
+    assert emulator.registers["gain"] == gainModes["low"]
+    assert cam.getSensorGain() == "low"
+    roundTrips = emulator.nRoundTrips
+    cam.configure(fps=60, gain="high")
+    assert emulator.nRoundTrips > roundTrips
+    assert emulator.registers["gain"] == gainModes["high"]
+
+def test_refresh_drops_stale_cache(cam, emulator):
+    cam.configure(gain="high")
+    emulator.registers["gain"] = gainModes["medium"] # changed behind the driver's back
+    assert cam.getSensorGain() == "high"
+    assert cam.refresh()["gain"] == "medium"
+    assert cam.getSensorGain() == "medium"
+
+
+### TEC SETTLE ###
+
+def _trace(engine, curve, dt=0.25, tMax=600):
+    t = 0.0
+    rng = np.random.default_rng(0)
+    while not engine.add(t, round(curve(t) + rng.normal(0, 0.03), 1)):
+        t += dt
+        assert t < tMax
+    return t
+
+def test_settle_engine_settles_when_the_fit_enters_the_band():
+    for tau in (8, 60):
+        engine = tecSettleEngine(40, timeout=1e3)
+        t = _trace(engine, lambda t: 40 - 20*np.exp(-t/tau))
+        assert engine.reason == "settled" and engine.settled
+        # Within a couple of polls of the true curve entering the band
+        assert t == pytest.approx(tau*np.log(20/0.2), abs=3)
+
+def test_settle_engine_reports_stall():
+    engine = tecSettleEngine(40, timeout=1e3)
+    _trace(engine, lambda t: 38 - 18*np.exp(-t/8))
+    assert engine.reason == "stalled" and not engine.settled
+    assert engine.T_inf == pytest.approx(38, abs=0.2)
+
+def test_settle_engine_times_out():
+    engine = tecSettleEngine(40, timeout=5)
+    _trace(engine, lambda t: 20 + 0.5*t)
+    assert engine.reason == "timeout" and not engine.settled
+
+def test_camera_settle(cam):
+    time_values, temp_values = cam.setFPATempSetPoint(2, pollInterval=0.05)
+    assert abs(temp_values[-1] - 40) <= 0.3
+    assert cam.fpaTempSetPoint == 40
+
+def test_camera_async_settle(cam):
+    time_values, temp_values = asyncio.run(cam.asetFPATempSetPoint(0, pollInterval=0.05))
+    assert abs(temp_values[-1]) <= 0.3
+    assert cam.fpaTempSetPoint == 0
+
+
+### SWEEP CHECKPOINT ###
+
+grid = {"fpa_temp": [20], "fps": [30, 60], "gain": ["low", "high"], "int_time_ms": [1.0, 2.0, 3.0]}
+
+def test_sweep_resumes_from_checkpoint(cam, emulator, tmp_path):
+    checkpoint = str(tmp_path / "sweep.json")
+    done = []
+    def action(cam, point):
+        if len(done) == 5: raise KeyboardInterrupt
+        done.append((point["fps"], emulator.registers["gain"], point["gain"]))
+    sweep = calibrationSweep(cam, grid, action, checkpoint)
+    with pytest.raises(KeyboardInterrupt):
+        sweep.run()
+    assert len(sweep.completed) == 5
+    with open(checkpoint) as f:
+        learned = json.load(f)["costs"]
+    assert learned != defaultTransitionCosts # measured durations were learned
+
+    resumed = calibrationSweep(cam, grid, lambda cam, point: done.append((point["fps"], emulator.registers["gain"], point["gain"])), checkpoint)
+    assert resumed.costs == learned
+    assert len(resumed.remainingPoints) == len(planSweep(grid)) - 5
+    resumed.run()
+    assert len(done) == len(planSweep(grid)) == 12
+    # Every point ran once, with the gain register it asked for
+    assert all(register == gainModes[gain] for _, register, gain in done)
+
+def test_sweep_rejects_other_grid(cam, tmp_path):
+    checkpoint = str(tmp_path / "sweep.json")
+    sweep = calibrationSweep(cam, grid, lambda cam, point: None, checkpoint)
+    sweep.completed.add("x")
+    sweep._saveCheckpoint()
+    with pytest.raises(Exception, match="different grid"):
+        calibrationSweep(cam, dict(grid, fps=[30]), lambda cam, point: None, checkpoint)
+
+def test_sweep_validates_grid(cam, tmp_path):
+    with pytest.raises(Exception, match="FPA temperature"):
+        calibrationSweep(cam, dict(grid, fpa_temp=[20, 25]), None, str(tmp_path / "sweep.json"))
+
+def test_sweep_skips_points_when_tec_does_not_settle(cam, emulator, tmp_path):
+    checkpoint = str(tmp_path / "sweep.json")
+    settle = cam._settleFPATemp
+    # Short timeout, and a TEC that cannot reach 40oC
+    cam._settleFPATemp = lambda n, tolerance, timeout, pollInterval, verbose=False: settle(n, tolerance, 1.0, 0.05, verbose)
+    emulator.tecTau = 1e6
+    done = []
+    sweep = calibrationSweep(cam, dict(grid, fpa_temp=[20, 40]), lambda cam, point: done.append(point), checkpoint, startTemp=20)
+    skipped = sweep.run()
+    assert len(skipped) == 12 and all(point["fpa_temp"] == 40 for point in skipped)
+    assert len(done) == 12 and all(point["fpa_temp"] == 20 for point in done)
+    with open(checkpoint) as f:
+        state = json.load(f)
+    assert len(state["completed"]) == 12
+    assert [(s["fpa_temp"], s["results"]["CAM1"]) for s in state["settles"]] == [(20, "settled"), (40, "timeout")]
+    # The next run retries only the skipped points
+    emulator.tecTau = 0.5
+    cam._settleFPATemp = settle
+    resumed = calibrationSweep(cam, dict(grid, fpa_temp=[20, 40]), lambda cam, point: done.append(point), checkpoint, startTemp=20)
+    assert resumed.remainingPoints == skipped
+    assert resumed.run() == []
+    assert len(done) == 24